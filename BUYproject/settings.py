@@ -226,6 +226,15 @@ LOGGING = {
     },
 }
 
+# 操作日志配置，OPERATE_LOG_ASYNC为True时操作日志先缓冲在进程内，
+# 每积累OPERATE_LOG_BATCH_SIZE条或每隔OPERATE_LOG_FLUSH_INTERVAL毫秒批量写入一次，为False时同步写入
+OPERATE_LOG_ASYNC = True
+OPERATE_LOG_BATCH_SIZE = 100
+OPERATE_LOG_FLUSH_INTERVAL = 500
+
+# 带有Idempotency-Key的请求处理中标记的保存时间（秒），需不短于最慢请求的处理时间
+IDEMPOTENCY_IN_PROGRESS_TTL = 60 * 30
+
 # jwt配置
 SIMPLE_JWT = {
     # token有效时长
@@ -0,0 +1,76 @@
+import datetime
+import hashlib
+
+from django.core.cache import cache
+from django.db import transaction
+
+# 商品目录缓存的版本号，商品、类别或生效价格变化时加1，旧版本的缓存随之失效
+VERSION_KEY = 'catalogue:version'
+# 命中与未命中次数
+HITS_KEY = 'catalogue:hits'
+MISSES_KEY = 'catalogue:misses'
+# 缓存有效期（秒）
+CATALOGUE_TTL = 60 * 10
+
+
+def _incr(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # 键不存在时从1开始计数，并发时由add保证只有一个请求初始化成功
+        if cache.add(key, 1, None):
+            return 1
+        return cache.incr(key)
+
+
+def get_catalogue_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, None)
+        version = cache.get(VERSION_KEY, 1)
+    return version
+
+
+def bump_catalogue_version():
+    """
+    使商品目录缓存失效，在事务中调用时等到事务提交后再失效，避免其他请求缓存未提交前的数据
+    """
+    transaction.on_commit(lambda: _incr(VERSION_KEY))
+
+
+def catalogue_cache_key(name, request):
+    """
+    缓存键包含版本号、用户角色、排序后的查询参数、域名和日期。
+    不同角色可见的商品不同，图片地址包含域名，价格随日期变化
+    """
+    params = '&'.join(f'{k}={v}' for k in sorted(request.query_params) for v in request.query_params.getlist(k))
+    raw = f'{request.user.role}|{params}|{request.get_host()}|{datetime.date.today()}'
+    digest = hashlib.md5(raw.encode('utf-8')).hexdigest()
+    return f'catalogue:{get_catalogue_version()}:{name}:{digest}'
+
+
+def cached_catalogue(name, request, build):
+    """
+    读取缓存的目录数据，未命中时调用build生成并写入缓存
+    """
+    key = catalogue_cache_key(name, request)
+    data = cache.get(key)
+    if data is not None:
+        _incr(HITS_KEY)
+        return data
+    _incr(MISSES_KEY)
+    data = build()
+    cache.set(key, data, CATALOGUE_TTL)
+    return data
+
+
+def get_catalogue_stats():
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        "version": get_catalogue_version(),
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / total, 4) if total else None
+    }
@@ -0,0 +1,312 @@
+import datetime
+import os
+from decimal import Decimal, InvalidOperation
+
+import openpyxl
+from django.conf import settings
+from django.db import transaction
+
+from .models import CategoryModel, GoodsModel, PriceCycleModel, PriceModel, UploadJobModel
+from .cache import bump_catalogue_version
+from .prices import refresh_effective_prices
+from utils.logger import log_operate
+
+# 批量写入时每批的行数
+BATCH_SIZE = 500
+
+# 每处理多少行汇报一次进度
+PROGRESS_ROWS = 200
+
+# 报价表格中去掉序号后的列名
+SHEET_COLUMNS = ['brand', 'name', 'description', 'price_check_1', 'price_check_2', 'price_check_avg', 'price_down5', 'price']
+
+# 报价更新时需要写回的字段
+PRICE_UPDATE_FIELDS = ['price', 'price_check_1', 'price_check_2', 'price_check_avg', 'status', 'reviewer_id', 'review_time']
+
+
+def _is_null(value):
+    return value is None or (isinstance(value, float) and value != value)
+
+
+def _to_text(value):
+    if _is_null(value):
+        return None
+    return str(value).strip()
+
+
+def _to_price(value, allow_null=True):
+    """
+    将表格中的价格转换为保留两位小数的Decimal，无法转换时抛出ValueError
+    """
+    if _is_null(value):
+        if allow_null:
+            return None
+        raise ValueError
+    try:
+        price = Decimal(str(value)).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise ValueError
+    # 与模型 max_digits=10, decimal_places=2 保持一致
+    if price.adjusted() >= 8:
+        raise ValueError
+    return price
+
+
+def read_price_sheets(f):
+    """
+    以只读模式打开报价表格，返回逐张工作簿的 (类别名, 行数据) 生成器。
+    工作簿名不含“类”的工作簿不读取其单元格，行数据逐行读取，内存占用不随表格大小增长。
+    """
+    workbook = openpyxl.load_workbook(f, read_only=True, data_only=True)
+    return _iter_sheets(workbook)
+
+
+def _iter_sheets(workbook):
+    try:
+        for sheet_name in workbook.sheetnames:
+            # 如果工作簿名不含“类”，则不是商品列表，跳过
+            if '类' not in sheet_name:
+                continue
+            yield sheet_name.strip(), _iter_rows(workbook[sheet_name])
+    finally:
+        workbook.close()
+
+
+def _iter_rows(worksheet):
+    # 前两行为标题，第三行为表头，从第四行开始为商品数据
+    for values in worksheet.iter_rows(min_row=4, max_col=len(SHEET_COLUMNS) + 1, values_only=True):
+        # 去掉序号列和下浮5%列
+        row = dict(zip(SHEET_COLUMNS, values[1:]))
+        row.pop('price_down5', None)
+        # 遇到商品数据全为空的行表示表格数据结束，只有序号的空行同样结束
+        if all(_is_null(v) for v in row.values()):
+            break
+        for field in ['price_check_1', 'price_check_2', 'price_check_avg', 'price']:
+            if isinstance(row.get(field), float):
+                row[field] = round(row[field], 2)
+        yield row
+
+
+class PriceSheetImporter:
+    """
+    报价表格导入引擎。
+    一次性读取已有商品和所选周期的价格，在内存中比对表格数据，最后在一个事务中批量写入。
+    """
+
+    def __init__(self, cycle, user_id, on_progress=None):
+        self.cycle = cycle
+        self.user_id = user_id
+        self.on_progress = on_progress
+
+        # 错误信息，保存修改或添加失败的商品信息
+        self.errs = {
+            "edit": [],
+            "add": []
+        }
+        # 已处理的行数
+        self.processed = 0
+
+        # 已存在的商品，以(商品名, 规格, 品牌)为键
+        self.goods = {
+            (goods.name, goods.description, goods.brand): goods
+            for goods in GoodsModel.objects.only('id', 'name', 'description', 'brand', 'category_id')
+        }
+        # 所选周期已存在的价格，以商品ID为键
+        self.prices = {price.product_id: price for price in PriceModel.objects.filter(cycle=cycle)}
+
+        # 待修改报价的商品和待添加的商品，同一商品在表格中出现多次时以最后一次为准
+        self._edit = {}
+        self._add = {}
+
+    def feed(self, category_name, rows):
+        """
+        比对一张工作簿的数据，类别不存在时创建类别
+        """
+        category_obj, created = CategoryModel.objects.get_or_create(name=category_name)
+        if created:
+            bump_catalogue_version()
+        for row in rows:
+            self.feed_row(category_obj.id, row)
+            if self.on_progress and self.processed % PROGRESS_ROWS == 0:
+                self.on_progress(self)
+
+    def feed_row(self, category_id, row):
+        self.processed += 1
+        row_dict = dict(row)
+        row_dict['category'] = category_id
+        row_dict['brand'] = _to_text(row_dict.get('brand'))
+        row_dict['name'] = _to_text(row_dict.get('name'))
+        row_dict['description'] = _to_text(row_dict.get('description'))
+        key = (row_dict['name'], row_dict['description'], row_dict['brand'])
+
+        # 如果商品及其规格存在的话，则修改并更新报价，否则作为新的商品添加
+        err_type = 'edit' if key in self.goods else 'add'
+        try:
+            data = self._clean(row_dict)
+        except ValueError:
+            self.errs[err_type].append(row_dict)
+            return
+
+        if err_type == 'edit':
+            self._edit[key] = data
+        else:
+            self._add[key] = data
+
+    def _clean(self, row_dict):
+        """
+        校验一行数据，规则与 GoodsModelSerializer 一致
+        """
+        for field in ['name', 'description']:
+            if not row_dict[field] or len(row_dict[field]) > 100:
+                raise ValueError
+        if row_dict['brand'] is not None and len(row_dict['brand']) > 100:
+            raise ValueError
+        data = {
+            'name': row_dict['name'],
+            'description': row_dict['description'],
+            'brand': row_dict['brand'],
+            'category_id': row_dict['category'],
+            'price': _to_price(row_dict.get('price'), allow_null=False),
+            'price_check_1': _to_price(row_dict.get('price_check_1')),
+            'price_check_2': _to_price(row_dict.get('price_check_2')),
+            'price_check_avg': _to_price(row_dict.get('price_check_avg'), allow_null=False),
+        }
+        # 错误报告中与原表格数据保持一致
+        data['row'] = row_dict
+        return data
+
+    def commit(self):
+        """
+        在一个事务中批量写入商品和价格，返回错误信息
+        """
+        now_time = datetime.datetime.now()
+        goods_update = []
+        price_update = []
+        price_create = []
+
+        with transaction.atomic():
+            # 修改已存在的商品，并更新所选周期的报价，状态设为2（已审核）
+            for key, data in self._edit.items():
+                product_obj = self.goods[key]
+                product_obj.category_id = data['category_id']
+                product_obj.update_at = now_time
+                goods_update.append(product_obj)
+
+                price_obj = self.prices.get(product_obj.id)
+                if price_obj is None:
+                    price_create.append(self._new_price(product_obj, data, self.cycle, now_time, approved=True))
+                    continue
+                price_obj.price = data['price']
+                price_obj.price_check_1 = data['price_check_1']
+                price_obj.price_check_2 = data['price_check_2']
+                price_obj.price_check_avg = data['price_check_avg']
+                price_obj.status = 2
+                price_obj.reviewer_id = self.user_id
+                price_obj.review_time = now_time
+                price_update.append(price_obj)
+
+            if self._add:
+                price_create.extend(self._create_goods(now_time))
+
+            GoodsModel.objects.bulk_update(goods_update, ['category', 'update_at'], batch_size=BATCH_SIZE)
+            PriceModel.objects.bulk_update(price_update, PRICE_UPDATE_FIELDS, batch_size=BATCH_SIZE)
+            PriceModel.objects.bulk_create(price_create, batch_size=BATCH_SIZE)
+            # 导入的价格均为已审核状态，刷新所选周期的生效价格
+            refresh_effective_prices(cycle_ids=[self.cycle.id])
+
+        return self.errs
+
+    def _create_goods(self, now_time):
+        """
+        批量添加新商品，为每个可用的价格周期生成价格对象。
+        所选周期的价格状态为2（已审核），其他周期的价格状态为0（未申报）
+        """
+        cycles = list(PriceCycleModel.objects.filter(end_date__gte=now_time, status=True))
+        if not cycles:
+            self.errs['add'].extend(data['row'] for data in self._add.values())
+            return []
+
+        new_goods = [
+            GoodsModel(name=data['name'], description=data['description'], brand=data['brand'], category_id=data['category_id'])
+            for data in self._add.values()
+        ]
+        GoodsModel.objects.bulk_create(new_goods, batch_size=BATCH_SIZE)
+
+        # MySQL批量插入不会返回主键，需要重新查询新增的商品
+        if any(goods.pk is None for goods in new_goods):
+            names = sorted({goods.name for goods in new_goods})
+            created = {}
+            for i in range(0, len(names), BATCH_SIZE):
+                queryset = GoodsModel.objects.filter(name__in=names[i:i + BATCH_SIZE]).only('id', 'name', 'description', 'brand').order_by('id')
+                for goods in queryset:
+                    created[(goods.name, goods.description, goods.brand)] = goods
+            new_goods = [created[key] for key in self._add]
+
+        price_create = []
+        for product_obj, data in zip(new_goods, self._add.values()):
+            for cycle in cycles:
+                price_create.append(self._new_price(product_obj, data, cycle, now_time, approved=cycle.id == self.cycle.id))
+        return price_create
+
+    def _new_price(self, product_obj, data, cycle, now_time, approved):
+        price_obj = PriceModel(product=product_obj, price=data['price'], price_check_1=data['price_check_1'],
+                               price_check_2=data['price_check_2'], price_check_avg=data['price_check_avg'],
+                               cycle=cycle, start_date=cycle.start_date, end_date=cycle.end_date, status=0)
+        if approved:
+            price_obj.status = 2
+            price_obj.creater_id = self.user_id
+            price_obj.create_time = now_time
+            price_obj.reviewer_id = self.user_id
+            price_obj.review_time = now_time
+        return price_obj
+
+
+def run_upload_job(job):
+    """
+    执行一个报价表格导入任务，处理过程中更新任务的已处理行数和失败行数
+    """
+    def on_progress(importer):
+        UploadJobModel.objects.filter(id=job.id).update(processed_rows=importer.processed,
+                                                        err_num=len(importer.errs['edit']) + len(importer.errs['add']))
+
+    try:
+        sheets = read_price_sheets(os.path.join(settings.MEDIA_ROOT, job.file))
+    except:
+        sheets = None
+        job.status = "-1"
+        job.msg = "文件格式错误，请传入xlsx文件"
+
+    if sheets is not None:
+        importer = None
+        try:
+            importer = PriceSheetImporter(job.cycle, job.creater_id, on_progress=on_progress)
+            # 逐行读取表格时出错或比对时数据库出错，同样视为任务失败
+            for category_name, rows in sheets:
+                importer.feed(category_name, rows)
+            errs = importer.commit()
+        except:
+            sheets.close()
+            job.status = "-1"
+            job.msg = "商品添加/报价修改失败，请检查表格数据"
+        else:
+            job.status = "2"
+            job.errs = errs
+            job.msg = "部分商品添加失败或报价修改失败" if errs['add'] or errs['edit'] else "商品添加成功/报价修改成功"
+            # 记录操作日志
+            log_operate(job.creater_id, f"上传价格表格{job.file_name}")
+        if importer is not None:
+            job.processed_rows = importer.processed
+            job.err_num = len(importer.errs['edit']) + len(importer.errs['add'])
+
+    job.finish_time = datetime.datetime.now()
+    try:
+        with transaction.atomic():
+            job.save()
+    except:
+        # 保存失败信息出错时仍将任务标记为失败，避免任务一直处于处理中
+        job.status = "-1"
+        job.errs = None
+        job.msg = "保存导入结果失败，请重新上传"
+        UploadJobModel.objects.filter(id=job.id).update(status=job.status, errs=job.errs, msg=job.msg, processed_rows=job.processed_rows,
+                                                        err_num=job.err_num, finish_time=job.finish_time)
+    return job
@@ -0,0 +1,124 @@
+import datetime
+import time
+import tracemalloc
+from io import BytesIO
+
+import xlsxwriter
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from goods.importer import PriceSheetImporter, read_price_sheets
+from goods.models import CategoryModel, GoodsModel, PriceCycleModel
+
+
+def build_workbook(rows, sheets):
+    """
+    生成与询价单格式一致的报价表格，共rows行，平均分布在sheets张工作簿中
+    """
+    output = BytesIO()
+    workbook = xlsxwriter.Workbook(output, {'in_memory': True})
+    header = ['序号', '品牌', '商品名称', '规格', '询价1', '询价2', '平均价格', '下调5%价格', '四舍五入保留两位']
+    per_sheet = (rows + sheets - 1) // sheets
+    no = 0
+    for i in range(sheets):
+        worksheet = workbook.add_worksheet(f'测试{i}类')
+        worksheet.write_row('A3', header)
+        for row in range(3, 3 + per_sheet):
+            if no >= rows:
+                break
+            price = round(1 + no % 997 * 0.37, 2)
+            worksheet.write_row(row, 0, [no + 1, f'品牌{no % 50}', f'商品{no}', f'{no % 20 + 1}kg',
+                                         price, price, price, round(price * 0.95, 2), round(price * 0.95, 2)])
+            no += 1
+    workbook.close()
+    output.seek(0)
+    return output
+
+
+def parse_with_pandas(f):
+    """
+    旧的解析方式：一次性将所有工作簿读入DataFrame后再遍历
+    """
+    import pandas as pd
+
+    rows = 0
+    for sheet_name, sheet_data in pd.read_excel(f, sheet_name=None, skiprows=2).items():
+        if '类' not in sheet_name:
+            continue
+        for _, row in sheet_data.iterrows():
+            if row.isnull().all():
+                break
+            rows += 1
+    return rows
+
+
+def parse_streaming(f):
+    rows = 0
+    for _, sheet_rows in read_price_sheets(f):
+        for _ in sheet_rows:
+            rows += 1
+    return rows
+
+
+def peak_memory(parse, f):
+    """
+    返回解析表格时的内存峰值（MB）
+    """
+    f.seek(0)
+    tracemalloc.start()
+    parse(f)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1024 / 1024
+
+
+class Command(BaseCommand):
+    help = '报价表格导入基准测试：生成合成表格并导入，输出查询次数和耗时（数据会回滚）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='表格总行数')
+        parser.add_argument('--sheets', type=int, default=5, help='工作簿数量')
+        parser.add_argument('--existing', type=float, default=0.5, help='表格中已存在商品的比例')
+        parser.add_argument('--memory', action='store_true', help='对比pandas与流式解析在不同表格大小下的内存峰值，不写入数据库')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        sheets = options['sheets']
+        if options['memory']:
+            return self.bench_memory(rows, sheets)
+
+        existing = int(rows * options['existing'])
+        f = build_workbook(rows, sheets)
+
+        with transaction.atomic():
+            today = datetime.date.today()
+            cycle = PriceCycleModel.objects.create(name='bench', start_date=today, end_date=today + datetime.timedelta(days=30), creater_id=0)
+
+            # 预先创建一部分商品，用于测试报价修改
+            category = CategoryModel.objects.create(name='测试0类')
+            GoodsModel.objects.bulk_create([
+                GoodsModel(name=f'商品{no}', description=f'{no % 20 + 1}kg', brand=f'品牌{no % 50}', category=category)
+                for no in range(existing)
+            ], batch_size=1000)
+
+            with CaptureQueriesContext(connection) as ctx:
+                start = time.perf_counter()
+                importer = PriceSheetImporter(cycle, 0)
+                for category_name, sheet_rows in read_price_sheets(f):
+                    importer.feed(category_name, sheet_rows)
+                errs = importer.commit()
+                elapsed = time.perf_counter() - start
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(f'rows: {rows} (existing {existing}), sheets: {sheets}')
+        self.stdout.write(f'queries: {len(ctx.captured_queries)}')
+        self.stdout.write(f'time: {elapsed:.2f}s')
+        self.stdout.write(f"errors: edit {len(errs['edit'])}, add {len(errs['add'])}")
+
+    def bench_memory(self, rows, sheets):
+        self.stdout.write('rows\tpandas(MB)\tstreaming(MB)')
+        for n in [rows // 4, rows // 2, rows]:
+            f = build_workbook(n, sheets)
+            self.stdout.write(f'{n}\t{peak_memory(parse_with_pandas, f):.1f}\t\t{peak_memory(parse_streaming, f):.1f}')
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from goods.models import EffectivePriceModel
+from goods.prices import compute_effective_prices, refresh_effective_prices
+
+
+def _key(effective):
+    return effective.product_id, effective.cycle_id
+
+
+def _row(effective):
+    return effective.price_id, effective.price, effective.start_date, effective.end_date
+
+
+def find_mismatches():
+    """
+    比对生效价格表与根据价格表重新计算的结果，返回 (缺少的, 多余的, 不一致的) 三个键列表
+    """
+    expected = {_key(e): _row(e) for e in compute_effective_prices()}
+    actual = {_key(e): _row(e) for e in EffectivePriceModel.objects.all()}
+    missing = sorted(expected.keys() - actual.keys())
+    extra = sorted(actual.keys() - expected.keys())
+    wrong = sorted(k for k in expected.keys() & actual.keys() if expected[k] != actual[k])
+    return missing, extra, wrong
+
+
+class Command(BaseCommand):
+    help = '根据价格表重建生效价格表，并校验重建结果'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='只校验生效价格表，不重建')
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            count = refresh_effective_prices()
+            self.stdout.write(f'已重建生效价格{count}条')
+
+        missing, extra, wrong = find_mismatches()
+        if missing or extra or wrong:
+            for name, keys in (('缺少', missing), ('多余', extra), ('不一致', wrong)):
+                for product_id, cycle_id in keys:
+                    self.stdout.write(f'{name}：商品{product_id} 周期{cycle_id}')
+            raise CommandError(f'生效价格校验失败：缺少{len(missing)}条，多余{len(extra)}条，不一致{len(wrong)}条')
+        self.stdout.write(self.style.SUCCESS('生效价格校验通过'))
@@ -0,0 +1,63 @@
+import datetime
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from goods.importer import run_upload_job
+from goods.models import UploadJobModel
+
+# 任务处理超过该时间（分钟）仍未完成时，视为处理任务的worker已退出
+UPLOAD_JOB_TIMEOUT = getattr(settings, 'UPLOAD_JOB_TIMEOUT', 30)
+
+
+def fail_stuck_jobs(timeout=UPLOAD_JOB_TIMEOUT):
+    """
+    将处理超时的任务标记为失败，返回标记的任务数。
+    不重新排队，避免导致worker退出的表格被反复处理
+    """
+    now_time = datetime.datetime.now()
+    cutoff = now_time - datetime.timedelta(minutes=timeout)
+    return UploadJobModel.objects.filter(
+        Q(start_time__lt=cutoff) | Q(start_time__isnull=True, create_at__lt=cutoff), status="1"
+    ).update(status="-1", msg="任务处理超时，请重新上传", finish_time=now_time)
+
+
+def claim_job():
+    """
+    领取一个排队中的任务并标记为处理中，多个worker同时运行时不会领取到同一个任务。
+    领取前先将处理超时的任务标记为失败
+    """
+    fail_stuck_jobs()
+    with transaction.atomic():
+        job = (UploadJobModel.objects.select_for_update(skip_locked=True)
+               .select_related('cycle').filter(status="0").order_by('id').first())
+        if job is None:
+            return None
+        job.status = "1"
+        job.start_time = datetime.datetime.now()
+        job.save(update_fields=['status', 'start_time'])
+    return job
+
+
+class Command(BaseCommand):
+    help = '处理后台报价表格导入任务'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='处理完当前排队的任务后退出')
+        parser.add_argument('--interval', type=float, default=2, help='没有任务时的轮询间隔（秒）')
+
+    def handle(self, *args, **options):
+        while True:
+            job = claim_job()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+                continue
+
+            self.stdout.write(f'开始处理导入任务{job.id}：{job.file_name}')
+            job = run_upload_job(job)
+            self.stdout.write(f'导入任务{job.id}：{job.get_status_display()}，{job.msg}')
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('goods', '0020_alter_goodsmodel_license'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadJobModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.CharField(max_length=200, verbose_name='表格文件路径')),
+                ('file_name', models.CharField(max_length=200, verbose_name='上传文件名')),
+                ('status', models.CharField(choices=[('0', '排队中'), ('1', '处理中'), ('2', '已完成'), ('-1', '失败')], db_index=True, default='0', max_length=10, verbose_name='任务状态')),
+                ('creater_id', models.BigIntegerField(verbose_name='上传人ID')),
+                ('processed_rows', models.IntegerField(default=0, verbose_name='已处理行数')),
+                ('err_num', models.IntegerField(default=0, verbose_name='失败行数')),
+                ('errs', models.JSONField(blank=True, default=None, null=True, verbose_name='失败信息')),
+                ('msg', models.CharField(blank=True, default=None, max_length=200, null=True, verbose_name='任务结果')),
+                ('create_at', models.DateTimeField(auto_now_add=True, verbose_name='添加时间')),
+                ('finish_time', models.DateTimeField(blank=True, default=None, null=True, verbose_name='完成时间')),
+                ('cycle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_jobs', to='goods.pricecyclemodel', verbose_name='关联周期')),
+            ],
+            options={
+                'verbose_name': '导入任务',
+                'verbose_name_plural': '导入任务',
+                'db_table': 'upload_job',
+            },
+        ),
+    ]
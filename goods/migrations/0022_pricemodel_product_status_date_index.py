@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('goods', '0021_uploadjobmodel'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pricemodel',
+            index=models.Index(fields=['product', 'status', 'start_date', 'end_date'], name='price_product_status_date'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:08
+
+from django.db import migrations, models
+from django.db.models import Max
+import django.db.models.deletion
+
+
+def populate_effective_prices(apps, schema_editor):
+    PriceModel = apps.get_model('goods', 'PriceModel')
+    EffectivePriceModel = apps.get_model('goods', 'EffectivePriceModel')
+    latest_ids = PriceModel.objects.filter(status=2).values('product', 'cycle').annotate(latest_id=Max('id')).values_list('latest_id', flat=True)
+    latest_ids = list(latest_ids)
+    for i in range(0, len(latest_ids), 1000):
+        EffectivePriceModel.objects.bulk_create([
+            EffectivePriceModel(product_id=price.product_id, cycle_id=price.cycle_id, price_id=price.id, price=price.price,
+                                start_date=price.start_date, end_date=price.end_date)
+            for price in PriceModel.objects.filter(id__in=latest_ids[i:i + 1000])
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('goods', '0022_pricemodel_product_status_date_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EffectivePriceModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price_id', models.BigIntegerField(verbose_name='来源价格ID')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='生效价格')),
+                ('start_date', models.DateField(verbose_name='价格开始时间')),
+                ('end_date', models.DateField(verbose_name='价格结束时间')),
+                ('cycle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='effective_prices', to='goods.pricecyclemodel', verbose_name='关联周期')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='effective_prices', to='goods.goodsmodel', verbose_name='关联商品')),
+            ],
+            options={
+                'verbose_name': '生效价格',
+                'verbose_name_plural': '生效价格',
+                'db_table': 'effective_price',
+                'indexes': [models.Index(fields=['product', 'start_date', 'end_date'], name='effective_price_product_date')],
+                'unique_together': {('product', 'cycle')},
+            },
+        ),
+        migrations.RunPython(populate_effective_prices, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('goods', '0023_effectivepricemodel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadjobmodel',
+            name='start_time',
+            field=models.DateTimeField(blank=True, default=None, null=True, verbose_name='开始处理时间'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:50
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('goods', '0024_uploadjob_start_time'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='uploadjobmodel',
+            name='errs',
+            field=models.JSONField(blank=True, default=None, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True, verbose_name='失败信息'),
+        ),
+    ]
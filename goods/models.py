@@ -1,3 +1,4 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 import os
 import shutil
@@ -92,6 +93,50 @@ class PriceModel(models.Model):
         db_table = 'price'
         verbose_name = '价格'
         verbose_name_plural = verbose_name
+        # 用于查询商品当前已审核的价格
+        indexes = [
+            models.Index(fields=['product', 'status', 'start_date', 'end_date'], name='price_product_status_date'),
+        ]
+
+# 生效价格模型，保存每个商品在每个价格周期内最新的已审核价格，由价格审核、弃用等操作维护
+class EffectivePriceModel(models.Model):
+    product = models.ForeignKey(GoodsModel, related_name='effective_prices', on_delete=models.CASCADE, verbose_name="关联商品")
+    cycle = models.ForeignKey(PriceCycleModel, related_name="effective_prices", on_delete=models.CASCADE, verbose_name="关联周期")
+    price_id = models.BigIntegerField(verbose_name="来源价格ID")
+    price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="生效价格")
+    start_date = models.DateField(verbose_name="价格开始时间")
+    end_date = models.DateField(verbose_name="价格结束时间")
+
+    class Meta:
+        db_table = 'effective_price'
+        verbose_name = '生效价格'
+        verbose_name_plural = verbose_name
+        unique_together = (('product', 'cycle'),)
+        indexes = [
+            models.Index(fields=['product', 'start_date', 'end_date'], name='effective_price_product_date'),
+        ]
+
+# 报价表格导入任务模型
+class UploadJobModel(models.Model):
+    file = models.CharField(max_length=200, verbose_name="表格文件路径")
+    file_name = models.CharField(max_length=200, verbose_name="上传文件名")
+    cycle = models.ForeignKey(PriceCycleModel, related_name="upload_jobs", on_delete=models.CASCADE, verbose_name="关联周期")
+    status_choice = (("0", "排队中"), ("1", "处理中"), ("2", "已完成"), ("-1", "失败"))
+    status = models.CharField(choices=status_choice, max_length=10, verbose_name="任务状态", default="0", db_index=True)
+    creater_id = models.BigIntegerField(verbose_name="上传人ID")
+    processed_rows = models.IntegerField(verbose_name="已处理行数", default=0)
+    err_num = models.IntegerField(verbose_name="失败行数", default=0)
+    # 失败行保留表格中的原始值，日期和小数等单元格需要转换为字符串保存
+    errs = models.JSONField(verbose_name="失败信息", blank=True, null=True, default=None, encoder=DjangoJSONEncoder)
+    msg = models.CharField(max_length=200, verbose_name="任务结果", blank=True, null=True, default=None)
+    create_at = models.DateTimeField(auto_now_add=True, verbose_name='添加时间')
+    start_time = models.DateTimeField(verbose_name="开始处理时间", blank=True, null=True, default=None)
+    finish_time = models.DateTimeField(verbose_name="完成时间", blank=True, null=True, default=None)
+
+    class Meta:
+        db_table = 'upload_job'
+        verbose_name = '导入任务'
+        verbose_name_plural = verbose_name
 
 # # 价格请求模型
 # class PriceRequestModel(models.Model):
@@ -0,0 +1,71 @@
+from django.db import transaction
+from django.db.models import Max, OuterRef, Subquery
+
+from .cache import bump_catalogue_version
+from .models import EffectivePriceModel, PriceModel
+
+# 批量写入时每批的行数
+BATCH_SIZE = 1000
+
+
+def compute_effective_prices(product_ids=None, cycle_ids=None):
+    """
+    根据价格表计算生效价格：每个商品在每个周期内id最大的已审核价格
+    """
+    approved = PriceModel.objects.filter(status=2)
+    if product_ids is not None:
+        approved = approved.filter(product_id__in=product_ids)
+    if cycle_ids is not None:
+        approved = approved.filter(cycle_id__in=cycle_ids)
+    latest_ids = approved.values('product', 'cycle').annotate(latest_id=Max('id')).values('latest_id')
+    return [
+        EffectivePriceModel(product_id=price.product_id, cycle_id=price.cycle_id, price_id=price.id, price=price.price,
+                            start_date=price.start_date, end_date=price.end_date)
+        for price in PriceModel.objects.filter(id__in=latest_ids)
+    ]
+
+
+def refresh_effective_prices(product_ids=None, cycle_ids=None):
+    """
+    重新计算指定商品或周期的生效价格，都不传入时重建全部生效价格。
+    价格被审核、拒绝、弃用、修改或创建新周期后调用
+    """
+    effective = compute_effective_prices(product_ids, cycle_ids)
+    queryset = EffectivePriceModel.objects.all()
+    if product_ids is not None:
+        queryset = queryset.filter(product_id__in=product_ids)
+    if cycle_ids is not None:
+        queryset = queryset.filter(cycle_id__in=cycle_ids)
+    with transaction.atomic():
+        queryset.delete()
+        EffectivePriceModel.objects.bulk_create(effective, batch_size=BATCH_SIZE)
+        # 商品目录中展示的价格随之变化
+        bump_catalogue_version()
+    return len(effective)
+
+
+def _effective_queryset(date):
+    return EffectivePriceModel.objects.filter(start_date__lte=date, end_date__gte=date)
+
+
+def get_effective_price(product_id, date):
+    """
+    获取商品在某一天的生效价格，没有则返回None
+    """
+    return _effective_queryset(date).filter(product_id=product_id).order_by('-price_id').values_list('price', flat=True).first()
+
+
+def get_effective_prices(product_ids, date):
+    """
+    获取多个商品在某一天的生效价格，返回 {商品ID: 价格}
+    """
+    rows = _effective_queryset(date).filter(product_id__in=product_ids).order_by('price_id').values_list('product_id', 'price')
+    # 多个周期重叠时以最新的价格为准
+    return dict(rows)
+
+
+def effective_price_subquery(date, product_ref='pk'):
+    """
+    用于annotate的生效价格子查询
+    """
+    return Subquery(_effective_queryset(date).filter(product_id=OuterRef(product_ref)).order_by('-price_id').values('price')[:1])
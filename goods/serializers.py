@@ -1,6 +1,7 @@
 from rest_framework import serializers
 import datetime
 from .models import *
+from .prices import get_effective_price, refresh_effective_prices
 import os
 import shutil
 from django.conf import settings
@@ -79,6 +80,7 @@ class GoodsModelSerializer(serializers.ModelSerializer):
                                                             cycle=PriceCycleModel.objects.get(id=cycle_id), start_date=PriceCycleModel.objects.get(id=cycle_id).start_date, 
                                                             end_date=PriceCycleModel.objects.get(id=cycle_id).end_date, status=2, creater_id=self.context['user_id'], 
                                                             create_time=datetime.datetime.now(), reviewer_id=self.context['user_id'], review_time=datetime.datetime.now())
+                refresh_effective_prices(product_ids=[product_obj.id])
                 return product_obj
             else:   
                 raise serializers.ValidationError("已存在该规格商品")
@@ -130,6 +132,9 @@ class GoodsModelSerializer(serializers.ModelSerializer):
             except:
                 instance.delete()
                 raise serializers.ValidationError("为商品添加价格失败")
+            # 上传文件添加的商品在所传入周期的价格已审核，需要刷新生效价格
+            if self.context.get("cycle_id"):
+                refresh_effective_prices(product_ids=[instance.id])
         return instance
 
     def update(self, instance, validated_data): 
@@ -159,13 +164,13 @@ class GoodsModelSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
-        now_time = datetime.datetime.now()
-        # now_time = "2024-07-18"
-        price = instance.prices.filter(status=2, start_date__lte=now_time, end_date__gte=now_time).order_by('-id').first()
-        if not price:
-            data['price'] = None
+        # 列表查询时已在queryset中附带当前价格
+        if hasattr(instance, 'current_price'):
+            data['price'] = instance.current_price
         else:
-            data['price'] = price.price
+            now_time = datetime.datetime.now()
+            # now_time = "2024-07-18"
+            data['price'] = get_effective_price(instance.id, now_time.date())
         # data['unit'] = instance.unit.name
         data['category'] = instance.category.name  
         return data
@@ -182,3 +187,24 @@ class PriceCycleModelSerializer(serializers.ModelSerializer):
         validated_data['creater_id'] = self.context['request'].user.id
         return super().create(validated_data)
 
+
+class UploadJobModelSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadJobModel
+        exclude = ['file', 'creater_id']
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        data['cycle_id'] = data.pop('cycle')
+        data['status_code'] = data.pop('status')
+        data['status'] = instance.get_status_display()
+        # 与同步上传的返回格式保持一致
+        errs = data.pop('errs')
+        if errs and (errs['edit'] or errs['add']):
+            data['errs'] = {
+                "报价修改失败": errs['edit'],
+                "商品添加失败": errs['add']
+            }
+        else:
+            data['errs'] = None
+        return data
@@ -1,3 +1,319 @@
-from django.test import TestCase
+import datetime
+import io
+import re
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+import openpyxl
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from account.models import AccountModel
+from goods.importer import read_price_sheets, run_upload_job
+from goods.management.commands.run_upload_jobs import claim_job
+from goods.prices import refresh_effective_prices
+from goods.models import CategoryModel, GoodsModel, PriceCycleModel, PriceModel, UploadJobModel
+from orders.models import OrderDetailModel, OrdersModel
+
+
+def create_cycle(user_id, days=30):
+    today = datetime.date.today()
+    return PriceCycleModel.objects.create(name='测试周期', start_date=today - datetime.timedelta(days=1),
+                                          end_date=today + datetime.timedelta(days=days), creater_id=user_id)
+
+
+def create_client(user):
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+def create_goods(count, cycle, price_status="2", category=None):
+    """
+    批量创建商品和商品在周期内的价格
+    """
+    category = category or CategoryModel.objects.create(name='粮油类')
+    last_id = GoodsModel.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    GoodsModel.objects.bulk_create(
+        [GoodsModel(name=f'商品{i}', description='10kg', brand='品牌', category=category) for i in range(count)], batch_size=1000)
+    # MySQL批量插入不会返回主键，按主键范围查询新增的商品
+    PriceModel.objects.bulk_create([
+        PriceModel(product_id=product_id, price='12.50', cycle=cycle, start_date=cycle.start_date, end_date=cycle.end_date, status=price_status)
+        for product_id in GoodsModel.objects.filter(id__gt=last_id).values_list('id', flat=True)
+    ], batch_size=1000)
+
+
+class ReadPriceSheetsTests(SimpleTestCase):
+    def create_sheet(self, rows):
+        workbook = openpyxl.Workbook()
+        worksheet = workbook.active
+        worksheet.title = '粮油类'
+        worksheet.append(['报价表'])
+        worksheet.append([])
+        worksheet.append(['序号', '品牌', '品名', '规格', '询价1', '询价2', '询价平均', '下浮5%', '报价'])
+        for row in rows:
+            worksheet.append(row)
+        output = io.BytesIO()
+        workbook.save(output)
+        output.seek(0)
+        return output
+
+    def test_numbered_blank_rows_end_sheet(self):
+        f = self.create_sheet([
+            [1, '品牌', '大米', '10kg', 50, 52, 51, 48.45, 48],
+            [2, None, '面粉', '5kg', 20, 22, 21, 19.95, 20],
+            # 模板中预先编号的空行，下浮5%列为公式计算结果
+            [3, None, None, None, None, None, None, 0],
+            [4, None, None, None, None, None, None, 0],
+        ])
+
+        sheets = [(name, list(rows)) for name, rows in read_price_sheets(f)]
+
+        self.assertEqual(len(sheets), 1)
+        name, rows = sheets[0]
+        self.assertEqual(name, '粮油类')
+        self.assertEqual([row['name'] for row in rows], ['大米', '面粉'])
+        self.assertNotIn('price_down5', rows[0])
+
+
+@override_settings(OPERATE_LOG_ASYNC=False)
+class UploadJobTests(TestCase):
+    def setUp(self):
+        self.user = AccountModel.objects.create_user(username='edu', password='x', role='1')
+        self.cycle = create_cycle(self.user.id)
+
+    def create_job(self, **kwargs):
+        return UploadJobModel.objects.create(file='price_upload/test.xlsx', file_name='test.xlsx', cycle=self.cycle,
+                                             creater_id=self.user.id, **kwargs)
+
+    def test_read_error_mid_sheet_fails_job(self):
+        def rows():
+            yield {'brand': None, 'name': '大米', 'description': '10kg', 'price_check_1': 1, 'price_check_2': 1,
+                   'price_check_avg': 1, 'price': 1}
+            raise OSError('表格读取失败')
+
+        def sheets():
+            yield '粮油类', rows()
+
+        job = self.create_job(status="1")
+        with mock.patch('goods.importer.read_price_sheets', return_value=sheets()):
+            job = run_upload_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, "-1")
+        self.assertIsNotNone(job.finish_time)
+        self.assertEqual(job.processed_rows, 1)
+
+    def test_error_rows_with_dates_are_saved(self):
+        def sheets():
+            yield '粮油类', iter([{'brand': None, 'name': '大米', 'description': '10kg', 'price_check_1': 1, 'price_check_2': 1,
+                                  'price_check_avg': 1, 'price': datetime.datetime(2024, 9, 1)}])
+
+        job = self.create_job(status="1")
+        with mock.patch('goods.importer.read_price_sheets', return_value=sheets()):
+            run_upload_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, "2")
+        self.assertEqual(job.err_num, 1)
+        self.assertEqual(job.errs['add'][0]['price'], '2024-09-01T00:00:00')
+
+    def test_failed_save_marks_job_failed(self):
+        def sheets():
+            yield '粮油类', iter([{'brand': None, 'name': '大米', 'description': '10kg', 'price_check_1': 1, 'price_check_2': 1,
+                                  'price_check_avg': 1, 'price': object()}])
+
+        job = self.create_job(status="1")
+        with mock.patch('goods.importer.read_price_sheets', return_value=sheets()):
+            run_upload_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, "-1")
+        self.assertIsNone(job.errs)
+        self.assertIsNotNone(job.finish_time)
+
+    def test_stuck_job_is_failed_before_claiming(self):
+        stuck = self.create_job(status="1", start_time=datetime.datetime.now() - datetime.timedelta(hours=2))
+        running = self.create_job(status="1", start_time=datetime.datetime.now())
+        queued = self.create_job()
+
+        job = claim_job()
+
+        self.assertEqual(job.id, queued.id)
+        self.assertIsNotNone(job.start_time)
+        stuck.refresh_from_db()
+        running.refresh_from_db()
+        self.assertEqual(stuck.status, "-1")
+        self.assertEqual(running.status, "1")
+
+
+@override_settings(OPERATE_LOG_ASYNC=False, MEDIA_ROOT=tempfile.gettempdir())
+class SyncUploadTests(TestCase):
+    def setUp(self):
+        self.user = AccountModel.objects.create_user(username='edu', password='x', role='1')
+        self.cycle = create_cycle(self.user.id)
+        self.client = create_client(self.user)
+
+    def test_read_error_mid_sheet_returns_error(self):
+        def rows():
+            yield {'brand': None, 'name': '大米', 'description': '10kg', 'price_check_1': 1, 'price_check_2': 1,
+                   'price_check_avg': 1, 'price': 1}
+            raise OSError('表格读取失败')
+
+        def sheets():
+            yield '粮油类', rows()
+
+        f = SimpleUploadedFile('test.xlsx', b'xlsx')
+        with mock.patch('goods.views.read_price_sheets', return_value=sheets()):
+            response = self.client.post('/api/goods/upload/', {'file': f, 'cycle': self.cycle.id}, format='multipart')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(GoodsModel.objects.exists())
+
+
+@override_settings(OPERATE_LOG_ASYNC=False)
+class DeprecateCycleTests(TestCase):
+    # 弃用的价格数量，查询次数不应随价格数量增长
+    ROWS = 50000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = AccountModel.objects.create_user(username='edu', password='x', role='1')
+        cls.cycle = create_cycle(cls.user.id)
+        create_goods(cls.ROWS, cls.cycle, price_status="1")
+        # 已弃用的价格不计入
+        PriceModel.objects.filter(id=PriceModel.objects.order_by('id').values_list('id', flat=True).first()).update(status="-99")
+
+    def setUp(self):
+        self.client = create_client(self.user)
+
+    def test_dry_run_only_counts(self):
+        with self.assertNumQueries(2):
+            response = self.client.post(f'/api/priceCycle/{self.cycle.id}/deprecate/?dry_run=1')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['count'], self.ROWS - 1)
+        self.assertEqual(PriceModel.objects.filter(cycle=self.cycle, status="-99").count(), 1)
+        self.cycle.refresh_from_db()
+        self.assertTrue(self.cycle.status)
+
+    def test_deprecate_uses_one_update(self):
+        with CaptureQueriesContext(connection) as ctx, self.assertNumQueries(10):
+            response = self.client.post(f'/api/priceCycle/{self.cycle.id}/deprecate/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['count'], self.ROWS - 1)
+        # 价格表只执行一次UPDATE，其余查询为读取周期、刷新生效价格、修改周期和写入日志
+        price_updates = [q['sql'] for q in ctx.captured_queries if re.match(r'UPDATE [`"]price[`"] ', q['sql'])]
+        self.assertEqual(len(price_updates), 1)
+        self.assertEqual(PriceModel.objects.filter(cycle=self.cycle).exclude(status="-99").count(), 0)
+        self.cycle.refresh_from_db()
+        self.assertFalse(self.cycle.status)
+
+
+@override_settings(OPERATE_LOG_ASYNC=False, CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class GoodsListQueryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = AccountModel.objects.create_user(username='school', password='x', role='2')
+        self.cycle = create_cycle(self.user.id)
+        self.client = create_client(self.user)
+        self.category = CategoryModel.objects.create(name='粮油类')
+
+    def list_goods(self, count):
+        create_goods(count, self.cycle, category=self.category)
+        refresh_effective_prices()
+        cache.clear()
+        # 统计数量、读取一页商品，商品类别和当前价格在同一条查询中获取
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/goods/', {'page_size': 1000})
+        self.assertEqual(response.status_code, 200)
+        return response.data['data']['results']
+
+    def test_query_count_does_not_grow_with_goods(self):
+        results = self.list_goods(5)
+        self.assertEqual(len(results), 5)
+        results = self.list_goods(50)
+        self.assertEqual(len(results), 55)
+        self.assertTrue(all(item['price'] is not None for item in results))
+
+
+@override_settings(OPERATE_LOG_ASYNC=False, MEDIA_ROOT=tempfile.gettempdir())
+class UpdatePriceTests(TestCase):
+    def setUp(self):
+        self.user = AccountModel.objects.create_user(username='edu', password='x', role='1')
+        self.cycle = create_cycle(self.user.id)
+        create_goods(2, self.cycle)
+        self.client = create_client(self.user)
+
+    def test_report_is_returned_when_some_details_fail(self):
+        priced, missing = GoodsModel.objects.order_by('id')
+        PriceModel.objects.filter(product=missing).delete()
+        order = OrdersModel.objects.create(status="0", creater_id=self.user.id, cycle=self.cycle, deliver_date=datetime.date.today())
+        for product in (priced, missing):
+            OrderDetailModel.objects.create(order=order, product_id=product.id, product_name=product.name, category='粮油类',
+                                            funds='营养餐', price='10.00', order_quantity=1)
+
+        response = self.client.post(f'/api/priceCycle/{self.cycle.id}/updatePrice/')
+
+        self.assertEqual(response.status_code, 400)
+        report = response.data['data']
+        self.assertEqual((report['details'], report['changed'], report['failed']), (2, 1, 1))
+        self.assertEqual(len(report['err_list']), 1)
+        self.assertIn(f"商品ID:{missing.id}", report['err_list'][0])
+        self.assertEqual(set(report['timing']), {'load', 'copy', 'compute', 'write'})
+
+
+@override_settings(OPERATE_LOG_ASYNC=False)
+class MultiReviewTests(TestCase):
+    def setUp(self):
+        self.user = AccountModel.objects.create_user(username='edu', password='x', role='1')
+        self.cycle = create_cycle(self.user.id)
+        create_goods(3, self.cycle, price_status="1")
+        self.client = create_client(self.user)
+
+    def test_invalid_params_return_400(self):
+        for action in ('multiaccept', 'multireject'):
+            for data in ({'cycle_id': 'abc'}, {'price_ids': '1'}, {'price_ids': {'id': 1}}, {}):
+                response = self.client.post(f'/api/price/{action}/', data, format='json')
+                self.assertEqual(response.status_code, 400, (action, data))
+        self.assertEqual(PriceModel.objects.filter(status="1").count(), 3)
+
+    def test_accept_cycle(self):
+        response = self.client.post('/api/price/multiaccept/', {'cycle_id': str(self.cycle.id)}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['count'], 3)
+        self.assertEqual(PriceModel.objects.filter(cycle=self.cycle, status="2").count(), 3)
+
+
+@override_settings(OPERATE_LOG_ASYNC=False)
+class GenAskTests(TestCase):
+    def setUp(self):
+        self.user = AccountModel.objects.create_user(username='company', password='x', role='0')
+        self.cycle = create_cycle(self.user.id)
+        self.client = create_client(self.user)
+
+    def test_sheet_per_category(self):
+        create_goods(3, self.cycle, category=CategoryModel.objects.create(name='粮油类'))
+        CategoryModel.objects.create(name='调味品类')
+
+        response = self.client.post('/api/goods/genask/')
+
+        self.assertEqual(response.status_code, 200)
+        workbook = openpyxl.load_workbook(io.BytesIO(response.content))
+        self.assertEqual(workbook.sheetnames, ['粮油类', '调味品类'])
+        sheet = workbook['粮油类']
+        self.assertEqual(sheet['A1'].value, '学校大宗食品采购询价单(粮油类)')
+        self.assertEqual([sheet[f'A{row}'].value for row in range(4, 7)], [1, 2, 3])
+        self.assertEqual(sheet['C4'].value, '商品0')
+        # 签字行位于表格下方两行，没有商品的类别同样如此
+        self.assertEqual((sheet['A9'].value, sheet['A10'].value), ('询价人员签字：', '监督人员签字：'))
+        empty = workbook['调味品类']
+        self.assertEqual(empty['A3'].value, '序号')
+        self.assertEqual((empty['A6'].value, empty['A7'].value), ('询价人员签字：', '监督人员签字：'))
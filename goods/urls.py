@@ -9,6 +9,7 @@ router.register(r'price', views.PriceViewSet)
 # router.register(r'unit', views.UnitViewSet)
 router.register(r'category', views.CategoryViewSet)
 router.register(r'priceCycle', views.PriceCycleViewSet)
+router.register(r'jobs', views.UploadJobViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -1,6 +1,8 @@
 from django.shortcuts import render
 from django.conf import settings
 from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import F, Max
 
 from rest_framework import viewsets
 from rest_framework import permissions
@@ -13,16 +15,19 @@ from .serializers import *
 from .pagination import GoodsPagination
 from account.permissions import *
 from .filters import *
+from .importer import BATCH_SIZE, PriceSheetImporter, read_price_sheets
+from .prices import effective_price_subquery, refresh_effective_prices
+from .cache import bump_catalogue_version, cached_catalogue, get_catalogue_stats
+from orders.facts import refresh_daily_facts
 from orders.models import FundsModel, CartModel, OrdersModel, OrderDetailModel
 from orders.serializers import CartModelSerializer
 from utils import response as myresponse
+from utils.export import XlsxExport
 from utils.logger import log_operate
 
 import datetime
-import pandas as pd
-import numpy as np
-from io import BytesIO
-import xlsxwriter
+import time
+from decimal import Decimal
 from urllib.parse import quote
 
 # 商品视图集
@@ -46,7 +51,7 @@ class GoodsViewSet(myresponse.CustomModelViewSet):
             return [IsRole2()]
         elif self.action == 'upload':
             return [IsRole1()]
-        elif self.action in ['genask']:
+        elif self.action in ['genask', 'cachestats']:
             return [IsRole0OrRole1()]
         else:
             return [IsRole0()]
@@ -57,8 +62,37 @@ class GoodsViewSet(myresponse.CustomModelViewSet):
         # 学院用户只能看到上架商品
         if self.request.user.role == '2':
             queryset = queryset.filter(status=1)
+
+        # 在查询中附带商品类别和当前的生效价格，避免序列化时逐个查询
+        queryset = queryset.select_related('category').annotate(current_price=effective_price_subquery(datetime.date.today()))
         
         return queryset.order_by('id')
+
+    # 商品列表读取缓存，商品或价格变化后缓存失效
+    def list(self, request, *args, **kwargs):
+        data = cached_catalogue('goods', request, lambda: super(GoodsViewSet, self).list(request, *args, **kwargs).data)
+        return Response(data, status=status.HTTP_200_OK)
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        bump_catalogue_version()
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        bump_catalogue_version()
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        bump_catalogue_version()
+
+    # 查看商品目录缓存的命中情况
+    @action(methods=['get'], detail=False)
+    def cachestats(self, request, pk=None):
+        return Response({
+            "msg": "商品目录缓存统计",
+            "data": get_catalogue_stats(),
+            "code": status.HTTP_200_OK
+        }, status=status.HTTP_200_OK)
     
     # def get_queryset(self):
     #     queryset = super().get_queryset().order_by('id')
@@ -119,19 +153,28 @@ class GoodsViewSet(myresponse.CustomModelViewSet):
                  "data": None,
                  "code": status.HTTP_201_CREATED}, status=status.HTTP_201_CREATED)
 
-    # 商品报价表格上传
+    # 商品报价表格上传，传入async=1时仅保存文件并创建后台导入任务
     @action(methods=['post'], detail=False)
     def upload(self, request, pk=None):
         f = request.data.get('file')
         cycle_id = request.data.get('cycle')
-        try:
-            df = pd.read_excel(f, sheet_name=None, skiprows=2)
-        except:
+        is_async = request.query_params.get('async') == '1'
+        if not f:
             return Response({
                 "msg": "文件格式错误，请传入xlsx文件",
                 "data": None,
                 "code": status.HTTP_400_BAD_REQUEST
             }, status=status.HTTP_400_BAD_REQUEST)
+
+        if not is_async:
+            try:
+                sheets = read_price_sheets(f)
+            except:
+                return Response({
+                    "msg": "文件格式错误，请传入xlsx文件",
+                    "data": None,
+                    "code": status.HTTP_400_BAD_REQUEST
+                }, status=status.HTTP_400_BAD_REQUEST)
         
         # 保存文件
         file_path = os.path.join('price_upload', f.name.split('.')[0] + '-' + str(datetime.datetime.now().timestamp()) + '.' + f.name.split('.')[-1])
@@ -149,97 +192,39 @@ class GoodsViewSet(myresponse.CustomModelViewSet):
                 "code": status.HTTP_400_BAD_REQUEST
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        if not PriceCycleModel.objects.filter(id=cycle_id).exists():
+        cycle = PriceCycleModel.objects.filter(id=cycle_id).first()
+        if not cycle:
             return Response({
                 "msg": "所选周期不存在",
                 "data": None,
                 "code": status.HTTP_400_BAD_REQUEST
             }, status=status.HTTP_400_BAD_REQUEST)
-        
-        # 错误信息，保存修改或添加失败的商品信息
-        errs = {
-            "edit":[],
-            "add":[]
-        }
-
-        # 遍历每一张工作簿，添加商品或修改商品价格
-        for sheet_name, sheet_data in df.items():
-            # 如果工作簿名不含“类”，则不是商品列表，跳过
-            if '类' not in sheet_name:
-                continue
 
+        # 后台导入，由 run_upload_jobs 命令处理，通过 /api/jobs/<id>/ 查询进度
+        if is_async:
+            job = UploadJobModel.objects.create(file=file_path, file_name=f.name, cycle=cycle, creater_id=request.user.id)
+            return Response({
+                "msg": "已创建导入任务",
+                "data": {
+                    "job_id": job.id
+                },
+                "code": status.HTTP_202_ACCEPTED
+            }, status=status.HTTP_202_ACCEPTED)
 
-            # 获取类别名，如果当前类别不存在，则创建类别
-            category_name = sheet_name.strip()
-            category_obj, _ = CategoryModel.objects.get_or_create(name=category_name)
-            category_id = category_obj.id
-
-            # 处理df，价格保留两位小数
-            sheet_data = sheet_data.drop('序号', axis=1)
-            # sheet_data = sheet_data.dropna()
-            col_name = ['brand', 'name', 'description', 'price_check_1', 'price_check_2', 'price_check_avg', 'price_down5', 'price']
-            sheet_data.columns = col_name
-            sheet_data = sheet_data.drop('price_down5', axis=1)
-            sheet_data['price_check_1'] = np.where(sheet_data['price_check_1'].notnull(),sheet_data['price_check_1'].round(2),None)
-            sheet_data['price_check_2'] = np.where(sheet_data['price_check_2'].notnull(),sheet_data['price_check_2'].round(2),None)
-
-            # sheet_data['price_check_1'] = sheet_data['price_check_1'].round(2)
-            # sheet_data['price_check_2'] = sheet_data['price_check_2'].round(2)
-            sheet_data['price_check_avg'] = sheet_data['price_check_avg'].round(2)
-            sheet_data['price'] = sheet_data['price'].round(2)
-
-
-            # 遍历每一行数据，进行商品的添加或报价的修改提交
-            for _, row in sheet_data.iterrows():
-                if row.isnull().all():
-                    break
-                row_dict = row.to_dict()
-                row_dict['category'] = category_id
-                row_dict['brand'] = None if pd.isnull(row_dict['brand']) else row_dict['brand'].strip()
-                row_dict['name'] = row_dict['name'].strip()
-                row_dict['description'] = row_dict['description'].strip()
-                # 如果商品及其规格存在的话，则修改并更新报价
-                if GoodsModel.objects.filter(name=row['name'], description=row['description'], brand=row['brand']).exists():
-                    product_obj = GoodsModel.objects.filter(name=row['name'], description=row['description'], brand=row['brand']).first()
-                    ser = GoodsModelSerializer(product_obj, data=row_dict, context={'user_id': request.user.id, 'cycle_id':cycle_id}, partial=True)
-                    if ser.is_valid():
-                        ser.save()
-                    else:
-                        errs['edit'].append(row_dict)
-                    # # 没有status=0的价格，表示已经提出报价或报价已经被处理，需要手动调整
-                    # if not PriceModel.objects.filter(product=product_obj, status=0, cycle__id=cycle_id).exists():
-                    #     errs['edit'].append(row_dict)
-
-                    # # 有status=0的价格，则修改报价，并提交申请
-                    # else:
-                    try:
-                        price_obj = PriceModel.objects.get(product=product_obj, cycle__id=cycle_id)
-                        price_obj.price = row_dict['price']
-                        price_obj.price_check_1 = row_dict['price_check_1']
-                        price_obj.price_check_2 = row_dict['price_check_2']
-                        price_obj.price_check_avg = row_dict['price_check_avg']
-                        price_obj.status = 2
-                        price_obj.reviewer_id = self.request.user.id
-                        price_obj.review_time = datetime.datetime.now()
-                    except:
-                        price_obj = PriceModel.objects.create(product=product_obj, price=row_dict['price'], price_check_1=row_dict['price_check_1'], 
-                                                              price_check_2=row_dict['price_check_2'], price_check_avg=row_dict['price_check_avg'], 
-                                                              cycle=PriceCycleModel.objects.get(id=cycle_id), start_date=PriceCycleModel.objects.get(id=cycle_id).start_date, 
-                                                              end_date=PriceCycleModel.objects.get(id=cycle_id).end_date, status=2, creater_id=self.request.user.id, 
-                                                              create_time=datetime.datetime.now(), reviewer_id=self.request.user.id, review_time=datetime.datetime.now())
-                    try:
-                        price_obj.save()
-                    except:
-                        errs['edit'].append(row_dict)
-
-
-                # 如果不存在，则添加作为新的商品
-                else:
-                    ser = GoodsModelSerializer(data=row_dict, context={'user_id': request.user.id, 'cycle_id':cycle_id, 'upload':True})
-                    if ser.is_valid():
-                        ser.save()
-                    else:
-                        errs['add'].append(row_dict)
+        # 一次性读取已有商品和该周期的价格，遍历每一张工作簿在内存中比对，最后批量写入
+        # 逐行读取表格时出错或比对、写入时数据库出错，均返回导入失败
+        try:
+            importer = PriceSheetImporter(cycle, request.user.id)
+            for category_name, rows in sheets:
+                importer.feed(category_name, rows)
+            errs = importer.commit()
+        except:
+            sheets.close()
+            return Response({
+                "msg": "商品添加/报价修改失败，请检查表格数据",
+                "data": None,
+                "code": status.HTTP_400_BAD_REQUEST
+            }, status=status.HTTP_400_BAD_REQUEST)
 
         # 记录操作日志
         log_operate(request.user.id, f"上传价格表格{f.name}")
@@ -269,77 +254,38 @@ class GoodsViewSet(myresponse.CustomModelViewSet):
         # 商品种类queryset
         category_queryset = CategoryModel.objects.all()
 
+        # 一次查询获取所有商品，按种类分组
+        goods_dict = {}
+        for goods in goods_queryset:
+            goods_dict.setdefault(goods.category_id, []).append(goods)
+
         # 生成询价单文件
-        output = BytesIO()
-        workbook = xlsxwriter.Workbook(output, {'in_memory': True})
+        export = XlsxExport()
 
         # 遍历商品种类，生成询价单
         for category in category_queryset:
-            worksheet = workbook.add_worksheet(category.name)
+            sheet = export.add_sheet(category.name, 9, [('A:A', 6), ('B:I', 22)])
 
             # 获得商品数据
-            goods_category_queryset = goods_queryset.filter(category=category)
             data = []
-            no = 1
-            for goods in goods_category_queryset:
+            for no, goods in enumerate(goods_dict.get(category.id, []), start=1):
                 data.append([no, goods.brand, goods.name, goods.description, None, None, None, None, None])
-                no += 1
-            # 设置列宽
-            worksheet.set_column('A:A', 6)
-            worksheet.set_column('B:I', 22)
             # 添加标题
-            worksheet.set_row(0, 30)
-            worksheet.merge_range('A1:I1', f'学校大宗食品采购询价单({category.name})', workbook.add_format({
-                'font_size': 16, 
-                'align': 'center', 
-                'valign': 'vcenter'
-            }))
-            # 添加表头
-            worksheet.set_row(2, 30)
+            sheet.title(f'学校大宗食品采购询价单({category.name})', style="ask_title", height=30)
+            sheet.skip()
+            # 添加表头和数据
             header = ['序号', '品牌', '商品名称', '规格', '询价1', '询价2', '平均价格', '下调5%价格', '四舍五入保留两位']
-            worksheet.write_row('A3', header, workbook.add_format({
-                'bold': True,
-                'align': 'center',
-                'valign': 'vcenter',
-                'font_size': 12,
-                'border': 1
-            }))
-            # 添加数据
-            row_start = 3
-            row_for_total = 0
-            for row, record in enumerate(data, start=row_start):
-                worksheet.set_row(row, 25)
-                worksheet.write_row(row, 0, record, workbook.add_format({
-                    'align': 'center',
-                    'valign': 'vcenter',
-                    'font_size': 12,
-                    'border': 1
-                }))
-                row_for_total = row
-            
+            sheet.table(header, data, header_style="ask_header", cell_style="ask_cell", header_height=30, row_height=25)
             # 添加额外信息
-            row_for_total += 3
-            worksheet.set_row(row_for_total, 30)
-            worksheet.merge_range(f'A{row_for_total+1}:D{row_for_total+1}', '询价人员签字：', workbook.add_format({
-                'align': 'left',
-                'valign': 'vcenter',
-                'font_size': 12
-            }))
-            row_for_total += 1
-            worksheet.set_row(row_for_total, 30)
-            worksheet.merge_range(f'A{row_for_total+1}:D{row_for_total+1}', '监督人员签字：', workbook.add_format({
-                'align': 'left',
-                'valign': 'vcenter',
-                'font_size': 12
-            }))
+            sheet.skip(2)
+            sheet.cells([('询价人员签字：', 4, 'ask_sign')], height=30)
+            sheet.cells([('监督人员签字：', 4, 'ask_sign')], height=30)
 
-        
         # 关闭文件
-        workbook.close()
+        output = export.close()
 
         # 返回文件
         today = datetime.datetime.now().strftime('%Y-%m-%d')
-        output.seek(0)
         response = HttpResponse(output, content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
         file_name = f"泸定县学校大宗食品询价清单({today}).xlsx"
         response['Content-Disposition'] = f'attachment; filename="{quote(file_name)}"'
@@ -382,57 +328,62 @@ class PriceCycleViewSet(viewsets.GenericViewSet,
         queryset = queryset.filter(status=True).order_by('id')
         return queryset
 
-    # 创建价格周期时，分情况创建price对象
+    # 创建价格周期时，为每个商品创建price对象，价格沿用该商品最新的价格
     def perform_create(self, serializer):
-        instance = serializer.save()
-        # 获得所有的商品
-        product_queryset = GoodsModel.objects.all()
-        for product in product_queryset:
-            # 使用上一个价格
-            try:
-                old_price_obj = PriceModel.objects.filter(product=product).order_by('-id').first()
-                old_price = old_price_obj.price
-                old_price_check_1 = old_price_obj.price_check_1
-                old_price_check_2 = old_price_obj.price_check_2
-                old_price_check_avg = old_price_obj.price_check_avg
-            except:
-                old_price = 0
-                old_price_check_1 = None
-                old_price_check_2 = None
-                old_price_check_avg = None
-            
-            PriceModel.objects.create(
-                product=product,
-                price=old_price,
-                price_check_1 = old_price_check_1,
-                price_check_2 = old_price_check_2,
-                price_check_avg = old_price_check_avg,
-                cycle=instance,
-                start_date=instance.start_date,
-                end_date=instance.end_date,
-                status=0
-            )
+        with transaction.atomic():
+            instance = serializer.save()
+
+            # 一次查询获得每个商品最新的价格对象
+            latest_ids = PriceModel.objects.values('product').annotate(latest_id=Max('id')).values('latest_id')
+            latest_prices = {
+                price.product_id: price
+                for price in PriceModel.objects.filter(id__in=latest_ids).only('product_id', 'price', 'price_check_1', 'price_check_2', 'price_check_avg')
+            }
+
+            price_list = []
+            for product_id in GoodsModel.objects.values_list('id', flat=True):
+                old_price_obj = latest_prices.get(product_id)
+                price_list.append(PriceModel(
+                    product_id=product_id,
+                    price=old_price_obj.price if old_price_obj else 0,
+                    price_check_1=old_price_obj.price_check_1 if old_price_obj else None,
+                    price_check_2=old_price_obj.price_check_2 if old_price_obj else None,
+                    price_check_avg=old_price_obj.price_check_avg if old_price_obj else None,
+                    cycle=instance,
+                    start_date=instance.start_date,
+                    end_date=instance.end_date,
+                    status=0
+                ))
+            PriceModel.objects.bulk_create(price_list, batch_size=BATCH_SIZE)
+            refresh_effective_prices(cycle_ids=[instance.id])
         
         # 记录操作日志
         log_operate(self.request.user.id, f"创建价格周期{instance.id}")
     
-    # 弃用一个周期，并将该周期的价格对象的状态都设置为-99（已弃用）
+    # 弃用一个周期，并将该周期的价格对象的状态都设置为-99（已弃用），传入dry_run=1时仅返回将被弃用的价格数量
     @action(detail=True, methods=['post'])
     def deprecate(self, request, pk=None):
         price_cycle = self.get_object()
-        price_cycle.status = False
-        price_cycle.creater_id = request.user.id
-        price_queryset = price_cycle.prices.all()
-        for price in price_queryset:
-            price.status = -99
-            price.save()
-        price_cycle.save()
+        price_queryset = price_cycle.prices.exclude(status=-99)
+
+        if request.query_params.get('dry_run') == '1':
+            return Response({"msg": "预览价格周期弃用",
+                                "data": {"count": price_queryset.count()},
+                                "code": status.HTTP_200_OK}, status=status.HTTP_200_OK)
+
+        # 周期和价格的状态在同一个事务中修改
+        with transaction.atomic():
+            count = price_queryset.update(status=-99)
+            refresh_effective_prices(cycle_ids=[price_cycle.id])
+            price_cycle.status = False
+            price_cycle.creater_id = request.user.id
+            price_cycle.save()
 
         # 记录操作日志
         log_operate(request.user.id, f"弃用价格周期{price_cycle.id}")
 
         return Response({"msg": "价格周期弃用成功",
-                            "data": None,
+                            "data": {"count": count},
                             "code": status.HTTP_200_OK}, status=status.HTTP_200_OK)
     
 
@@ -441,76 +392,97 @@ class PriceCycleViewSet(viewsets.GenericViewSet,
         cycle = self.get_object()
         
         # 查询所有绑定了该价格周期的订单
-        order_queryset = OrdersModel.objects.filter(cycle=cycle)
-        if not order_queryset.exists():
+        if not OrdersModel.objects.filter(cycle=cycle).exists():
             return Response({
                 "msg": "所选周期内不存在已下订单",
                 "data": None,
                 "code": status.HTTP_404_NOT_FOUND
             }, status=status.HTTP_404_NOT_FOUND)
 
-        err_list = []
-        for order in order_queryset:
-            details = order.details.all()
-            for detail in details:
-
-                # 获取详情对应的商品对象，如果没有，表示商品被删除，加入到错误列表中
-                try:
-                    product = GoodsModel.objects.get(id=detail.product_id)
-                except:
-                    err_list.append[f"订单ID:{order.id}-详情ID:{detail.id}-商品ID:{detail.product_id}-商品名:{detail.product_name}"]
+        # 各阶段耗时（毫秒）
+        timing = {}
+        phase_start = time.perf_counter()
+
+        # 一次性读取订单详情、详情对应的商品和商品在该周期的价格
+        details = list(OrderDetailModel.objects.filter(order__cycle=cycle).annotate(
+            order_status=F('order__status'), order_deliver_date=F('order__deliver_date'), order_creater_id=F('order__creater_id')).order_by('id'))
+        product_ids = {detail.product_id for detail in details}
+        products = GoodsModel.objects.only('id', 'image', 'license').in_bulk(product_ids)
+        prices = dict(PriceModel.objects.filter(cycle=cycle, product_id__in=product_ids).values_list('product_id', 'price'))
+        timing['load'] = round((time.perf_counter() - phase_start) * 1000)
+        phase_start = time.perf_counter()
+
+        # 复制订单详情使用的图片和资质，每个文件只处理一次
+        copied = {}
+        failed_products = set()
+        os.makedirs(os.path.join(settings.MEDIA_ROOT, 'detail_image', 'goods'), exist_ok=True)
+        os.makedirs(os.path.join(settings.MEDIA_ROOT, 'detail_image', 'license'), exist_ok=True)
+        for product in products.values():
+            for field, folder in [(product.image, 'goods'), (product.license, 'license')]:
+                if not field or field.name in copied:
                     continue
-
-                # 获取详情对应的商品对象，在该价格周期下的价格对象，如果没有，表示价格对象被删除，加入到错误列表中
+                detail_path = os.path.join('detail_image', folder, field.name.split('/')[-1])
                 try:
-                    price = PriceModel.objects.get(cycle=cycle, product=product).price
-                except:
-                    err_list.append[f"订单ID:{order.id}-详情ID:{detail.id}-商品ID:{detail.product_id}-商品名:{detail.product_name}"]
+                    if not os.path.exists(os.path.join(settings.MEDIA_ROOT, detail_path)):
+                        shutil.copyfile(field.path, os.path.join(settings.MEDIA_ROOT, detail_path))
+                except OSError:
+                    failed_products.add(product.id)
                     continue
+                copied[field.name] = detail_path
+        timing['copy'] = round((time.perf_counter() - phase_start) * 1000)
+        phase_start = time.perf_counter()
 
-                # 获取用于订单详情的图片
-                image = product.image
-                if image:
-                    detail_image_path = os.path.join('detail_image', 'goods', image.name.split('/')[-1])
-                    if not os.path.exists(os.path.join(settings.MEDIA_ROOT, detail_image_path)):
-                        shutil.copyfile(product.image.path, os.path.join(settings.MEDIA_ROOT, detail_image_path))
-                else:
-                    detail_image_path = None
-            
-                # 获取用于订单详情的资质
-                license = product.license
-                if license:
-                    detail_license_path = os.path.join('detail_image', 'license', license.name.split('/')[-1])
-                    if not os.path.exists(os.path.join(settings.MEDIA_ROOT, detail_license_path)):
-                        shutil.copyfile(product.license.path, os.path.join(settings.MEDIA_ROOT, detail_license_path))
-                else:
-                    detail_license_path = None
-
-                # 更新订单详情的price,image,license，如果订单已收货，则重新计算总价
-                try:
-                    detail.price = price
-                    detail.image = detail_image_path
-                    detail.license = detail_license_path
-                    if order.status in ["4", "5", "6"]:
-                        detail.cost = float(detail.received_quantity) * float(price)
-                    detail.save()
-                except:
-                    err_list.append[f"订单ID:{order.id}-详情ID:{detail.id}-商品ID:{detail.product_id}-商品名:{detail.product_name}"]
-                    continue
+        # 更新订单详情的price,image,license，如果订单已收货，则重新计算总价
+        err_list = []
+        changed = []
+        for detail in details:
+            # 商品、价格被删除或文件复制失败时，加入到错误列表中
+            product = products.get(detail.product_id)
+            price = prices.get(detail.product_id)
+            if product is None or price is None or product.id in failed_products:
+                err_list.append(f"订单ID:{detail.order_id}-详情ID:{detail.id}-商品ID:{detail.product_id}-商品名:{detail.product_name}")
+                continue
+
+            old = (detail.price, detail.image, detail.license, detail.cost)
+            detail.price = price
+            detail.image = copied[product.image.name] if product.image else None
+            detail.license = copied[product.license.name] if product.license else None
+            if detail.order_status in ["4", "5", "6"] and detail.received_quantity is not None:
+                detail.cost = (detail.received_quantity * price).quantize(Decimal('0.01'))
+            if (detail.price, detail.image, detail.license, detail.cost) != old:
+                changed.append(detail)
+        timing['compute'] = round((time.perf_counter() - phase_start) * 1000)
+        phase_start = time.perf_counter()
+
+        with transaction.atomic():
+            OrderDetailModel.objects.bulk_update(changed, ['price', 'image', 'license', 'cost'], batch_size=BATCH_SIZE)
+            # 价格和总价变化的订单所在日期的日汇总需要刷新
+            refresh_daily_facts({(detail.order_deliver_date, detail.order_creater_id) for detail in changed})
+        timing['write'] = round((time.perf_counter() - phase_start) * 1000)
+
+        report = {
+            "details": len(details),
+            "changed": len(changed),
+            "failed": len(err_list),
+            "copied_files": len(copied),
+            "timing": timing,
+            "err_list": err_list
+        }
         
         # 记录操作日志
-        log_operate(request.user.id, f"更新所有订单详情在价格周期{cycle.id}的价格")
+        log_operate(request.user.id, f"更新所有订单详情在价格周期{cycle.id}的价格，修改{len(changed)}条")
         
+        # 部分更新失败时同样返回更新报告，失败的订单详情在err_list中
         if err_list:
             return Response({
                 "msg": "部分价格更新失败，可能商品或价格被手动删除",
-                "data": err_list,
+                "data": report,
                 "code": status.HTTP_400_BAD_REQUEST
             }, status=status.HTTP_400_BAD_REQUEST)
         else:
             return Response({
                 "msg": "订单商品价格更新完成",
-                "data": None,
+                "data": report,
                 "code": status.HTTP_200_OK
             }, status=status.HTTP_200_OK)
                     
@@ -573,7 +545,9 @@ class PriceViewSet(viewsets.GenericViewSet,
         instance.create_time = datetime.datetime.now()   # 申请时间为当前时间
         instance.reviewer_id = None                      # 审核人清空
         instance.review_time = None                      # 审核时间清空
-        instance.save()     
+        with transaction.atomic():
+            instance.save()
+            refresh_effective_prices(product_ids=[instance.product_id], cycle_ids=[instance.cycle_id])
 
     # 通过某价格请求
     @action(detail=True, methods=['post'])
@@ -583,42 +557,86 @@ class PriceViewSet(viewsets.GenericViewSet,
         price.status = 2
         price.reviewer_id = request.user.id
         price.review_time = datetime.datetime.now()
-        price.save()
+        with transaction.atomic():
+            price.save()
+            refresh_effective_prices(product_ids=[price.product_id], cycle_ids=[price.cycle_id])
         return Response({"msg": "已批准该价格",
                             "data": None,
                             "code": status.HTTP_200_OK}, status=status.HTTP_200_OK)
 
-    # 批量通过某些价格请求,传入价格对象id的列表
+    # 批量审核价格请求，仅修改状态为1（未审核）的价格
+    # 传入price_ids时审核列表中的价格，传入cycle_id时审核该周期内所有未审核的价格
+    def check_review_params(self, request):
+        """
+        校验批量审核的参数，price_ids需为列表，未传入price_ids时cycle_id需为整数，参数错误时返回错误响应
+        """
+        price_list = request.data.get('price_ids')
+        cycle_id = request.data.get('cycle_id')
+        if not price_list and not cycle_id:
+            msg = "未传入价格对象id"
+        elif price_list and not isinstance(price_list, list):
+            msg = "价格对象id列表格式错误"
+        elif not price_list and not str(cycle_id).isdigit():
+            msg = "周期ID格式错误"
+        else:
+            return None
+        return Response({
+            "msg": msg,
+            "data": None,
+            "code": status.HTTP_400_BAD_REQUEST
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    def multireview(self, request, review_status):
+        price_list = request.data.get('price_ids')
+        cycle_id = request.data.get('cycle_id')
+        missing = []
+        wrong_status = []
+
+        queryset = PriceModel.objects.filter(status=1)
+        if price_list:
+            # 一次查询找出不存在的价格和不处于未审核状态的价格
+            price_info = {str(k): (s, p) for k, s, p in PriceModel.objects.filter(id__in=[i for i in price_list if str(i).isdigit()]).values_list('id', 'status', 'product_id')}
+            for price_id in price_list:
+                if str(price_id) not in price_info:
+                    missing.append(price_id)
+                elif price_info[str(price_id)][0] != "1":
+                    wrong_status.append(price_id)
+            queryset = queryset.filter(id__in=[i for i in price_list if str(i) in price_info])
+            # 只需刷新被审核的商品的生效价格
+            refresh_scope = {"product_ids": sorted({p for s, p in price_info.values() if s == "1"})}
+        else:
+            queryset = queryset.filter(cycle_id=int(cycle_id))
+            refresh_scope = {"cycle_ids": [int(cycle_id)]}
+
+        with transaction.atomic():
+            count = queryset.update(status=review_status, reviewer_id=request.user.id, review_time=datetime.datetime.now())
+            if count:
+                refresh_effective_prices(**refresh_scope)
+        return count, missing, wrong_status
+
+    # 批量通过某些价格请求,传入价格对象id的列表，或传入周期id通过该周期所有未审核的价格
     @action(methods=['post'], detail=False)
     def multiaccept(self, request, pk=None):
-        price_list = request.data.get('price_ids')
-        if not price_list:
-            return Response({
-                "msg": "未传入价格对象id",
-                "data": None,
-                "code": status.HTTP_400_BAD_REQUEST
-            }, status=status.HTTP_400_BAD_REQUEST)
-        err_list = []
-        for price_id in price_list:
-            try:
-                price = PriceModel.objects.get(id=price_id)
-                price.status = 2
-                price.reviewer_id = request.user.id
-                price.review_time = datetime.datetime.now()
-                price.save()
-            except:
-                err_list.append(price_id)
-                continue
-        if err_list:
+        err_response = self.check_review_params(request)
+        if err_response:
+            return err_response
+        count, missing, wrong_status = self.multireview(request, 2)
+        if missing or wrong_status:
             return Response({
                 "msg": "部分价格请求批准失败",
-                "data": err_list,
+                "data": {
+                    "count": count,
+                    "missing": missing,
+                    "wrong_status": wrong_status
+                },
                 "code": status.HTTP_200_OK
             },status=status.HTTP_200_OK)
         else:
             return Response({
                 "msg": "价格请求批准成功",
-                "data": None,
+                "data": {
+                    "count": count
+                },
                 "code": status.HTTP_200_OK
             },status=status.HTTP_200_OK)
 
@@ -631,43 +649,37 @@ class PriceViewSet(viewsets.GenericViewSet,
         price.status = -1
         price.reviewer_id = request.user.id
         price.review_time = datetime.datetime.now()
-        price.save()
+        with transaction.atomic():
+            price.save()
+            refresh_effective_prices(product_ids=[price.product_id], cycle_ids=[price.cycle_id])
         return Response({"msg": "已拒绝该价格",
                             "data": None,
                             "code": status.HTTP_200_OK}, status=status.HTTP_200_OK)
     
 
-    # 批量拒绝某些价格请求,传入价格对象id的列表
+    # 批量拒绝某些价格请求,传入价格对象id的列表，或传入周期id拒绝该周期所有未审核的价格
     @action(methods=['post'], detail=False)
     def multireject(self, request, pk=None):
-        price_list = request.data.get('price_ids')
-        if not price_list:
-            return Response({
-                "msg": "未传入价格对象id",
-                "data": None,
-                "code": status.HTTP_400_BAD_REQUEST
-            }, status=status.HTTP_400_BAD_REQUEST)
-        err_list = []
-        for price_id in price_list:
-            try:
-                price = PriceModel.objects.get(id=price_id)
-                price.status = -1
-                price.reviewer_id = request.user.id
-                price.review_time = datetime.datetime.now()
-                price.save()
-            except:
-                err_list.append(price_id)
-                continue
-        if err_list:
+        err_response = self.check_review_params(request)
+        if err_response:
+            return err_response
+        count, missing, wrong_status = self.multireview(request, -1)
+        if missing or wrong_status:
             return Response({
                 "msg": "部分价格请求拒绝失败",
-                "data": err_list,
+                "data": {
+                    "count": count,
+                    "missing": missing,
+                    "wrong_status": wrong_status
+                },
                 "code": status.HTTP_200_OK
             },status=status.HTTP_200_OK)
         else:
             return Response({
                 "msg": "价格请求拒绝成功",
-                "data": None,
+                "data": {
+                    "count": count
+                },
                 "code": status.HTTP_200_OK
             },status=status.HTTP_200_OK)
     
@@ -727,6 +739,18 @@ class PriceViewSet(viewsets.GenericViewSet,
 #             return [IsRole0()]
         
 
+# 报价表格导入任务视图集，仅能查看自己创建的任务
+class UploadJobViewSet(viewsets.GenericViewSet,
+                       myresponse.CustomRetrieveModelMixin):
+    queryset = UploadJobModel.objects.all()
+    serializer_class = UploadJobModelSerializer
+    permission_classes = [IsRole1]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        return queryset.filter(creater_id=self.request.user.id)
+
+
 # 商品种类视图集
 class CategoryViewSet(viewsets.GenericViewSet,
                       myresponse.CustomCreateModelMixin,
@@ -742,6 +766,19 @@ class CategoryViewSet(viewsets.GenericViewSet,
             return [permissions.IsAuthenticated()]
         else:
             return [IsRole0()]
+
+    # 类别列表读取缓存，类别变化后缓存失效
+    def list(self, request, *args, **kwargs):
+        data = cached_catalogue('category', request, lambda: super(CategoryViewSet, self).list(request, *args, **kwargs).data)
+        return Response(data, status=status.HTTP_200_OK)
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        bump_catalogue_version()
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        bump_catalogue_version()
         
 
 
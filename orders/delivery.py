@@ -0,0 +1,58 @@
+from django.db.models import Prefetch
+
+from utils.export import XlsxExport
+from .models import OrderDetailModel
+
+# 送货单标题
+DELIVERY_TITLE = '泸定县粮油购销有限责任公司配送清单'
+
+# 送货单表头
+DELIVERY_HEADERS = ['行号', '品名', '品牌', '规格', '预订数量', '实收数量', '备注']
+
+
+def collect_delivery_rows(queryset, categorys, category_of):
+    """
+    收集订单中待送货的订单详情，按工作表分组，返回 ({工作表名: 行数据列表}, 备注)。
+    category_of将订单详情的类别转换为工作表名，返回的工作表名不在categorys中时跳过该订单详情
+    """
+    category_data = {category: [] for category in categorys}
+    note_list = []
+
+    queryset = queryset.prefetch_related(Prefetch('details', queryset=OrderDetailModel.objects.order_by('id')))
+    for order in queryset:
+        # 跳过已完成和未接单的订单
+        if order.status == '6' or order.status == '0':
+            continue
+        if order.note:
+            note_list.append(f"{order.note}")
+        for detail in order.details.all():
+            category = category_of(detail.category)
+            if category not in category_data:
+                continue
+            data = category_data[category]
+            data.append([len(data) + 1, detail.product_name, detail.brand, detail.description, detail.order_quantity, '', detail.note])
+
+    return category_data, ";".join(note_list)
+
+
+def render_delivery(category_data, school_name, deliver_date, note):
+    """
+    生成送货单，每个类别一张工作表，没有待送货物品的类别不生成工作表。所有类别都为空时返回None
+    """
+    if not any(category_data.values()):
+        return None
+
+    export = XlsxExport()
+    for name, rows in category_data.items():
+        if not rows:
+            continue
+        sheet = export.add_sheet(name, len(DELIVERY_HEADERS), [('A:G', 9)])
+        # 标题和收货单位、配送日期
+        sheet.title(DELIVERY_TITLE, height=33)
+        sheet.cells([('收货单位', 1, 'label'), (school_name, 3, 'label'), ('配送日期', 1, 'label'), (deliver_date, 2, 'label')], height=25)
+        # 表格
+        sheet.table(DELIVERY_HEADERS, rows, header_height=25, row_height=25)
+        # 备注和签字
+        sheet.note('备注', note, height=25)
+        sheet.cells([('送货人', 1, 'label'), ('', 2, None), ('验收人', 1, 'label'), (None, 1, None), ('负责人', 1, 'label')], height=25)
+    return export.close()
@@ -0,0 +1,99 @@
+import datetime
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import Coalesce
+
+from .models import DailyOrderFactModel, OrderDetailModel, OrdersModel
+
+# 批量写入时每批的行数
+BATCH_SIZE = 1000
+
+# 每次刷新的 (送达日期, 学校ID) 个数，避免查询条件过长
+KEYS_CHUNK_SIZE = 200
+
+# 汇总表的维度字段
+FACT_DIMENSIONS = ['day', 'school_id', 'cycle_id', 'category', 'funds', 'status']
+
+# 汇总表的度量字段
+FACT_MEASURES = ['quantity', 'cost', 'amount', 'line_count']
+
+# 订单详情的金额，有总价时为总价，否则为单价乘购入数量
+DETAIL_AMOUNT = Coalesce(
+    'cost',
+    ExpressionWrapper(F('price') * F('order_quantity'), output_field=DecimalField(max_digits=20, decimal_places=4)),
+    output_field=DecimalField(max_digits=20, decimal_places=4)
+)
+
+
+def _keys_filter(keys, day_field, school_field):
+    condition = Q()
+    for day, school_id in keys:
+        condition |= Q(**{day_field: day, school_field: school_id})
+    return condition
+
+
+def compute_daily_facts(keys=None):
+    """
+    根据订单详情计算日汇总，keys为 (送达日期, 学校ID) 的集合，不传入时计算全部
+    """
+    details = OrderDetailModel.objects.all()
+    if keys is not None:
+        details = details.filter(_keys_filter(keys, 'order__deliver_date', 'order__creater_id'))
+    rows = details.values(
+        'category', 'funds', day=F('order__deliver_date'), school_id=F('order__creater_id'),
+        cycle_id=F('order__cycle_id'), status=F('order__status')
+    ).annotate(
+        # 金额需在同名的总价汇总之前计算，否则cost会引用汇总结果
+        amount=Sum(DETAIL_AMOUNT), quantity=Sum('order_quantity'), cost=Sum('cost'), line_count=Count('id')
+    ).order_by()
+    return [DailyOrderFactModel(**row) for row in rows]
+
+
+def refresh_daily_facts(keys=None):
+    """
+    重新计算指定 (送达日期, 学校ID) 的日汇总，不传入时重建全部日汇总。
+    订单详情增删、数量或价格变化，订单状态、送达日期变化后调用
+    """
+    if keys is None:
+        chunks = [None]
+    else:
+        keys = sorted(set(keys), key=lambda key: (key[0] is None, key[0] or datetime.date.min, key[1]))
+        chunks = [keys[i:i + KEYS_CHUNK_SIZE] for i in range(0, len(keys), KEYS_CHUNK_SIZE)]
+
+    count = 0
+    # 通常在订单修改的事务中调用，不再单独创建保存点，出错时随外层事务一起回滚
+    with transaction.atomic(savepoint=False):
+        for chunk in chunks:
+            queryset = DailyOrderFactModel.objects.all()
+            if chunk is not None:
+                queryset = queryset.filter(_keys_filter(chunk, 'day', 'school_id'))
+            queryset.delete()
+            facts = compute_daily_facts(chunk)
+            DailyOrderFactModel.objects.bulk_create(facts, batch_size=BATCH_SIZE)
+            count += len(facts)
+    return count
+
+
+def order_fact_keys(order_ids):
+    """
+    查询订单对应的 (送达日期, 学校ID)
+    """
+    return set(OrdersModel.objects.filter(id__in=order_ids).values_list('deliver_date', 'creater_id'))
+
+
+def refresh_order_facts(order_ids):
+    """
+    重新计算订单所在日期和学校的日汇总
+    """
+    return refresh_daily_facts(order_fact_keys(order_ids))
+
+
+def summarize_daily_facts(queryset, group_by=()):
+    """
+    按指定维度汇总日汇总表，不传入维度时返回一行总计
+    """
+    measures = {field: Sum(field) for field in FACT_MEASURES}
+    if not group_by:
+        return [queryset.aggregate(**measures)]
+    return list(queryset.values(*group_by).annotate(**measures).order_by(*group_by))
@@ -0,0 +1,89 @@
+import re
+import statistics
+import time
+import zipfile
+from decimal import Decimal
+from io import BytesIO
+
+import xlsxwriter
+from django.core.management.base import BaseCommand
+
+from orders.delivery import DELIVERY_HEADERS, DELIVERY_TITLE, render_delivery
+
+CELL_STYLE = {'border': 1, 'font_size': 11, 'align': 'center', 'valign': 'vcenter'}
+LABEL_STYLE = {'align': 'center', 'valign': 'vcenter', 'font_size': 11}
+
+
+def make_rows(count):
+    return [[i, f'商品{i}', '品牌', '10kg/袋', Decimal('12.50'), '', '备注' if i % 3 == 0 else None] for i in range(1, count + 1)]
+
+
+def legacy_delivery(rows, school_name, deliver_date, note):
+    """
+    原送货单的写法：每写入一个单元格或一行都创建一个新的格式对象
+    """
+    output = BytesIO()
+    workbook = xlsxwriter.Workbook(output, {"in_memory": True})
+    worksheet = workbook.add_worksheet(name='粮油类')
+    worksheet.set_column('A:G', 9)
+    worksheet.set_row(0, 33)
+    worksheet.merge_range('A1:G1', DELIVERY_TITLE, workbook.add_format({'align': 'center', 'valign': 'vcenter', 'font_size': 18, 'bold': True}))
+    worksheet.set_row(1, 25)
+    worksheet.write('A2', '收货单位', workbook.add_format(LABEL_STYLE))
+    worksheet.merge_range('B2:D2', school_name, workbook.add_format(LABEL_STYLE))
+    worksheet.write('E2', '配送日期', workbook.add_format(LABEL_STYLE))
+    worksheet.merge_range('F2:G2', deliver_date, workbook.add_format(LABEL_STYLE))
+    worksheet.set_row(2, 25)
+    worksheet.write_row('A3', DELIVERY_HEADERS, workbook.add_format(dict(LABEL_STYLE, border=1)))
+    row_for_total = 0
+    for row, record in enumerate(rows, start=3):
+        worksheet.set_row(row, 25)
+        worksheet.write_row(row, 0, record, workbook.add_format(CELL_STYLE))
+        row_for_total = row
+    row_for_total += 1
+    worksheet.set_row(row_for_total, 25)
+    worksheet.write(f'A{row_for_total+1}', '备注', workbook.add_format(LABEL_STYLE))
+    worksheet.merge_range(f'B{row_for_total+1}:G{row_for_total+1}', note, workbook.add_format({'align': 'left', 'valign': 'vcenter', 'font_size': 11}))
+    row_for_total += 1
+    worksheet.set_row(row_for_total, 25)
+    worksheet.write(f'A{row_for_total+1}', '送货人', workbook.add_format(LABEL_STYLE))
+    worksheet.merge_range(f'B{row_for_total+1}:C{row_for_total+1}', '')
+    worksheet.write(f'D{row_for_total+1}', '验收人', workbook.add_format(LABEL_STYLE))
+    worksheet.write(f'F{row_for_total+1}', '负责人', workbook.add_format(LABEL_STYLE))
+    workbook.close()
+    return output.getvalue()
+
+
+def shared_delivery(rows, school_name, deliver_date, note):
+    """
+    使用共享样式表的送货单
+    """
+    return render_delivery({'粮油类': rows}, school_name, deliver_date, note)
+
+
+def count_styles(content):
+    """
+    统计xlsx文件styles.xml中的单元格格式个数
+    """
+    with zipfile.ZipFile(BytesIO(content)) as archive:
+        styles = archive.read('xl/styles.xml').decode('utf-8')
+    return int(re.search(r'<cellXfs count="(\d+)"', styles).group(1))
+
+
+class Command(BaseCommand):
+    help = '对比逐行创建格式和共享样式表两种方式生成送货单的耗时和文件大小'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000, help='送货单的行数')
+        parser.add_argument('--repeat', type=int, default=5, help='每种方式重复生成的次数')
+
+    def handle(self, *args, **options):
+        rows = make_rows(options['rows'])
+        for name, build in (('逐行创建格式', legacy_delivery), ('共享样式表', shared_delivery)):
+            durations = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                content = build(rows, '测试学校', '2024-09-01', '测试备注')
+                durations.append((time.perf_counter() - start) * 1000)
+            self.stdout.write(f'{name}：{len(rows)}行，平均{statistics.mean(durations):.1f}ms，最快{min(durations):.1f}ms，'
+                              f'文件{len(content) / 1024:.1f}KB，单元格格式{count_styles(content)}个')
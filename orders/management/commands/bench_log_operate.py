@@ -0,0 +1,44 @@
+import statistics
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from orders.models import OrderLogModel
+from utils.logger import flush_operate_log, log_operate
+
+
+def run(count, marker, is_async):
+    """
+    调用count次log_operate，返回每次调用的耗时（毫秒）和包括写入数据库在内的总耗时（秒）
+    """
+    latencies = []
+    with override_settings(OPERATE_LOG_ASYNC=is_async):
+        start = time.perf_counter()
+        for i in range(count):
+            t = time.perf_counter()
+            log_operate(0, f"{marker}{i}")
+            latencies.append((time.perf_counter() - t) * 1000)
+        flush_operate_log()
+        total = time.perf_counter() - start
+    return latencies, total
+
+
+class Command(BaseCommand):
+    help = '对比同步写入和缓冲写入操作日志时每次调用的耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1000, help='写入日志的条数')
+
+    def handle(self, *args, **options):
+        count = options['count']
+        for name, is_async in (('同步写入', False), ('缓冲写入', True)):
+            marker = f"bench-{uuid.uuid4().hex}-"
+            latencies, total = run(count, marker, is_async)
+            written = OrderLogModel.objects.filter(operation__startswith=marker).count()
+            OrderLogModel.objects.filter(operation__startswith=marker).delete()
+            latencies.sort()
+            self.stdout.write(f'{name}：{count}条，单次调用平均{statistics.mean(latencies):.3f}ms，'
+                              f'P50 {latencies[len(latencies) // 2]:.3f}ms，P95 {latencies[int(len(latencies) * 0.95)]:.3f}ms，'
+                              f'含写入数据库总耗时{total:.2f}s，已写入{written}条')
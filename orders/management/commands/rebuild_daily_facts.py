@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from orders.facts import FACT_DIMENSIONS, FACT_MEASURES, compute_daily_facts, refresh_daily_facts
+from orders.models import DailyOrderFactModel
+
+
+def _key(fact):
+    return tuple(getattr(fact, field) for field in FACT_DIMENSIONS)
+
+
+def _row(fact):
+    return tuple(getattr(fact, field) for field in FACT_MEASURES)
+
+
+def find_mismatches():
+    """
+    比对日汇总表与根据订单详情重新计算的结果，返回 (缺少的, 多余的, 不一致的) 三个键列表
+    """
+    expected = {_key(f): _row(f) for f in compute_daily_facts()}
+    actual = {}
+    for fact in DailyOrderFactModel.objects.all():
+        # 同一维度出现多行也视为不一致
+        actual[_key(fact)] = None if _key(fact) in actual else _row(fact)
+    missing = sorted(expected.keys() - actual.keys(), key=str)
+    extra = sorted(actual.keys() - expected.keys(), key=str)
+    wrong = sorted((k for k in expected.keys() & actual.keys() if expected[k] != actual[k]), key=str)
+    return missing, extra, wrong
+
+
+class Command(BaseCommand):
+    help = '根据订单详情重建订单日汇总表，并校验重建结果'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='只校验日汇总表，不重建')
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            count = refresh_daily_facts()
+            self.stdout.write(f'已重建日汇总{count}条')
+
+        missing, extra, wrong = find_mismatches()
+        if missing or extra or wrong:
+            for name, keys in (('缺少', missing), ('多余', extra), ('不一致', wrong)):
+                for key in keys:
+                    self.stdout.write(f'{name}：' + ' '.join(f'{field}={value}' for field, value in zip(FACT_DIMENSIONS, key)))
+            raise CommandError(f'日汇总校验失败：缺少{len(missing)}条，多余{len(extra)}条，不一致{len(wrong)}条')
+        self.stdout.write(self.style.SUCCESS('日汇总校验通过'))
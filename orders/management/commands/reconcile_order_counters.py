@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from orders.models import OrderDetailModel, OrdersModel
+
+
+def counter_subqueries():
+    """
+    根据订单详情计算订单项个数和完成项个数的子查询
+    """
+    details = OrderDetailModel.objects.filter(order=OuterRef('pk')).order_by().values('order')
+    product_num = details.annotate(c=Count('id')).values('c')
+    finish_num = details.filter(received_quantity__isnull=False).annotate(c=Count('id')).values('c')
+    return (Coalesce(Subquery(product_num, output_field=IntegerField()), Value(0)),
+            Coalesce(Subquery(finish_num, output_field=IntegerField()), Value(0)))
+
+
+def find_drift():
+    """
+    一次查询找出订单项个数或完成项个数与订单详情不一致的订单
+    """
+    product_num, finish_num = counter_subqueries()
+    return list(OrdersModel.objects.annotate(real_product_num=product_num, real_finish_num=finish_num)
+                .filter(~Q(product_num=F('real_product_num')) | ~Q(finish_num=F('real_finish_num')))
+                .order_by('id').values('id', 'product_num', 'real_product_num', 'finish_num', 'real_finish_num'))
+
+
+class Command(BaseCommand):
+    help = '根据订单详情修正订单的订单项个数和完成项个数'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='只报告不一致的订单，不做修改')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            drift = find_drift()
+            for row in drift:
+                self.stdout.write(f"订单{row['id']}：订单项个数 {row['product_num']} -> {row['real_product_num']}，"
+                                  f"完成项个数 {row['finish_num']} -> {row['real_finish_num']}")
+
+            if not drift:
+                self.stdout.write(self.style.SUCCESS('所有订单计数一致'))
+                return
+            if options['dry_run']:
+                self.stdout.write(f'共{len(drift)}个订单计数不一致')
+                return
+
+            # 一条UPDATE语句修正所有不一致的订单
+            product_num, finish_num = counter_subqueries()
+            count = OrdersModel.objects.filter(id__in=[row['id'] for row in drift]).update(product_num=product_num, finish_num=finish_num)
+        self.stdout.write(self.style.SUCCESS(f'已修正{count}个订单的计数'))
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:19
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0017_orderlogmodel'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='orderlogmodel',
+            name='operate_time',
+            field=models.DateTimeField(default=datetime.datetime.now, verbose_name='操作时间'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:22
+
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import Coalesce
+
+
+def populate_daily_facts(apps, schema_editor):
+    OrderDetailModel = apps.get_model('orders', 'OrderDetailModel')
+    DailyOrderFactModel = apps.get_model('orders', 'DailyOrderFactModel')
+    amount = Coalesce('cost', ExpressionWrapper(F('price') * F('order_quantity'), output_field=DecimalField(max_digits=20, decimal_places=4)),
+                      output_field=DecimalField(max_digits=20, decimal_places=4))
+    rows = OrderDetailModel.objects.values(
+        'category', 'funds', day=F('order__deliver_date'), school_id=F('order__creater_id'),
+        cycle_id=F('order__cycle_id'), status=F('order__status')
+    ).annotate(amount=Sum(amount), quantity=Sum('order_quantity'), cost=Sum('cost'), line_count=Count('id')).order_by()
+    DailyOrderFactModel.objects.bulk_create([DailyOrderFactModel(**row) for row in rows], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0018_orderlog_operate_time_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyOrderFactModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(blank=True, null=True, verbose_name='送达日期')),
+                ('school_id', models.IntegerField(verbose_name='学校（订单创建人）ID')),
+                ('cycle_id', models.IntegerField(blank=True, null=True, verbose_name='价格周期ID')),
+                ('category', models.CharField(max_length=100, verbose_name='商品类别')),
+                ('funds', models.CharField(max_length=100, verbose_name='经费来源')),
+                ('status', models.CharField(choices=[('0', '待接单'), ('1', '待发货'), ('2', '配送中'), ('3', '配送完成'), ('4', '已收货待复核'), ('5', '订单有疑问'), ('6', '订单完成'), ('-1', '撤销')], max_length=10, verbose_name='订单状态')),
+                ('quantity', models.DecimalField(decimal_places=2, max_digits=14, verbose_name='购入数量合计')),
+                ('cost', models.DecimalField(blank=True, decimal_places=2, max_digits=14, null=True, verbose_name='商品总价合计')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=14, verbose_name='金额合计（无总价时按单价乘数量）')),
+                ('line_count', models.IntegerField(verbose_name='订单项个数')),
+            ],
+            options={
+                'verbose_name': '订单日汇总',
+                'verbose_name_plural': '订单日汇总',
+                'db_table': 'daily_order_fact',
+                'indexes': [models.Index(fields=['day', 'school_id'], name='daily_fact_day_school'), models.Index(fields=['cycle_id', 'status'], name='daily_fact_cycle_status')],
+            },
+        ),
+        migrations.RunPython(populate_daily_facts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:41
+
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import Coalesce
+
+
+def rebuild_daily_facts(apps, schema_editor):
+    # 已有的金额合计保留了两位小数，按订单详情重新计算
+    OrderDetailModel = apps.get_model('orders', 'OrderDetailModel')
+    DailyOrderFactModel = apps.get_model('orders', 'DailyOrderFactModel')
+    amount = Coalesce('cost', ExpressionWrapper(F('price') * F('order_quantity'), output_field=DecimalField(max_digits=20, decimal_places=4)),
+                      output_field=DecimalField(max_digits=20, decimal_places=4))
+    rows = OrderDetailModel.objects.values(
+        'category', 'funds', day=F('order__deliver_date'), school_id=F('order__creater_id'),
+        cycle_id=F('order__cycle_id'), status=F('order__status')
+    ).annotate(amount=Sum(amount), quantity=Sum('order_quantity'), cost=Sum('cost'), line_count=Count('id')).order_by()
+    DailyOrderFactModel.objects.all().delete()
+    DailyOrderFactModel.objects.bulk_create([DailyOrderFactModel(**row) for row in rows], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0019_dailyorderfactmodel'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='dailyorderfactmodel',
+            name='amount',
+            field=models.DecimalField(decimal_places=4, max_digits=18, verbose_name='金额合计（无总价时按单价乘数量）'),
+        ),
+        migrations.RunPython(rebuild_daily_facts, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,5 @@
+import datetime
+
 from django.db import models
 from goods.models import GoodsModel
 from goods.models import PriceCycleModel
@@ -70,10 +72,35 @@ class OrderDetailModel(models.Model):
 
 class OrderLogModel(models.Model):
     operator_id = models.IntegerField(verbose_name="操作人ID")
-    operate_time = models.DateTimeField(auto_now_add=True, verbose_name="操作时间")
+    operate_time = models.DateTimeField(default=datetime.datetime.now, verbose_name="操作时间")
     operation = models.TextField(verbose_name="操作内容")
 
     class Meta:
         db_table = 'order_log'
         verbose_name = '订单日志'
-        verbose_name_plural = verbose_name
\ No newline at end of file
+        verbose_name_plural = verbose_name
+
+class DailyOrderFactModel(models.Model):
+    """
+    订单日汇总表，按送达日期、学校、周期、类别、经费来源和订单状态汇总订单详情，
+    由 orders.facts.refresh_daily_facts 在订单变化时按（日期，学校）增量刷新
+    """
+    day = models.DateField(verbose_name="送达日期", blank=True, null=True)
+    school_id = models.IntegerField(verbose_name="学校（订单创建人）ID")
+    cycle_id = models.IntegerField(verbose_name="价格周期ID", blank=True, null=True)
+    category = models.CharField(max_length=100, verbose_name="商品类别")
+    funds = models.CharField(max_length=100, verbose_name="经费来源")
+    status = models.CharField(max_length=10, choices=OrdersModel.status_choice, verbose_name="订单状态")
+    quantity = models.DecimalField(max_digits=14, decimal_places=2, verbose_name="购入数量合计")
+    cost = models.DecimalField(max_digits=14, decimal_places=2, verbose_name="商品总价合计", blank=True, null=True)
+    amount = models.DecimalField(max_digits=18, decimal_places=4, verbose_name="金额合计（无总价时按单价乘数量）")
+    line_count = models.IntegerField(verbose_name="订单项个数")
+
+    class Meta:
+        db_table = 'daily_order_fact'
+        verbose_name = '订单日汇总'
+        verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['day', 'school_id'], name='daily_fact_day_school'),
+            models.Index(fields=['cycle_id', 'status'], name='daily_fact_cycle_status'),
+        ]
@@ -0,0 +1,82 @@
+import csv
+import json
+import tempfile
+
+import xlsxwriter
+
+# 订单报表支持的文件格式
+REPORT_FORMATS = ["xlsx", "csv", "ndjson"]
+
+# 每次从数据库读取的行数
+REPORT_CHUNK_SIZE = 2000
+
+# 报表的列名与查询字段
+REPORT_COLUMNS = {
+    "商品编号": "product_id",
+    "订单编号": "order_id",
+    "商品名称": "product_name",
+    "商品规格": "description",
+    "商品品牌": "brand",
+    "商品种类": "category",
+    "商品单价": "price",
+    "经费来源": "funds",
+    "订购数量": "order_quantity",
+    "实收数量": "received_quantity",
+    "总价": "cost",
+    "下单时间": "order__create_time",
+    "送货日期": "order__deliver_date",
+    "收货时间": "recipient_time",
+    "学校": "school_name",
+    "备注": "note",
+}
+
+_TIME_COLUMNS = [list(REPORT_COLUMNS).index(name) for name in ["下单时间", "收货时间"]]
+_DATE_COLUMN = list(REPORT_COLUMNS).index("送货日期")
+
+
+def format_row(row):
+    """
+    将一行查询结果转换为报表中的值，时间去掉微秒，日期转换为字符串
+    """
+    row = list(row)
+    for i in _TIME_COLUMNS:
+        row[i] = str(row[i]).split(".")[0] if row[i] else None
+    row[_DATE_COLUMN] = str(row[_DATE_COLUMN])
+    return row
+
+
+def write_report_xlsx(rows):
+    """
+    以constant_memory模式将报表逐行写入临时文件，返回已定位到开头的文件对象，文件关闭后自动删除
+    """
+    output = tempfile.TemporaryFile()
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    worksheet = workbook.add_worksheet('Sheet1')
+    worksheet.write_row(0, 0, list(REPORT_COLUMNS), workbook.add_format({'bold': True, 'border': 1, 'align': 'center'}))
+    for row_num, row in enumerate(rows, start=1):
+        worksheet.write_row(row_num, 0, format_row(row))
+    workbook.close()
+    output.seek(0)
+    return output
+
+
+class _Echo:
+    """
+    csv.writer的写入对象，直接返回写入的内容
+    """
+    def write(self, value):
+        return value
+
+
+def stream_report_csv(rows):
+    writer = csv.writer(_Echo())
+    # 带BOM以便Excel正确识别中文
+    yield '﻿' + writer.writerow(list(REPORT_COLUMNS))
+    for row in rows:
+        yield writer.writerow(format_row(row))
+
+
+def stream_report_ndjson(rows):
+    names = list(REPORT_COLUMNS)
+    for row in rows:
+        yield json.dumps(dict(zip(names, format_row(row))), ensure_ascii=False, default=str) + '\n'
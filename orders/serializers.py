@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from .models import *
 from goods.models import GoodsModel, PriceModel
+from goods.prices import get_effective_price
 import datetime
 import os
 
@@ -16,28 +17,22 @@ class CartModelSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
-        try:
-            product = instance.product
-        except:
-            instance.delete()
-            raise serializers.ValidationError(f"商品不存在，刷新以删除购物车商品")
+        product = instance.product
         data['product_name'] = product.name
         data['product_id'] = data.pop('product')
         data['description'] = product.description
         data['category'] = product.category.name
         data['brand'] = product.brand
         data['image'] = self.context['request'].build_absolute_uri(product.image.url) if product.image else None
-        try:
-            now_time = datetime.datetime.now()
-            # now_time = "2024-07-18"
-            price = product.prices.filter(status=2, start_date__lte=now_time, end_date__gte=now_time).order_by('-id').first()
-            data['price'] = price.price  # Convert to integer
-        except:
-            # instance.delete()
-            # raise serializers.ValidationError(f"{product.name}不存在可用价格，刷新以删除购物车商品")
-            data['price'] = 0
-        data['funds'] = instance.funds.name
-        data['tolto_price'] = round(float(data['price']) * float(data['quantity']), 2)  # Convert to floats and round to 2 decimal places
+        # 列表查询时已在queryset中附带当前价格和总价
+        if hasattr(instance, 'tolto_price'):
+            data['price'] = instance.price
+            data['tolto_price'] = instance.tolto_price
+        else:
+            price = get_effective_price(product.id, datetime.date.today())
+            data['price'] = price if price is not None else 0
+            data['tolto_price'] = round(float(data['price']) * float(data['quantity']), 2)  # Convert to floats and round to 2 decimal places
+        data['funds'] = instance.funds.name if instance.funds else None
         return data
     
 class CartPatchSerializer(serializers.ModelSerializer):
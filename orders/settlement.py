@@ -0,0 +1,95 @@
+import copy
+import datetime
+import os
+import threading
+from io import BytesIO
+
+from django.conf import settings
+from django.db.models import Sum
+
+# 经费结算单模板
+FUNDS_TEMPLATE = 'funds_template.docx'
+
+# 已解析的模板，以模板路径为键，值为 (修改时间, Document)，模板文件被替换后重新解析
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def get_funds_template():
+    """
+    获取经费结算单模板的副本。模板在每个进程中只解析一次，每次请求深拷贝已解析的文档，不再读取和解析文件
+    """
+    from docx import Document
+
+    template_path = os.path.join(settings.MEDIA_ROOT, FUNDS_TEMPLATE)
+    mtime = os.path.getmtime(template_path)
+    with _templates_lock:
+        cached = _templates.get(template_path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, Document(template_path))
+            _templates[template_path] = cached
+        return copy.deepcopy(cached[1])
+
+
+def funds_breakdown(queryset):
+    """
+    从日汇总查询集中按经费来源汇总总价，返回 {经费来源: 总价}
+    """
+    rows = queryset.values('funds').annotate(total=Sum('cost')).order_by('funds')
+    return {row['funds']: row['total'] or 0 for row in rows}
+
+
+def school_funds_breakdown(queryset):
+    """
+    从日汇总查询集中按学校和经费来源汇总总价，返回 {学校ID: {经费来源: 总价}}
+    """
+    result = {}
+    rows = queryset.values('school_id', 'funds').annotate(total=Sum('cost')).order_by('school_id', 'funds')
+    for row in rows:
+        result.setdefault(row['school_id'], {})[row['funds']] = row['total'] or 0
+    return result
+
+
+def _set_cell(cell, text):
+    from docx.shared import Pt  # 用于设置字体大小
+    from docx.oxml.ns import qn  # 用于设置字体
+
+    cell.text = ''
+    run = cell.paragraphs[0].add_run(text)
+    run.font.name = '宋体'  # 设置字体
+    run._element.rPr.rFonts.set(qn('w:eastAsia'), '宋体')  # 强制设置中文字体为宋体
+    run.font.size = Pt(11)  # 设置字体大小为11号
+
+
+def render_funds_settlement(school_name, start_date, end_date, funds_dic):
+    """
+    根据模板生成学校在一段时间内的经费结算单，返回docx文件内容
+    """
+    doc = get_funds_template()
+
+    # 生成日期表示
+    start_date2 = datetime.datetime.strptime(start_date, "%Y-%m-%d").strftime("%Y 年 %m 月 %d 日")
+    end_date2 = datetime.datetime.strptime(end_date, "%Y-%m-%d").strftime("%Y 年 %m 月 %d 日")
+    date = f"{start_date2}  ------------ {end_date2}"
+
+    total = sum(funds_dic.values())
+
+    # 遍历文档中的所有表格
+    for table in doc.tables:
+        for row in table.rows:
+            if row.cells[0].text == "学校名称":
+                _set_cell(row.cells[1], school_name)
+            if row.cells[0].text == "结算时间":
+                _set_cell(row.cells[1], date)
+            if row.cells[0].text == "结算资金（元）":
+                if row.cells[1].text == "以上四项合计金额：":
+                    _set_cell(row.cells[1], row.cells[1].text + str(total))
+                else:
+                    # 使用经费字段名和模板进行匹配
+                    for k, v in funds_dic.items():
+                        if k in row.cells[1].text:
+                            _set_cell(row.cells[1], row.cells[1].text + str(v))
+
+    output = BytesIO()
+    doc.save(output)
+    return output.getvalue()
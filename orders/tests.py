@@ -1,3 +1,690 @@
-from django.test import TestCase
+import datetime
+import hashlib
+import io
+import json
+import re
+import threading
+import unittest
+import zipfile
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import openpyxl
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from account.models import AccountModel
+from goods.models import CategoryModel, GoodsModel, PriceCycleModel, PriceModel
+from goods.prices import refresh_effective_prices
+from orders.delivery import DELIVERY_HEADERS, DELIVERY_TITLE
+from orders.facts import refresh_order_facts
+from orders.models import CartModel, FundsModel, OrderDetailModel, OrdersModel
+from orders.reports import REPORT_COLUMNS
+from utils.idempotency import IN_PROGRESS
+
+
+def create_client(user):
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+def create_catalogue(count, user_id):
+    """
+    创建覆盖今天之后一个月的价格周期和count个已审核价格的商品
+    """
+    today = datetime.date.today()
+    cycle = PriceCycleModel.objects.create(name='测试周期', start_date=today - datetime.timedelta(days=1),
+                                           end_date=today + datetime.timedelta(days=30), creater_id=user_id)
+    category = CategoryModel.objects.create(name='粮油类')
+    goods = []
+    for i in range(count):
+        product = GoodsModel.objects.create(name=f'商品{i}', description='10kg', brand='品牌', category=category)
+        PriceModel.objects.create(product=product, price='12.50', cycle=cycle, start_date=cycle.start_date,
+                                  end_date=cycle.end_date, status=2)
+        goods.append(product)
+    refresh_effective_prices()
+    return cycle, goods
+
+
+def create_order(school_id, goods, cycle, status="0", quantity=2, deliver_date=None):
+    """
+    直接创建包含goods中每个商品的订单并刷新日汇总
+    """
+    order = OrdersModel.objects.create(status=status, creater_id=school_id, cycle=cycle, product_num=len(goods),
+                                       deliver_date=deliver_date or datetime.date.today() + datetime.timedelta(days=3))
+    OrderDetailModel.objects.bulk_create([
+        OrderDetailModel(order=order, product_id=product.id, product_name=product.name, category='粮油类', funds='营养餐',
+                         price='12.50', order_quantity=quantity)
+        for product in goods
+    ])
+    refresh_order_facts([order.id])
+    return order
+
+
+@override_settings(OPERATE_LOG_ASYNC=False, CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PurchaseTests(TestCase):
+    def setUp(self):
+        self.school = AccountModel.objects.create_user(username='school', password='x', role='2')
+        self.cycle, self.goods = create_catalogue(3, self.school.id)
+        self.funds = FundsModel.objects.create(name='营养餐')
+        self.client = create_client(self.school)
+        self.deliver_date = datetime.date.today() + datetime.timedelta(days=3)
+
+    def add_cart(self, product, quantity=2, funds=True):
+        return CartModel.objects.create(product=product, funds=self.funds if funds else None, quantity=quantity, creater_id=self.school.id)
+
+    def purchase(self, carts, **data):
+        data.update(cart_ids=[cart.id for cart in carts], deliver_date=str(self.deliver_date))
+        return self.client.post('/api/cart/purchase/', data, format='json')
+
+    def test_purchase_creates_order_and_clears_cart(self):
+        carts = [self.add_cart(product, quantity=i + 1) for i, product in enumerate(self.goods)]
+
+        response = self.purchase(carts, note='上午送达')
+
+        self.assertEqual(response.status_code, 200)
+        order = OrdersModel.objects.get(creater_id=self.school.id)
+        self.assertEqual((order.status, order.deliver_date, order.cycle_id, order.product_num, order.note),
+                         ("0", self.deliver_date, self.cycle.id, 3, '上午送达'))
+        details = list(OrderDetailModel.objects.filter(order=order).order_by('product_id'))
+        self.assertEqual([(d.product_id, d.order_quantity, d.price, d.funds, d.category) for d in details],
+                         [(product.id, Decimal(i + 1), Decimal('12.50'), '营养餐', '粮油类') for i, product in enumerate(self.goods)])
+        self.assertFalse(CartModel.objects.exists())
+        call_command('rebuild_daily_facts', '--check', stdout=io.StringIO())
+
+    def test_purchase_merges_into_pending_order(self):
+        self.purchase([self.add_cart(self.goods[0])], note='第一次')
+        response = self.purchase([self.add_cart(self.goods[1])], note='第二次')
+
+        self.assertEqual(response.status_code, 200)
+        order = OrdersModel.objects.get(creater_id=self.school.id)
+        self.assertEqual(order.product_num, 2)
+        self.assertEqual(order.note, '第一次;第二次')
+
+    def test_missing_cart_fails_whole_purchase(self):
+        cart = self.add_cart(self.goods[0])
+
+        response = self.client.post('/api/cart/purchase/', {'cart_ids': [cart.id, cart.id + 100], 'deliver_date': str(self.deliver_date)}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(OrdersModel.objects.exists())
+        self.assertTrue(CartModel.objects.filter(id=cart.id).exists())
+
+    def test_same_carts_purchased_twice(self):
+        carts = [self.add_cart(product) for product in self.goods]
+
+        first = self.purchase(carts)
+        second = self.purchase(carts)
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 400)
+        order = OrdersModel.objects.get(creater_id=self.school.id)
+        self.assertEqual(OrderDetailModel.objects.filter(order=order).count(), 3)
+        self.assertEqual(order.product_num, 3)
+
+    def test_expired_and_unfunded_items_are_reported(self):
+        self.goods[1].status = False
+        self.goods[1].save()
+        carts = [self.add_cart(self.goods[0]), self.add_cart(self.goods[1]), self.add_cart(self.goods[2], funds=False)]
+
+        response = self.purchase(carts)
+
+        # 没有经费来源的商品下单失败并保留在购物车中，下架商品的购物车项被删除
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data'], [self.goods[2].name])
+        self.assertEqual(list(CartModel.objects.values_list('id', flat=True)), [carts[2].id])
+        order = OrdersModel.objects.get(creater_id=self.school.id)
+        self.assertEqual(list(OrderDetailModel.objects.filter(order=order).values_list('product_id', flat=True)), [self.goods[0].id])
+
+    def test_all_unfunded_items_create_no_order(self):
+        response = self.purchase([self.add_cart(self.goods[0], funds=False)])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(OrdersModel.objects.exists())
+
+
+@override_settings(OPERATE_LOG_ASYNC=False, CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.school = AccountModel.objects.create_user(username='school', password='x', role='2')
+        self.cycle, self.goods = create_catalogue(2, self.school.id)
+        self.funds = FundsModel.objects.create(name='营养餐')
+        self.client = create_client(self.school)
+        self.cart = CartModel.objects.create(product=self.goods[0], funds=self.funds, quantity=2, creater_id=self.school.id)
+        self.data = {'cart_ids': [self.cart.id], 'deliver_date': str(datetime.date.today() + datetime.timedelta(days=3))}
+
+    def purchase(self, data, key='key-1'):
+        return self.client.post('/api/cart/purchase/', data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def cache_key(self, key='key-1'):
+        return f'idempotency:{self.school.id}:POST:/api/cart/purchase/:{hashlib.md5(key.encode("utf-8")).hexdigest()}'
+
+    def test_retry_replays_first_response(self):
+        first = self.purchase(self.data)
+
+        with CaptureQueriesContext(connection) as ctx:
+            second = self.purchase(self.data)
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual((second.status_code, second.data), (first.status_code, first.data))
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        # 重复请求不会执行视图
+        self.assertEqual(len(ctx.captured_queries), 0)
+        self.assertEqual(OrderDetailModel.objects.count(), 1)
+
+    def test_key_reused_with_other_data(self):
+        self.purchase(self.data)
+        response = self.purchase(dict(self.data, note='备注'))
+
+        self.assertEqual(response.status_code, 422)
+
+    def test_request_in_progress(self):
+        cache.set(self.cache_key(), IN_PROGRESS)
+
+        response = self.purchase(self.data)
+
+        self.assertEqual(response.status_code, 409)
+        self.assertTrue(CartModel.objects.filter(id=self.cart.id).exists())
+
+    @override_settings(IDEMPOTENCY_IN_PROGRESS_TTL=1200)
+    def test_in_progress_marker_uses_configured_ttl(self):
+        with mock.patch.object(cache, 'add', wraps=cache.add) as add:
+            self.purchase(self.data)
+
+        add.assert_called_once_with(self.cache_key(), IN_PROGRESS, 1200)
+
+    def test_error_releases_key(self):
+        with mock.patch('orders.views.get_effective_prices', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.purchase(self.data)
+        self.assertIsNone(cache.get(self.cache_key()))
+
+        response = self.purchase(self.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Idempotent-Replayed', response)
+
+
+@override_settings(OPERATE_LOG_ASYNC=False, CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ConfirmTests(TestCase):
+    def setUp(self):
+        self.company = AccountModel.objects.create_user(username='company', password='x', role='0')
+        self.school = AccountModel.objects.create_user(username='school', password='x', role='2')
+        self.cycle, self.goods = create_catalogue(20, self.company.id)
+        self.client = create_client(self.company)
+
+    def confirm(self, order, recv):
+        return self.client.post(f'/api/orders/{order.id}/confirm/', {'recv': recv}, format='json')
+
+    def test_partial_receipt_keeps_status(self):
+        order = create_order(self.school.id, self.goods[:2], self.cycle, status="3")
+        detail = OrderDetailModel.objects.filter(order=order).order_by('id').first()
+
+        response = self.confirm(order, [{'id': detail.id, 'received_quantity': '1.5'}])
+
+        self.assertEqual(response.status_code, 200)
+        order.refresh_from_db()
+        detail.refresh_from_db()
+        self.assertEqual((order.status, order.finish_num), ("3", 1))
+        self.assertEqual((detail.received_quantity, detail.cost, detail.recipient_id), (Decimal('1.50'), Decimal('18.75'), self.company.id))
+        call_command('rebuild_daily_facts', '--check', stdout=io.StringIO())
+
+    def test_full_receipt_reports_invalid_items(self):
+        order = create_order(self.school.id, self.goods[:2], self.cycle, status="3")
+        other = create_order(self.school.id, self.goods[2:3], self.cycle, status="3", deliver_date=datetime.date.today() + datetime.timedelta(days=4))
+        first, second = OrderDetailModel.objects.filter(order=order).order_by('id')
+        foreign = OrderDetailModel.objects.get(order=other)
+
+        response = self.confirm(order, [{'id': first.id, 'received_quantity': 1}, {'id': second.id, 'received_quantity': 2},
+                                        {'id': foreign.id, 'received_quantity': 2}, {'id': 'x', 'received_quantity': 2},
+                                        {'id': first.id, 'received_quantity': 'abc'}])
+
+        # 不属于该订单的订单详情和格式错误的数据收货失败，其余订单详情收货成功
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data'], [foreign.id, 'x', first.id])
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.finish_num), ("4", 2))
+        foreign.refresh_from_db()
+        self.assertIsNone(foreign.received_quantity)
+        call_command('rebuild_daily_facts', '--check', stdout=io.StringIO())
+
+    def test_wrong_status_is_rejected(self):
+        order = create_order(self.school.id, self.goods[:1], self.cycle, status="1")
+        detail = OrderDetailModel.objects.get(order=order)
+
+        response = self.confirm(order, [{'id': detail.id, 'received_quantity': 1}])
+
+        self.assertEqual(response.status_code, 400)
+        detail.refresh_from_db()
+        self.assertIsNone(detail.received_quantity)
+
+    def test_query_count_does_not_grow_with_items(self):
+        def count_queries(goods, deliver_days):
+            order = create_order(self.school.id, goods, self.cycle, status="3",
+                                 deliver_date=datetime.date.today() + datetime.timedelta(days=deliver_days))
+            recv = [{'id': detail_id, 'received_quantity': 2} for detail_id in OrderDetailModel.objects.filter(order=order).values_list('id', flat=True)]
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.confirm(order, recv).status_code, 200)
+            return len(ctx.captured_queries)
+
+        self.assertEqual(count_queries(self.goods[:2], 3), count_queries(self.goods[2:], 4))
+
+
+@override_settings(OPERATE_LOG_ASYNC=False, CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TransitionTests(TestCase):
+    def setUp(self):
+        self.company = AccountModel.objects.create_user(username='company', password='x', role='0')
+        self.school = AccountModel.objects.create_user(username='school', password='x', role='2')
+        self.cycle, self.goods = create_catalogue(20, self.company.id)
+        self.client = create_client(self.company)
+
+    def test_accept_query_count(self):
+        order = create_order(self.school.id, self.goods, self.cycle)
+
+        # 保存点、条件更新、查询订单日期和学校、删除并重新计算写入日汇总、释放保存点、写入日志
+        with self.assertNumQueries(8):
+            response = self.client.post(f'/api/orders/{order.id}/accept/')
+
+        self.assertEqual(response.status_code, 200)
+        call_command('rebuild_daily_facts', '--check', stdout=io.StringIO())
+
+    def test_failed_accept_does_not_refresh_facts(self):
+        order = create_order(self.school.id, self.goods, self.cycle, status="1")
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(f'/api/orders/{order.id}/accept/')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse([q for q in ctx.captured_queries if 'daily_order_fact' in q['sql']])
+
+    def test_batch_refreshes_facts_once(self):
+        def count_queries(count, first_day):
+            orders = [create_order(self.school.id, self.goods, self.cycle, deliver_date=datetime.date.today() + datetime.timedelta(days=first_day + i))
+                      for i in range(count)]
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.post('/api/orders/transition/', {'order_ids': [order.id for order in orders], 'status': '1'}, format='json')
+            self.assertEqual(response.data['data']['count'], count)
+            return len(ctx.captured_queries)
+
+        self.assertEqual(count_queries(2, 3), count_queries(20, 10))
+        call_command('rebuild_daily_facts', '--check', stdout=io.StringIO())
+
+
+@override_settings(OPERATE_LOG_ASYNC=False, CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class BatchTransitionTests(TestCase):
+    def setUp(self):
+        self.company = AccountModel.objects.create_user(username='company', password='x', role='0')
+        self.school = AccountModel.objects.create_user(username='school', password='x', role='2')
+        self.other = AccountModel.objects.create_user(username='other', password='x', role='2')
+        self.cycle, self.goods = create_catalogue(1, self.company.id)
+
+    def transition(self, user, order_ids, target):
+        return create_client(user).post('/api/orders/transition/', {'order_ids': order_ids, 'status': target}, format='json')
+
+    def test_accept_reports_missing_and_wrong_status(self):
+        pending = [create_order(self.school.id, self.goods, self.cycle, deliver_date=datetime.date.today() + datetime.timedelta(days=i))
+                   for i in range(3, 5)]
+        accepted = create_order(self.school.id, self.goods, self.cycle, status="1")
+
+        response = self.transition(self.company, [pending[0].id, pending[1].id, pending[0].id, accepted.id, 999999, 'x'], "1")
+
+        self.assertEqual(response.status_code, 200)
+        data = response.data['data']
+        self.assertEqual(data['success'], [pending[0].id, pending[1].id])
+        self.assertEqual(data['missing'], [999999, 'x'])
+        self.assertEqual(data['wrong_status'], [accepted.id])
+        for order in pending:
+            order.refresh_from_db()
+            self.assertEqual((order.status, order.accepter_id), ("1", self.company.id))
+            self.assertIsNotNone(order.accept_time)
+        call_command('rebuild_daily_facts', '--check', stdout=io.StringIO())
+
+    def test_school_only_changes_own_orders(self):
+        own = create_order(self.school.id, self.goods, self.cycle, status="4")
+        others = create_order(self.other.id, self.goods, self.cycle, status="4")
+
+        response = self.transition(self.school, [own.id, others.id], "6")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['success'], [own.id])
+        self.assertEqual(response.data['data']['missing'], [others.id])
+        own.refresh_from_db()
+        others.refresh_from_db()
+        self.assertEqual((own.status, others.status), ("6", "4"))
+        self.assertIsNotNone(own.finish_time)
+
+    def test_invalid_requests(self):
+        order = create_order(self.school.id, self.goods, self.cycle)
+
+        self.assertEqual(self.transition(self.school, [order.id], "1").status_code, 403)
+        self.assertEqual(self.transition(self.company, [order.id], "-1").status_code, 400)
+        self.assertEqual(self.transition(self.company, order.id, "1").status_code, 400)
+        order.refresh_from_db()
+        self.assertEqual(order.status, "0")
+
+
+@override_settings(OPERATE_LOG_ASYNC=False, CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ConcurrentPurchaseTests(TransactionTestCase):
+    """
+    同一学校同时下单同一送达日期时，只能创建一个待接单的订单
+    """
+    THREADS = 8
+
+    def setUp(self):
+        self.school = AccountModel.objects.create_user(username='school', password='x', role='2')
+        self.cycle, self.goods = create_catalogue(self.THREADS, self.school.id)
+        self.funds = FundsModel.objects.create(name='营养餐')
+        self.deliver_date = datetime.date.today() + datetime.timedelta(days=3)
+
+    @unittest.skipUnless(connection.features.has_select_for_update, '数据库不支持SELECT ... FOR UPDATE')
+    def test_parallel_purchases_merge_into_one_order(self):
+        carts = [CartModel.objects.create(product=product, funds=self.funds, quantity=2, creater_id=self.school.id)
+                 for product in self.goods]
+        barrier = threading.Barrier(self.THREADS)
+        responses = []
+
+        def purchase(cart):
+            try:
+                client = create_client(self.school)
+                barrier.wait(timeout=30)
+                responses.append(client.post('/api/cart/purchase/', {'cart_ids': [cart.id], 'deliver_date': str(self.deliver_date)}, format='json'))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=purchase, args=(cart,)) for cart in carts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([response.status_code for response in responses], [200] * self.THREADS)
+        orders = OrdersModel.objects.filter(creater_id=self.school.id, status="0")
+        self.assertEqual(orders.count(), 1)
+        order = orders.get()
+        product_ids = list(OrderDetailModel.objects.filter(order=order).values_list('product_id', flat=True))
+        self.assertEqual(sorted(product_ids), sorted(product.id for product in self.goods))
+        self.assertEqual(order.product_num, self.THREADS)
+        self.assertFalse(CartModel.objects.filter(creater_id=self.school.id).exists())
+
+    @unittest.skipUnless(connection.features.has_select_for_update, '数据库不支持SELECT ... FOR UPDATE')
+    def test_parallel_purchases_of_same_carts_create_details_once(self):
+        carts = [CartModel.objects.create(product=product, funds=self.funds, quantity=2, creater_id=self.school.id)
+                 for product in self.goods]
+        cart_ids = [cart.id for cart in carts]
+        barrier = threading.Barrier(self.THREADS)
+        responses = []
+
+        def purchase():
+            try:
+                client = create_client(self.school)
+                barrier.wait(timeout=30)
+                responses.append(client.post('/api/cart/purchase/', {'cart_ids': cart_ids, 'deliver_date': str(self.deliver_date)}, format='json'))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=purchase) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # 只有一个请求下单成功，其余请求读不到已被删除的购物车项
+        self.assertEqual(sorted(response.status_code for response in responses), [200] + [400] * (self.THREADS - 1))
+        order = OrdersModel.objects.get(creater_id=self.school.id)
+        self.assertEqual(OrderDetailModel.objects.filter(order=order).count(), self.THREADS)
+        self.assertEqual(order.product_num, self.THREADS)
+
+
+@override_settings(OPERATE_LOG_ASYNC=False, CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ReportTests(TestCase):
+    def setUp(self):
+        self.company = AccountModel.objects.create_user(username='company', password='x', role='0')
+        self.school = AccountModel.objects.create_user(username='school', password='x', role='2', first_name='第一小学')
+        self.other = AccountModel.objects.create_user(username='other', password='x', role='2', first_name='第二小学')
+        self.cycle, self.goods = create_catalogue(30, self.company.id)
+        self.deliver_date = datetime.date.today() + datetime.timedelta(days=3)
+        self.day = str(self.deliver_date)
+
+    def report(self, user, report_format, **data):
+        data.update(start_date=self.day, end_date=self.day, format=report_format)
+        return create_client(user).post('/api/orders/report/', data, format='json')
+
+    def ndjson_rows(self, response):
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content).decode('utf-8')
+        return [json.loads(line) for line in content.splitlines()]
+
+    def test_ndjson_orders_by_school(self):
+        create_order(self.other.id, self.goods[:1], self.cycle, deliver_date=self.deliver_date)
+        create_order(self.school.id, self.goods[1:3], self.cycle, deliver_date=self.deliver_date)
+
+        rows = self.ndjson_rows(self.report(self.company, 'ndjson'))
+
+        self.assertEqual([row['学校'] for row in rows], ['第一小学', '第一小学', '第二小学'])
+        self.assertEqual(rows[0]['商品名称'], self.goods[1].name)
+        self.assertEqual((rows[0]['送货日期'], rows[0]['收货时间'], rows[0]['商品单价']), (self.day, None, '12.50'))
+
+    def test_school_sees_only_own_rows(self):
+        create_order(self.other.id, self.goods[:1], self.cycle, deliver_date=self.deliver_date)
+        create_order(self.school.id, self.goods[1:3], self.cycle, deliver_date=self.deliver_date)
+
+        response = self.report(self.school, 'csv')
+
+        self.assertEqual(response.status_code, 200)
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(lines[0], '\ufeff' + ','.join(REPORT_COLUMNS))
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(self.report(self.school, 'csv', school_id=self.other.id).status_code, 401)
+
+    def test_xlsx(self):
+        create_order(self.school.id, self.goods[:2], self.cycle, deliver_date=self.deliver_date)
+
+        response = self.report(self.company, 'xlsx', school_id=self.school.id)
+
+        self.assertEqual(response.status_code, 200)
+        workbook = openpyxl.load_workbook(io.BytesIO(b''.join(response.streaming_content)), read_only=True)
+        rows = list(workbook.active.iter_rows(values_only=True))
+        self.assertEqual(list(rows[0]), list(REPORT_COLUMNS))
+        self.assertEqual(len(rows), 3)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        def count_queries(goods, days):
+            deliver_date = datetime.date.today() + datetime.timedelta(days=days)
+            create_order(self.school.id, goods, self.cycle, deliver_date=deliver_date)
+            with CaptureQueriesContext(connection) as ctx:
+                response = create_client(self.company).post('/api/orders/report/', {'start_date': str(deliver_date), 'end_date': str(deliver_date),
+                                                                                      'format': 'ndjson'}, format='json')
+                self.assertEqual(len(self.ndjson_rows(response)), len(goods))
+            return len(ctx.captured_queries)
+
+        self.assertEqual(count_queries(self.goods[:2], 5), count_queries(self.goods[2:], 6))
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.report(self.company, 'ndjson').status_code, 400)
+        create_order(self.school.id, self.goods[:1], self.cycle, deliver_date=self.deliver_date)
+        self.assertEqual(self.report(self.company, 'pdf').status_code, 400)
+
+
+def count_cell_formats(content):
+    """
+    xlsx文件styles.xml中的单元格格式个数
+    """
+    with zipfile.ZipFile(io.BytesIO(content)) as archive:
+        styles = archive.read('xl/styles.xml').decode('utf-8')
+    return int(re.search(r'<cellXfs count="(\d+)"', styles).group(1))
+
+
+@override_settings(OPERATE_LOG_ASYNC=False, CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class DeliveryTests(TestCase):
+    def setUp(self):
+        self.company = AccountModel.objects.create_user(username='company', password='x', role='0')
+        self.school = AccountModel.objects.create_user(username='school', password='x', role='2', first_name='第一小学')
+        self.cycle, self.goods = create_catalogue(60, self.company.id)
+        self.client = create_client(self.company)
+        self.deliver_date = datetime.date.today() + datetime.timedelta(days=3)
+
+    def gendeliver(self):
+        return self.client.post('/api/orders/gendeliver/', {'deliver_date': str(self.deliver_date), 'school_id': self.school.id}, format='json')
+
+    def test_sheets_per_category(self):
+        order = create_order(self.school.id, self.goods[:3], self.cycle, status="1", deliver_date=self.deliver_date)
+        OrdersModel.objects.filter(id=order.id).update(note='上午送达')
+        OrderDetailModel.objects.filter(order=order, product_id=self.goods[2].id).update(category='调味品类', note='少盐')
+        # 未接单的订单不在送货单中
+        create_order(self.school.id, self.goods[3:4], self.cycle, deliver_date=self.deliver_date + datetime.timedelta(days=1))
+
+        response = self.gendeliver()
+
+        self.assertEqual(response.status_code, 200)
+        workbook = openpyxl.load_workbook(io.BytesIO(response.content))
+        self.assertEqual(workbook.sheetnames, ['粮油类', '其他类'])
+        sheet = workbook['粮油类']
+        self.assertEqual((sheet['A1'].value, sheet['B2'].value, sheet['F2'].value), (DELIVERY_TITLE, '第一小学', str(self.deliver_date)))
+        self.assertEqual([cell.value for cell in sheet[3]], DELIVERY_HEADERS)
+        self.assertEqual([sheet['B4'].value, sheet['B5'].value, sheet['A6'].value, sheet['B6'].value],
+                         [self.goods[0].name, self.goods[1].name, '备注', '上午送达'])
+        self.assertEqual((sheet['A7'].value, sheet['D7'].value), ('送货人', '验收人'))
+        other = workbook['其他类']
+        self.assertEqual((other['A4'].value, other['B4'].value, other['G4'].value), (1, self.goods[2].name, '少盐'))
+
+    def test_no_pending_items(self):
+        create_order(self.school.id, self.goods[:1], self.cycle, status="6", deliver_date=self.deliver_date)
+
+        self.assertEqual(self.gendeliver().status_code, 204)
+
+    def test_rows_share_formats(self):
+        order = create_order(self.school.id, self.goods[:2], self.cycle, status="1", deliver_date=self.deliver_date)
+        small = self.gendeliver().content
+        OrderDetailModel.objects.filter(order=order).delete()
+        OrderDetailModel.objects.bulk_create([
+            OrderDetailModel(order=order, product_id=product.id, product_name=product.name, category='粮油类', funds='营养餐',
+                             price='12.50', order_quantity=1)
+            for product in self.goods
+        ])
+
+        with CaptureQueriesContext(connection) as ctx:
+            large = self.gendeliver().content
+
+        # 单元格格式个数和查询次数不随行数增长
+        self.assertEqual(count_cell_formats(small), count_cell_formats(large))
+        self.assertLessEqual(len(ctx.captured_queries), 4)
+
+
+@override_settings(OPERATE_LOG_ASYNC=False, CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class DailyFactTests(TestCase):
+    """
+    订单流转后日汇总表与订单详情保持一致，汇总查询按角色限制学校
+    """
+
+    def setUp(self):
+        self.company = AccountModel.objects.create_user(username='company', password='x', role='0')
+        self.school = AccountModel.objects.create_user(username='school', password='x', role='2')
+        self.other = AccountModel.objects.create_user(username='other', password='x', role='3')
+        self.cycle, self.goods = create_catalogue(2, self.company.id)
+        self.funds = FundsModel.objects.create(name='营养餐')
+        self.company_client = create_client(self.company)
+        self.school_client = create_client(self.school)
+        self.today = datetime.date.today()
+
+    def purchase(self, product, quantity, days):
+        cart = CartModel.objects.create(product=product, funds=self.funds, quantity=quantity, creater_id=self.school.id)
+        deliver_date = self.today + datetime.timedelta(days=days)
+        response = self.school_client.post('/api/cart/purchase/', {'cart_ids': [cart.id], 'deliver_date': str(deliver_date)}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return OrdersModel.objects.get(creater_id=self.school.id, deliver_date=deliver_date)
+
+    def summarize(self, client, **data):
+        data.update(start_date=str(self.today), end_date=str(self.today + datetime.timedelta(days=30)), group_by=[])
+        response = client.post('/api/orders/summary/', data, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data['data']
+
+    def test_facts_match_after_confirm_and_cancel(self):
+        order = self.purchase(self.goods[0], 3, 3)
+        for name in ('accept', 'ship', 'delivered'):
+            self.assertEqual(self.company_client.post(f'/api/orders/{order.id}/{name}/').status_code, 200)
+        detail = OrderDetailModel.objects.get(order=order)
+        response = self.company_client.post(f'/api/orders/{order.id}/confirm/',
+                                            {'recv': [{'id': detail.id, 'received_quantity': 2}]}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        cancelled = self.purchase(self.goods[1], 4, 4)
+        response = self.school_client.post(f'/api/orders/{cancelled.id}/cancel/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(OrdersModel.objects.filter(id=cancelled.id).exists())
+
+        call_command('rebuild_daily_facts', '--check', stdout=io.StringIO())
+
+    def test_summary_limits_schools_by_role(self):
+        self.purchase(self.goods[0], 3, 3)
+
+        self.assertEqual(self.summarize(self.company_client, school_id=self.school.id)[0]['line_count'], 1)
+        self.assertEqual(self.summarize(self.school_client)[0]['line_count'], 1)
+        # 其他角色只能查询自己的汇总，传入school_id也不会生效
+        rows = self.summarize(create_client(self.other), school_id=self.school.id)
+        self.assertFalse(rows and rows[0]['line_count'])
+
+    def test_gentotal_keeps_exact_amount(self):
+        order = self.purchase(self.goods[0], 1, 3)
+        # 未收货的订单项按单价乘数量计算，精确合计为13.9910
+        OrderDetailModel.objects.filter(order=order).delete()
+        OrderDetailModel.objects.bulk_create([
+            OrderDetailModel(order=order, product_id=self.goods[0].id, product_name='商品', category='粮油类', funds=self.funds.name,
+                             price=price, order_quantity=quantity)
+            for price, quantity in (('3.33', '1.11'), ('2.21', '2.07'), ('2.86', '2.00'))
+        ])
+        refresh_order_facts([order.id])
+
+        response = self.company_client.post('/api/orders/gentotal/', {'funds_id': self.funds.id, 'cycle_id': self.cycle.id,
+                                                                      'status_list': ['0']}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Decimal(response.data['data']), Decimal('13.9910'))
+        # 响应中的金额为数字，与原来逐条累加的结果一致
+        self.assertEqual(json.loads(response.content)['data'], 13.991)
+
+    def test_gentotal_response_format_of_received_orders(self):
+        order = self.purchase(self.goods[0], 2, 3)
+        OrdersModel.objects.filter(id=order.id).update(status="6")
+        OrderDetailModel.objects.filter(order=order).update(received_quantity=2, cost='25.00')
+        refresh_order_facts([order.id])
+
+        response = self.company_client.post('/api/orders/gentotal/', {'funds_id': self.funds.id, 'cycle_id': self.cycle.id,
+                                                                      'status_list': ['6']}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['data'], 25.0)
+        summary = self.summarize(self.company_client)[0]
+        self.assertEqual((summary['cost'], summary['amount']), (Decimal('25.00'), Decimal('25.0000')))
+
+
+@override_settings(OPERATE_LOG_ASYNC=False, CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class FundsZipTests(TestCase):
+    def setUp(self):
+        self.company = AccountModel.objects.create_user(username='company', password='x', role='0')
+        self.cycle, self.goods = create_catalogue(1, self.company.id)
+        self.deliver_date = datetime.date.today()
+
+    def create_school(self, username, first_name):
+        school = AccountModel.objects.create_user(username=username, password='x', role='2', first_name=first_name)
+        order = OrdersModel.objects.create(status="6", creater_id=school.id, deliver_date=self.deliver_date, cycle=self.cycle, product_num=1, finish_num=1)
+        OrderDetailModel.objects.create(order=order, product_id=self.goods[0].id, product_name='商品', category='粮油类', funds='营养餐',
+                                        price='12.50', order_quantity=2, received_quantity=2, cost='25.00')
+        refresh_order_facts([order.id])
+        return school
+
+    def test_entry_names_are_unique_and_flat(self):
+        schools = [self.create_school('a', '第一小学'), self.create_school('b', '第一小学'), self.create_school('c', '城关/第二小学')]
+
+        day = str(self.deliver_date)
+        response = create_client(self.company).post('/api/orders/genfundszip/', {'start_date': day, 'end_date': day}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+            names = archive.namelist()
+        self.assertEqual(names, [f'{day}~{day}_{schools[0].id}_第一小学经费情况.docx', f'{day}~{day}_{schools[1].id}_第一小学经费情况.docx',
+                                 f'{day}~{day}_{schools[2].id}_城关_第二小学经费情况.docx'])
@@ -0,0 +1,102 @@
+import datetime
+
+from django.db import transaction
+
+from .facts import refresh_order_facts
+from .models import OrdersModel
+
+# 订单状态流转规则，以操作名为键：
+# from 允许流转的当前状态，to 目标状态，role 允许操作的角色，operation 操作日志中的操作名
+TRANSITIONS = {
+    "accept": {"from": ["0"], "to": "1", "role": "0", "operation": "接单"},
+    "ship": {"from": ["1"], "to": "2", "role": "0", "operation": "发货"},
+    "delivered": {"from": ["2"], "to": "3", "role": "0", "operation": "送达"},
+    "receive": {"from": ["3", "4", "5"], "to": "4", "role": "0", "operation": "确认收货"},
+    "argue": {"from": ["4"], "to": "5", "role": "2", "operation": "有异议"},
+    "agree": {"from": ["4", "5"], "to": "6", "role": "2", "operation": "订单完成"},
+    # 学校取消未接单的订单，订单先标记为撤销，商品放回购物车后删除
+    "cancel": {"from": ["0"], "to": "-1", "role": "2", "operation": "取消订单"},
+    # 粮油公司取消接单，订单回到未接单状态
+    "unaccept": {"from": ["1"], "to": "0", "role": "0", "operation": "取消订单"},
+}
+
+# 批量修改订单状态接口允许的目标状态，以目标状态为键
+BATCH_TRANSITIONS = {TRANSITIONS[name]["to"]: name for name in ["accept", "ship", "delivered", "argue", "agree"]}
+
+
+def transition_fields(name, user_id, now_time):
+    """
+    执行某个流转时需要同时修改的字段
+    """
+    fields = {"status": TRANSITIONS[name]["to"]}
+    # 接单时记录接单人和接单时间
+    if name == "accept":
+        fields["accepter_id"] = user_id
+        fields["accept_time"] = now_time
+    # 取消接单时清空接单人和接单时间
+    elif name == "unaccept":
+        fields["accepter_id"] = None
+        fields["accept_time"] = None
+    # 订单完成时记录完成时间
+    elif name == "agree":
+        fields["finish_time"] = now_time
+    return fields
+
+
+def transit(queryset, order_id, name, user_id, refresh_facts=True, **extra):
+    """
+    对单个订单执行流转，只有订单仍处于允许的状态时才会被修改，返回是否修改成功。
+    并发操作同一订单时只有一个请求能成功，不需要先查询订单状态，修改成功后刷新订单所在日期的日汇总。
+    流转后在同一事务中还会修改订单并自行刷新日汇总时，传入refresh_facts=False跳过刷新
+    """
+    rule = TRANSITIONS[name]
+    fields = transition_fields(name, user_id, datetime.datetime.now())
+    fields.update(extra)
+    try:
+        with transaction.atomic():
+            if queryset.filter(id=order_id, status__in=rule["from"]).update(**fields) != 1:
+                return False
+            # 订单状态是日汇总的维度之一
+            if refresh_facts:
+                refresh_order_facts([order_id])
+            return True
+    except (TypeError, ValueError):
+        return False
+
+
+def apply_transition(queryset, order_ids, name, user_id):
+    """
+    将queryset中的多个订单执行同一个流转，一次查询校验当前状态，一次条件更新修改状态。
+    返回 (成功的订单ID, 不存在的订单ID, 状态不允许流转的订单ID)
+    """
+    rule = TRANSITIONS[name]
+    missing = []
+    wrong_status = []
+    eligible = []
+
+    # 一次查询获取所有订单的当前状态
+    valid_ids = [int(order_id) for order_id in order_ids if str(order_id).isdigit()]
+    order_status = dict(queryset.filter(id__in=valid_ids).values_list('id', 'status'))
+    for order_id in order_ids:
+        if not str(order_id).isdigit() or int(order_id) not in order_status:
+            missing.append(order_id)
+        elif order_status[int(order_id)] not in rule["from"]:
+            wrong_status.append(order_id)
+        else:
+            eligible.append(int(order_id))
+    eligible = list(dict.fromkeys(eligible))
+
+    if not eligible:
+        return [], missing, wrong_status
+
+    now_time = datetime.datetime.now()
+    with transaction.atomic():
+        # 只修改仍处于允许状态的订单，校验后被其他请求修改了状态的订单不会被覆盖
+        count = OrdersModel.objects.filter(id__in=eligible, status__in=rule["from"]).update(**transition_fields(name, user_id, now_time))
+        success = eligible
+        if count != len(eligible):
+            changed = set(OrdersModel.objects.filter(id__in=eligible, status=rule["to"]).values_list('id', flat=True))
+            wrong_status.extend(order_id for order_id in eligible if order_id not in changed)
+            success = [order_id for order_id in eligible if order_id in changed]
+        refresh_order_facts(success)
+    return success, missing, wrong_status
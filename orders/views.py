@@ -1,16 +1,18 @@
 from io import BytesIO
 import datetime
-import pandas as pd
 from urllib.parse import quote
 import datetime
-import xlsxwriter
 import os
+import zipfile
 from decimal import Decimal
 
 from django.shortcuts import render
 from django.http import FileResponse, HttpResponse, StreamingHttpResponse
 from django.utils.encoding import escape_uri_path
 from django.conf import settings
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Round
 
 from rest_framework import viewsets
 from rest_framework import permissions
@@ -26,8 +28,15 @@ from account import permissions as mypermissions
 from account.models import AccountModel
 from utils import response as myresponse
 from goods.models import PriceCycleModel, CategoryModel
+from goods.prices import effective_price_subquery, get_effective_price, get_effective_prices
 from utils.func import is_valid_date
-from utils.logger import log_operate
+from utils.logger import log_operate, log_operate_bulk
+from utils.idempotency import idempotent
+from .facts import FACT_DIMENSIONS, order_fact_keys, refresh_daily_facts, summarize_daily_facts
+from .transitions import BATCH_TRANSITIONS, TRANSITIONS, apply_transition, transit
+from .delivery import collect_delivery_rows, render_delivery
+from .settlement import funds_breakdown, render_funds_settlement, school_funds_breakdown
+from .reports import REPORT_CHUNK_SIZE, REPORT_COLUMNS, REPORT_FORMATS, stream_report_csv, stream_report_ndjson, write_report_xlsx
 
 # Create your views here.
 
@@ -55,7 +64,27 @@ class CartViewset(myresponse.CustomModelViewSet):
         queryset = super().get_queryset()
         user_id = self.request.user.id
         queryset = queryset.filter(creater_id=user_id).order_by('id')
+
+        # 在查询中附带商品、类别、经费来源和当前价格，并计算每一项的总价，没有可用价格的商品价格记为0
+        price = Coalesce(effective_price_subquery(datetime.date.today(), 'product_id'), Value(0), output_field=DecimalField(max_digits=10, decimal_places=2))
+        queryset = queryset.select_related('product__category', 'funds').annotate(
+            price=price,
+            tolto_price=Round(ExpressionWrapper(F('price') * F('quantity'), output_field=DecimalField(max_digits=20, decimal_places=4)), 2)
+        )
         return queryset
+
+    # 购物车列表同时返回每个经费来源的商品总价
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        totals = queryset.order_by('funds_id').values('funds_id', 'funds__name').annotate(total=Sum('tolto_price'))
+        data = response.data['data']
+        totals = [{"funds_id": row['funds_id'], "funds": row['funds__name'], "total": round(float(row['total'] or 0), 2)} for row in totals]
+        if isinstance(data, dict):
+            data['totals'] = totals
+        else:
+            response.data['totals'] = totals
+        return response
     
     # PATCH方法时使用专用的序列化器
     def get_serializer_class(self):
@@ -65,6 +94,7 @@ class CartViewset(myresponse.CustomModelViewSet):
             return CartModelSerializer
         
     @action(methods=['post'], detail=False)
+    @idempotent
     def purchase(self, request):
         """
         购物车商品下单
@@ -108,18 +138,6 @@ class CartViewset(myresponse.CustomModelViewSet):
                                 "data": None,
                                 "code": status.HTTP_400_BAD_REQUEST}, status=status.HTTP_400_BAD_REQUEST)
         
-        # 失败列表，存储下单失败的商品的名字
-        fail_list = []
-
-        # 过期列表
-        expire_list = []
-
-        # 创建成功数，大于0则在失败时不删除订单
-        success = 0
-
-        # 商品ID列表
-        purchase_list = []
-
         # 获取送达日期对应的价格周期
         cycle = PriceCycleModel.objects.filter(start_date__lte=deliver_date, end_date__gte=deliver_date).order_by('-start_date').first()
         if not cycle:
@@ -127,87 +145,105 @@ class CartViewset(myresponse.CustomModelViewSet):
                                 "data": None,
                                 "code": status.HTTP_400_BAD_REQUEST}, status=status.HTTP_400_BAD_REQUEST)
 
-        # 创建订单实例
-        order, is_create = OrdersModel.objects.get_or_create(status=0, creater_id=user_id, deliver_date=deliver_date, cycle=cycle)
+        item_ids = {int(item) for item in item_list if str(item).isdigit()}
+        if any(not str(item).isdigit() for item in item_list):
+            return Response({"msg": "购物车项不存在，请刷新后重试",
+                                "data": None,
+                                "code": status.HTTP_400_BAD_REQUEST}, status=status.HTTP_400_BAD_REQUEST)
 
-        if is_create or order.note is None:
-            order.note = note
-        else:
-            order.note = order.note + ';' + note if note else order.note
-
-        cart_del_list = []
-        # 对每一个购物车项，创建一个订单详情实例，并关联在订单实例上
-        for item in item_list:
-            # 获取购物车项实例和对应商品实例
-            try:
-                cart = CartModel.objects.get(id=item, creater_id=user_id)
-            except:
-                if success == 0 and is_create:
-                    order.delete()
+        # 失败列表，存储下单失败的商品的名字
+        fail_list = []
+        # 过期列表，存储已下架的商品的名字
+        expire_list = []
+        # 已下架商品的购物车项
+        expire_carts = []
+        # 下单成功的购物车项
+        purchase_carts = []
+
+        with transaction.atomic():
+            # 锁定下单学校的账户行，同一学校的并发下单依次执行，避免重复创建订单或合并时丢失修改
+            AccountModel.objects.select_for_update().filter(id=user_id).first()
+
+            # 获得账户锁之后锁定并读取选中的购物车项，相同购物车项的重复下单只有第一个请求能读到购物车项。
+            # 只锁定购物车行，商品、类别和经费来源在第二次查询中读取，避免锁住其他学校共用的商品行
+            locked_ids = list(CartModel.objects.select_for_update().filter(id__in=item_ids, creater_id=user_id).values_list('id', flat=True))
+            if len(locked_ids) != len(item_ids):
                 return Response({"msg": "购物车项不存在，请刷新后重试",
                                     "data": None,
                                     "code": status.HTTP_400_BAD_REQUEST}, status=status.HTTP_400_BAD_REQUEST)
-            try:
+            carts = list(CartModel.objects.filter(id__in=locked_ids).select_related('product__category', 'funds').order_by('id'))
+
+            # 一次查询获取所有商品在送达日期的价格
+            prices = get_effective_prices([cart.product_id for cart in carts], deliver_date)
+
+            for cart in carts:
                 product = cart.product
-            except:
-                if success == 0 and is_create:
-                    order.delete()
-                return Response({"msg": "商品不存在，请刷新后重试",
-                                    "data": None,
-                                    "code": status.HTTP_400_BAD_REQUEST}, status=status.HTTP_400_BAD_REQUEST)
+                if not product.status:
+                    expire_list.append(product.name)
+                    expire_carts.append(cart.id)
+                elif cart.funds is None:
+                    fail_list.append(product.name)
+                else:
+                    purchase_carts.append(cart)
 
-            if product.status == 0:
-                expire_list.append(product.name)
-                cart.delete()
-                continue
-            # 获取商品当前的价格
-            price = product.prices.filter(status=2, start_date__lte=deliver_date, end_date__gte=deliver_date).order_by('-id').first()
-
-            # 获取商品用于生成订单详情的图片
-            image = product.image
-            if image:
-                detail_image_path = os.path.join('detail_image', 'goods', image.name.split('/')[-1])
-            else:
-                detail_image_path = None
-            
-            # 获取商品用于生成订单详情的资质
-            license = product.license
-            if license:
-                detail_license_path = os.path.join('detail_image', 'license', license.name.split('/')[-1])
+            # 下架商品的购物车项直接删除
+            if expire_carts:
+                CartModel.objects.filter(id__in=expire_carts).delete()
+
+            # 所有商品都无法下单，则不创建订单
+            if not purchase_carts:
+                order = None
             else:
-                detail_license_path = None
-
-            # 商品没有可用价格则下单失败，将商品名添加到失败列表中
-            # if not price:
-            #     fail_list.append(product.name)
-            #     continue
-
-            # 创建订单详情实例
-            try:
-                if not price:
-                    OrderDetailModel.objects.create(order=order, product_id=product.id, product_name=product.name, brand=product.brand,
-                                            description=product.description, category=product.category.name,
-                                            price=0, funds=cart.funds.name, order_quantity=cart.quantity, image=detail_image_path, license=detail_license_path, note=cart.note)
+                # 合并到同一送达日期待接单的订单，同时锁定该订单，避免合并过程中订单被接单
+                order = OrdersModel.objects.select_for_update().filter(status=0, creater_id=user_id, deliver_date=deliver_date, cycle=cycle).order_by('id').first()
+                is_create = order is None
+                if is_create:
+                    order = OrdersModel.objects.create(status=0, creater_id=user_id, deliver_date=deliver_date, cycle=cycle)
+
+                if is_create or order.note is None:
+                    order.note = note
                 else:
-                    OrderDetailModel.objects.create(order=order, product_id=product.id, product_name=product.name, brand=product.brand,
-                                            description=product.description, category=product.category.name,
-                                            price=price.price, funds=cart.funds.name, order_quantity=cart.quantity, image=detail_image_path, license=detail_license_path, note=cart.note)
-                success += 1
-                cart_del_list.append(cart)
-                purchase_list.append(product.id)
-            except:
-                fail_list.append(product.name)
-            # 下单后删除购物车项
-        
-
-        # 如果全失败，则删除创建的订单实例
-        if not order.details:
-            order.delete()
+                    order.note = order.note + ';' + note if note else order.note
+
+                # 对每一个购物车项，创建一个订单详情实例，并关联在订单实例上
+                details = []
+                for cart in purchase_carts:
+                    product = cart.product
+                    # 获取商品用于生成订单详情的图片和资质，没有可用价格的商品价格记为0
+                    detail_image_path = os.path.join('detail_image', 'goods', product.image.name.split('/')[-1]) if product.image else None
+                    detail_license_path = os.path.join('detail_image', 'license', product.license.name.split('/')[-1]) if product.license else None
+                    details.append(OrderDetailModel(order=order, product_id=product.id, product_name=product.name, brand=product.brand,
+                                                    description=product.description, category=product.category.name,
+                                                    price=prices.get(product.id) or 0, funds=cart.funds.name, order_quantity=cart.quantity,
+                                                    image=detail_image_path, license=detail_license_path, note=cart.note))
+                OrderDetailModel.objects.bulk_create(details)
+
+                # 添加订单的下单总数
+                order.product_num = F('product_num') + len(details)
+                order.save(update_fields=['note', 'product_num'])
+
+                # 下单后删除购物车项，删除的数量不一致说明购物车项已被其他请求处理，撤销本次下单
+                deleted, _ = CartModel.objects.filter(id__in=[cart.id for cart in purchase_carts]).delete()
+                if deleted != len(purchase_carts):
+                    transaction.set_rollback(True)
+                    return Response({"msg": "购物车项不存在，请刷新后重试",
+                                        "data": None,
+                                        "code": status.HTTP_400_BAD_REQUEST}, status=status.HTTP_400_BAD_REQUEST)
+
+                # 刷新送达日期的日汇总
+                refresh_daily_facts([(deliver_date, user_id)])
+
+        # 如果全失败，则返回失败的商品名
+        if order is None and fail_list:
             return Response({
                         "msg": "所有商品下单失败",
-                        "data": None,
+                        "data": fail_list,
                         "code": status.HTTP_400_BAD_REQUEST}, status=status.HTTP_400_BAD_REQUEST)
-        
+
+        if order is not None:
+            # 记录操作
+            log_operate(user_id, f"下单{order.id}，商品：{[cart.product_id for cart in purchase_carts]}")
+
         # 部分失败则返回失败的商品名
         if fail_list:
             return Response({
@@ -221,15 +257,6 @@ class CartViewset(myresponse.CustomModelViewSet):
                     "msg": "部分商品已下架,刷新以删除商品",
                     "data": expire_list,
                     "code": status.HTTP_200_OK}, status=status.HTTP_200_OK)
-        
-        # 添加订单的下单总数
-        order.product_num = order.details.count()
-        order.save()
-        for cart in cart_del_list:
-            cart.delete()
-
-        # 记录操作
-        log_operate(user_id, f"下单{order.id}，商品：{purchase_list}")
 
         # 返回响应
         return Response({"msg": "商品下单成功",
@@ -258,6 +285,15 @@ class OrdersViewset(viewsets.GenericViewSet,
         queryset = queryset.filter(creater_id=user_id).order_by(default_order_by)
         return queryset
 
+    def get_fact_queryset(self):
+        """
+        日汇总表的查询集，与get_queryset一致，教体局组和粮油公司组可查询所有学校，其他用户只能查询自己的汇总
+        """
+        queryset = DailyOrderFactModel.objects.all()
+        if self.request.user.role in ("0", "1"):
+            return queryset
+        return queryset.filter(school_id=self.request.user.id)
+
     def get_serializer_class(self):
         if self.action == 'partial_update':
             return OrderPatchSerializer
@@ -266,7 +302,7 @@ class OrdersViewset(viewsets.GenericViewSet,
     
     def get_permissions(self):       
         # 仅粮油公司组能进行接单、发货、送达操作
-        if self.action in ["accept", "ship", "delivered", "gendeliver", "genfunds", "gendeliverbycat", "destroy", "confirm"]:
+        if self.action in ["accept", "ship", "delivered", "gendeliver", "genfunds", "genfundszip", "gendeliverbycat", "destroy", "confirm"]:
             return [mypermissions.IsRole0()]
         elif self.action in ["argue", "agree"]:
             return [mypermissions.IsRole2()]
@@ -300,30 +336,86 @@ class OrdersViewset(viewsets.GenericViewSet,
         #     "code": status.HTTP_200_OK
         # }, status=status.HTTP_200_OK)
     
+    @action(methods=['post'], detail=False)
+    def transition(self, request, pk=None):
+        """
+        批量修改订单状态，传入订单ID列表和目标状态，流转规则与单个订单的接单、发货、送达、复核操作一致
+        """
+        order_ids = request.data.get("order_ids")
+        target = str(request.data.get("status"))
+
+        if not order_ids or not isinstance(order_ids, list):
+            return Response({
+                "msg": "请传入订单ID列表",
+                "data": None,
+                "code": status.HTTP_400_BAD_REQUEST
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        if target not in BATCH_TRANSITIONS:
+            return Response({
+                "msg": "目标状态错误",
+                "data": None,
+                "code": status.HTTP_400_BAD_REQUEST
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        # 检查当前用户是否有权限将订单修改为目标状态
+        name = BATCH_TRANSITIONS[target]
+        rule = TRANSITIONS[name]
+        if request.user.role != rule["role"]:
+            return Response({
+                "msg": "没有修改为该状态的权限",
+                "data": None,
+                "code": status.HTTP_403_FORBIDDEN
+            }, status=status.HTTP_403_FORBIDDEN)
+
+        success, missing, wrong_status = apply_transition(self.get_queryset(), order_ids, name, request.user.id)
+
+        # 记录操作
+        log_operate_bulk(request.user.id, [f"{rule['operation']}{order_id}" for order_id in success])
+
+        data = {
+            "count": len(success),
+            "success": success,
+            "missing": missing,
+            "wrong_status": wrong_status
+        }
+        if missing or wrong_status:
+            return Response({
+                "msg": "部分订单状态修改失败，请检查订单ID和订单状态",
+                "data": data,
+                "code": status.HTTP_200_OK
+            }, status=status.HTTP_200_OK)
+        return Response({
+            "msg": "订单状态修改成功",
+            "data": data,
+            "code": status.HTTP_200_OK
+        }, status=status.HTTP_200_OK)
+
+    def do_transition(self, pk, name, refresh_facts=True, **extra):
+        """
+        按流转规则修改单个订单的状态，修改失败且订单不存在时返回404
+        """
+        if transit(self.get_queryset(), pk, name, self.request.user.id, refresh_facts=refresh_facts, **extra):
+            return True
+        # 修改失败时才查询订单，订单不存在时抛出404
+        self.get_object()
+        return False
+
     @action(methods=['post'],detail=True)
     def accept(self, request, pk=None):
         """
         修改订单状态为1，表示订单已接单，并添加接单人和接单时间
         """
-        order = self.get_object()
-                
-        # 检查订单当前状态
-        if order.status != "0":
+        # 仅当订单处于未接单状态时接单，多人同时接单时只有一人能成功
+        if not self.do_transition(pk, "accept"):
             return Response({
                 "msg": "接单失败，请检查订单状态",
                 "data": None,
                 "code": status.HTTP_400_BAD_REQUEST
             }, status=status.HTTP_400_BAD_REQUEST)
-        
-        # 修改订单数据和状态
-        user_id = request.user.id
-        order.accepter_id = user_id
-        order.accept_time = datetime.datetime.now()
-        order.status = 1
-        order.save()
 
         # 记录操作
-        log_operate(user_id, f"接单{order.id}")
+        log_operate(request.user.id, f"接单{pk}")
 
         # 返回响应
         return Response({
@@ -337,22 +429,16 @@ class OrdersViewset(viewsets.GenericViewSet,
         """
         修改订单状态为2，表示订单已发货
         """
-        order = self.get_object()
-
-        # 检查订单当前状态
-        if order.status != "1":
+        # 仅当订单处于待发货状态时修改订单状态
+        if not self.do_transition(pk, "ship"):
             return Response({
                 "msg": "发货失败，请检查订单状态",
                 "data": None,
                 "code": status.HTTP_400_BAD_REQUEST
             }, status=status.HTTP_400_BAD_REQUEST)
-                
-        # 修改订单状态
-        order.status = 2
-        order.save()
 
         # 记录操作
-        log_operate(request.user.id, f"发货{order.id}")
+        log_operate(request.user.id, f"发货{pk}")
 
         # 返回响应
         return Response({
@@ -366,22 +452,16 @@ class OrdersViewset(viewsets.GenericViewSet,
         """
         修改订单状态为3，表示订单已送达
         """
-        order = self.get_object()
-
-        # 检查订单当前状态
-        if order.status != "2":
+        # 仅当订单处于配送中状态时修改订单状态
+        if not self.do_transition(pk, "delivered"):
             return Response({
                 "msg": "送达失败，请检查订单状态",
                 "data": None,
                 "code": status.HTTP_400_BAD_REQUEST
             }, status=status.HTTP_400_BAD_REQUEST)
-        
-        # 修改订单状态
-        order.status = 3
-        order.save()
 
         # 记录操作
-        log_operate(request.user.id, f"送达{order.id}")
+        log_operate(request.user.id, f"送达{pk}")
 
         # 反回响应
         return Response({
@@ -390,27 +470,21 @@ class OrdersViewset(viewsets.GenericViewSet,
             "code": status.HTTP_200_OK
         }, status=status.HTTP_200_OK)
     
-    @action(methods=['post'], detail=True)
+    @action(methods=['post'],detail=True)
     def argue(self, request, pk=None):
         """
         对收货情况有异议
         """
-        order = self.get_object()
-
-        # 检查订单当前状态
-        if order.status != "4":
+        # 仅当订单处于已收货待复核状态时修改订单状态
+        if not self.do_transition(pk, "argue"):
             return Response({
                 "msg": "复核失败，请检查订单状态",
                 "data": None,
                 "code": status.HTTP_400_BAD_REQUEST
             }, status=status.HTTP_400_BAD_REQUEST)
-        
-        # 修改订单状态
-        order.status = 5
-        order.save()
 
         # 记录操作
-        log_operate(request.user.id, f"有异议{order.id}")
+        log_operate(request.user.id, f"有异议{pk}")
 
         # 放回响应
         return Response({
@@ -419,28 +493,21 @@ class OrdersViewset(viewsets.GenericViewSet,
             "code": status.HTTP_200_OK
         }, status=status.HTTP_200_OK)
 
-    @action(methods=['post'], detail=True)
+    @action(methods=['post'],detail=True)
     def agree(self, request, pk=None):
         """
         对收货情况没有异议，订单结束
         """
-        order = self.get_object()
-
-        # 检查订单当前状态
-        if order.status != "4" and order.status != "5":
+        # 仅当订单处于已收货待复核或订单有疑问状态时完成订单，并记录完成时间
+        if not self.do_transition(pk, "agree"):
             return Response({
                 "msg": "复核失败，请检查订单状态",
                 "data": None,
                 "code": status.HTTP_400_BAD_REQUEST
             }, status=status.HTTP_400_BAD_REQUEST)
-        
-        # 修改订单状态
-        order.status = 6
-        order.finish_time = datetime.datetime.now()
-        order.save()
 
         # 记录操作
-        log_operate(request.user.id, f"订单完成{order.id}")
+        log_operate(request.user.id, f"订单完成{pk}")
 
         # 放回响应
         return Response({
@@ -450,18 +517,11 @@ class OrdersViewset(viewsets.GenericViewSet,
         }, status=status.HTTP_200_OK)
     
     @action(methods=['post'], detail=True)
+    @idempotent
     def confirm(self, request, pk=None):
         """
         对订单确认收货
         """
-        order = self.get_object()
-        if order.status not in ["3", "4", "5"]:
-            return Response({
-                "msg": f"当前订单状态为：{order.get_status_display()},无法进行收货操作",
-                "data": None,
-                "code": status.HTTP_400_BAD_REQUEST
-            }, status=status.HTTP_400_BAD_REQUEST)
-
         # err_list存储收货失败的订单详情号
         err_list = []
 
@@ -477,32 +537,54 @@ class OrdersViewset(viewsets.GenericViewSet,
                 "code": status.HTTP_400_BAD_REQUEST
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        for data in recv:
-            detail_id = data['id']
-            received_quantity = data['received_quantity']
-            try:
-                item = OrderDetailModel.objects.get(id=detail_id)
-                # 如果该订单详情不属于该订单，则加入错误列表
-                if item.order != order:
-                    raise ValueError
-                # 当该项之前未有过收货行为时，增加已收货条目数
-                if item.received_quantity is None:
-                    order.finish_num += 1
+        now_time = datetime.datetime.now()
+        with transaction.atomic():
+            # 锁定处于可收货状态的订单，同一订单的并发收货依次执行，保证已收货条目数准确
+            order = self.get_queryset().select_for_update().filter(id=pk, status__in=TRANSITIONS["receive"]["from"]).first()
+            if order is None:
+                order = self.get_object()
+                return Response({
+                    "msg": f"当前订单状态为：{order.get_status_display()},无法进行收货操作",
+                    "data": None,
+                    "code": status.HTTP_400_BAD_REQUEST
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            # 一次查询获取该订单下所有传入的订单详情，不属于该订单的订单详情不会被查出
+            detail_ids = [data.get('id') for data in recv if isinstance(data, dict) and str(data.get('id')).isdigit()]
+            details = OrderDetailModel.objects.filter(order=order, id__in=detail_ids).in_bulk()
+
+            # 待更新的订单详情，同一订单详情传入多次时以最后一次为准
+            update_dict = {}
+            for data in recv:
+                detail_id = data.get('id') if isinstance(data, dict) else data
+                try:
+                    item = details[int(detail_id)]
+                    received_quantity = Decimal(str(data['received_quantity'])).quantize(Decimal('0.01'))
+                    # 与模型 max_digits=10, decimal_places=2 保持一致
+                    if received_quantity.adjusted() >= 8:
+                        raise ValueError
+                except:
+                    err_list.append(detail_id)
+                    continue
                 # 更新收货数量和总计价格、时间
                 item.received_quantity = received_quantity
-                item.cost = float(received_quantity) * float(item.price)
+                item.cost = (received_quantity * item.price).quantize(Decimal('0.01'))
                 item.recipient_id = request.user.id
-                item.recipient_time = datetime.datetime.now()
-                item.save()
+                item.recipient_time = now_time
+                update_dict[item.id] = item
                 detail_list.append(detail_id)
-            except:
-                err_list.append(detail_id)
+            OrderDetailModel.objects.bulk_update(update_dict.values(), ['received_quantity', 'cost', 'recipient_id', 'recipient_time'])
 
+            # 已收货条目数为该订单中已有收货数量的订单详情数
+            finish_num = order.details.filter(received_quantity__isnull=False).count()
 
-        # 当已收货条目和待收获条目相等时，视为订单全部收货，修改订单状态为待复核
-        if order.finish_num == order.product_num:
-            order.status = 4
-        order.save()
+            # 当已收货条目和待收获条目相等时，视为订单全部收货，修改订单状态为待复核
+            # 流转时会刷新日汇总，未全部收货时收货金额仍有变化，需要单独刷新
+            if finish_num == order.product_num:
+                transit(OrdersModel.objects, order.id, "receive", request.user.id, finish_num=finish_num)
+            else:
+                OrdersModel.objects.filter(id=order.id).update(finish_num=finish_num)
+                refresh_daily_facts([(order.deliver_date, order.creater_id)])
 
         # 记录操作
         log_operate(request.user.id, f"确认收货{order.id}，订单详情：{detail_list}")
@@ -558,7 +640,7 @@ class OrdersViewset(viewsets.GenericViewSet,
                 queryset = queryset.filter(deliver_date__gte=start_date, deliver_date__lte=end_date).order_by('id')
         
         # 如果传入的school_id不是学校账户则返回错误
-        elif AccountModel.objects.filter(id=school_id).first().role != '2':
+        elif not AccountModel.objects.filter(id=school_id, role='2').exists():
             return Response({
                 "msg": "访问对象非学校",
                 "data": None,
@@ -579,6 +661,13 @@ class OrdersViewset(viewsets.GenericViewSet,
             # _end_date = datetime.datetime.strptime(end_date, "%Y-%m-%d") + datetime.timedelta(days=1)
             queryset = queryset.filter(deliver_date__gte=start_date, deliver_date__lte=end_date, creater_id=school_id).order_by('id')
 
+        report_format = request.data.get("format", "xlsx")
+        if report_format not in REPORT_FORMATS:
+            return Response({
+                "msg": "报表格式错误",
+                "data": None,
+                "code": status.HTTP_400_BAD_REQUEST
+            }, status=status.HTTP_400_BAD_REQUEST)
 
         # 如果查询结果为空，表示时间段内没有订单
         if not queryset.exists():
@@ -587,43 +676,25 @@ class OrdersViewset(viewsets.GenericViewSet,
                 "data": None,
                 "code": status.HTTP_400_BAD_REQUEST
             }, status=status.HTTP_400_BAD_REQUEST)
-        
-        # 制作表格数据
-        data = []
-        for order in queryset:
-            school_name = AccountModel.objects.get(id=order.creater_id).first_name
-            order_details = order.details.all()
-            for detail in order_details:
-                detail_data = {
-                    "商品编号": detail.product_id,
-                    "订单编号": order.id,
-                    "商品名称": detail.product_name,
-                    "商品规格": detail.description,
-                    "商品品牌": detail.brand,
-                    "商品种类": detail.category,
-                    "商品单价": detail.price,
-                    "经费来源": detail.funds,
-                    "订购数量": detail.order_quantity,
-                    "实收数量": detail.received_quantity,
-                    "总价": detail.cost,
-                    "下单时间": str(order.create_time).split(".")[0],
-                    "送货日期": str(order.deliver_date),
-                    "收货时间": str(detail.recipient_time).split(".")[0] if detail.recipient_time else None,
-                    "学校": school_name,
-                    "备注": detail.note
-                }
-                data.append(detail_data)
-
-        # 返回文件响应
-        df = pd.DataFrame(data)
-        file_name = f"{start_date}~{end_date}_订单报表.xlsx"
-
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = f'attachment; filename="{quote(file_name)}"'
-
-        with pd.ExcelWriter(response, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='Sheet1')
 
+        # 一次查询获取所有订单详情及其订单信息和学校名，按订单的顺序排列，分批从数据库读取
+        school_name = AccountModel.objects.filter(id=OuterRef('order__creater_id')).values('first_name')[:1]
+        order_by = ['order__' + field.lstrip('-') if not field.startswith('-') else '-order__' + field[1:] for field in queryset.query.order_by]
+        rows = (OrderDetailModel.objects.filter(order__in=queryset.order_by())
+                .annotate(school_name=Subquery(school_name))
+                .order_by(*order_by, 'id')
+                .values_list(*REPORT_COLUMNS.values())
+                .iterator(chunk_size=REPORT_CHUNK_SIZE))
+
+        file_name = f"{start_date}~{end_date}_订单报表.{report_format}"
+        if report_format == "xlsx":
+            return FileResponse(write_report_xlsx(rows), as_attachment=True, filename=file_name,
+                                content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        if report_format == "csv":
+            response = StreamingHttpResponse(stream_report_csv(rows), content_type='text/csv; charset=utf-8')
+        else:
+            response = StreamingHttpResponse(stream_report_ndjson(rows), content_type='application/x-ndjson; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="{quote(file_name)}"'
         return response
 
     @action(methods=['post'], detail=False)
@@ -667,193 +738,22 @@ class OrdersViewset(viewsets.GenericViewSet,
                 "code": status.HTTP_400_BAD_REQUEST
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # 制作表单数据
-        category_data = {}
-        count = {}
+        # 制作表单数据，粮油类单独一张表，其他类别合并为一张表
         categorys = ["粮油类", "其他类"]
-
-        # 为每个种类制作data列表
-        for category in categorys:
-            category_data[category] = []
-            count[category] = 1
-
-        # 制作备注
-        note_list = []
-
-        for order in queryset:
-            # 跳过已完成和未接单的订单
-            if order.status == '6' or order.status == '0':
-                continue
-            if order.note:
-                note_list.append(f"{order.note}")
-            details = order.details.all()
-            for detail in details:
-                category = "其他类" if detail.category != "粮油类" else "粮油类"
-
-                detail_data = []
-                detail_data.append(count[category])
-                count[category] += 1
-                detail_data.append(detail.product_name)
-                detail_data.append(detail.brand)
-                detail_data.append(detail.description)
-                detail_data.append(detail.order_quantity)
-                detail_data.append('')
-                detail_data.append(detail.note)
-                category_data[category].append(detail_data)
-
-        note = ";".join(note_list)
-        # data = []
-        # no = 1
-        # for order in queryset:
-        #     if order.status == '6':
-        #         continue
-        #     details = order.details.all()
-        #     for detail in details:
-        #         detail_data = []
-        #         detail_data.append(no)
-        #         no += 1
-        #         detail_data.append(detail.product_name)
-        #         detail_data.append(detail.brand)
-        #         detail_data.append(detail.description)
-        #         detail_data.append(detail.order_quantity)
-        #         detail_data.append('')
-        #         detail_data.append('')
-        #         data.append(detail_data)
-        
-        # 填充表格数据
-        # data1 = [
-        #     [1, '产品A', '品牌X', '规格1', '个', 100, 10, 1000, ''],
-        #     [2, '产品B', '品牌Y', '规格2', '盒', 50, 20, 1000, ''],
-        #     # 添加更多数据...
-        # ]
+        category_data, note = collect_delivery_rows(queryset, categorys, lambda category: "其他类" if category != "粮油类" else "粮油类")
 
         # 获取收货单位
         first_name = AccountModel.objects.get(id=school_id).first_name
-        
-        """
-        以下为生成表格样式
-        """
-        output = BytesIO()
 
-        workbook = xlsxwriter.Workbook(output, {"in_memory":True})
-
-        # 表示种类为空的数量，如果所有种类的数据都为空，表示所选时间没有要送的订单
-        empty_num = 0
-
-        # 遍历字典，为每个种类创建一个data列表，存储该种类下的订单详情信息，用于生成表格
-        for k, data in category_data.items():
-            if len(data) == 0:
-                empty_num += 1
-                continue
-            worksheet = workbook.add_worksheet(name=k)
-
-            # 设置列宽度
-            worksheet.set_column('A:G', 9)   # 单位列
-
-            # 合并单元格并添加标题
-            worksheet.set_row(0, 33)
-            worksheet.merge_range('A1:G1', '泸定县粮油购销有限责任公司配送清单', workbook.add_format({
-                'align': 'center', 
-                'valign': 'vcenter', 
-                'font_size': 18, 
-                'bold': True
-            }))
-
-            worksheet.set_row(1, 25)
-            worksheet.write('A2', '收货单位', workbook.add_format({
-                'align': 'center', 
-                'valign': 'vcenter', 
-                'font_size': 11, 
-            }))
-            worksheet.merge_range('B2:D2', first_name, workbook.add_format({
-                'align': 'center', 
-                'valign': 'vcenter', 
-                'font_size': 11, 
-            }))
-            worksheet.write('E2', '配送日期', workbook.add_format({
-                'align': 'center', 
-                'valign': 'vcenter', 
-                'font_size': 11, 
-            }))
-            worksheet.merge_range('F2:G2', deliver_date, workbook.add_format({
-                'align': 'center', 
-                'valign': 'vcenter', 
-                'font_size': 11, 
-            }))
-
-            # 添加表头
-            worksheet.set_row(2, 25)
-            headers = ['行号', '品名', '品牌', '规格', '预订数量', '实收数量', '备注']
-            worksheet.write_row('A3', headers, workbook.add_format({
-                'align': 'center', 
-                'valign': 'vcenter', 
-                'font_size': 11, 
-                'border': 1
-            }))
-
-            # 写入数据
-            row_start = 3
-            row_for_total = 0
-            for row, record in enumerate(data, start=row_start):
-                worksheet.set_row(row, 25)
-                worksheet.write_row(row, 0, record, workbook.add_format({
-                    'border': 1,
-                    'font_size': 11,
-                    'align': 'center',
-                    'valign': 'vcenter'
-                    }))
-                row_for_total = row
-
-            # 添加备注：
-            row_for_total += 1
-            worksheet.set_row(row_for_total, 25)
-            worksheet.write(f'A{row_for_total+1}', '备注', workbook.add_format({
-                'align': 'center', 
-                'valign': 'vcenter', 
-                'font_size': 11, 
-            }))
-            worksheet.merge_range(f'B{row_for_total+1}:G{row_for_total+1}', f'{note}', workbook.add_format({
-                'align': 'left', 
-                'valign': 'vcenter', 
-                'font_size': 11, 
-            }))
-            
-            # 添加额外信息
-            row_for_total += 1
-            worksheet.set_row(row_for_total, 25)
-            worksheet.write(f'A{row_for_total+1}', '送货人', workbook.add_format({
-                'align': 'center', 
-                'valign': 'vcenter', 
-                'font_size': 11, 
-            }))
-            worksheet.merge_range(f'B{row_for_total+1}:C{row_for_total+1}', '')
-
-            worksheet.write(f'D{row_for_total+1}', '验收人', workbook.add_format({
-                'align': 'center', 
-                'valign': 'vcenter', 
-                'font_size': 11, 
-            }))
-            # worksheet.merge_range(f'E{row_for_total+1}:F{row_for_total+1}', '')
-
-            worksheet.write(f'F{row_for_total+1}', '负责人', workbook.add_format({
-                'align': 'center', 
-                'valign': 'vcenter', 
-                'font_size': 11, 
-            }))
-            # worksheet.merge_range(f'H{row_for_total+1}:I{row_for_total+1}', '')
-
-        # 关闭Excel文件
-        workbook.close()
-
-        # 判单是否数据全为空
-        if len(category_data) == empty_num:
+        # 生成表格，如果所有种类的数据都为空，表示所选时间没有要送的订单
+        output = render_delivery(category_data, first_name, deliver_date, note)
+        if output is None:
             return Response({
                 "msg":"所选日期没有待送货物品",
                 "data":None,
                 "code":status.HTTP_204_NO_CONTENT
             }, status=status.HTTP_204_NO_CONTENT)
 
-        output.seek(0)
         response = HttpResponse(output, content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
         file_name = f"{first_name}_{deliver_date}_送货单.xlsx"
         response['Content-Disposition'] = f'attachment; filename="{quote(file_name)}"'
@@ -862,15 +762,6 @@ class OrdersViewset(viewsets.GenericViewSet,
 
     @action(methods=['post'], detail=False)
     def genfunds(self, request, pk=None):
-        from docx import Document
-        from docx.shared import Pt  # 用于设置字体大小
-        from docx.oxml.ns import qn  # 用于设置字体
-
-        # 定位模板文件
-        output = BytesIO()
-        template_path = os.path.join(settings.MEDIA_ROOT, 'funds_template.docx')
-        doc = Document(template_path)
-
         # 接收参数
         school_id = request.data.get("school_id")
         start_date = request.data.get("start_date")
@@ -915,119 +806,158 @@ class OrdersViewset(viewsets.GenericViewSet,
         
         # 获取学校名称
         school_name = school.first_name
-        
 
-        # 获取查询集
-        queryset = self.get_queryset()
-        queryset = queryset.filter(deliver_date__gte=start_date, deliver_date__lte=end_date, creater_id=school_id, status=6)
+        # 从日汇总表中按经费来源汇总已完成订单的总价
+        start_date = datetime.datetime.strptime(start_date, "%Y-%m-%d").strftime("%Y-%m-%d")
+        end_date = datetime.datetime.strptime(end_date, "%Y-%m-%d").strftime("%Y-%m-%d")
+        queryset = self.get_fact_queryset()
+        queryset = queryset.filter(day__gte=start_date, day__lte=end_date, school_id=school_id, status="6")
+        funds_dic = funds_breakdown(queryset)
 
-        if not queryset:
+        if not funds_dic:
             return Response({
                 "msg": "未查询到时间段内订单",
                 "data": None,
                 "code": status.HTTP_400_BAD_REQUEST
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        # 生成日期表示
-        start_date = datetime.datetime.strptime(start_date, "%Y-%m-%d")
-        end_date = datetime.datetime.strptime(end_date, "%Y-%m-%d")
-        start_date2 = start_date.strftime("%Y 年 %m 月 %d 日")
-        end_date2 = end_date.strftime("%Y 年 %m 月 %d 日")
-        start_date = start_date.strftime("%Y-%m-%d")
-        end_date = end_date.strftime("%Y-%m-%d")
-        date = f"{start_date2}  ------------ {end_date2}"
-
-        # 获取经费情况
-        funds_dic = {}
-        for order in queryset:
-            order_details = order.details.all()
-            for detail in order_details:
-                now_fund = detail.funds
-                funds_dic[now_fund] = funds_dic.get(now_fund, 0) + detail.cost
-        
-        total = 0
-        for k,v in funds_dic.items():
-            total += v
-
-        """
-        以下为生成docx
-        """
-        # 遍历文档中的所有表格
-        for table in doc.tables:
-            for row in table.rows:
-                if row.cells[0].text == "学校名称":
-                    row.cells[1].text = ''
-                    run = row.cells[1].paragraphs[0].add_run(school_name)
-                    run.font.name = '宋体'  # 设置字体
-                    run._element.rPr.rFonts.set(qn('w:eastAsia'), '宋体')  # 强制设置中文字体为宋体
-                    run.font.size = Pt(11)  # 设置字体大小为11号
-                if row.cells[0].text == "结算时间":
-                    row.cells[1].text = ''
-                    run = row.cells[1].paragraphs[0].add_run(date)
-                    run.font.name = '宋体'  # 设置字体
-                    run._element.rPr.rFonts.set(qn('w:eastAsia'), '宋体')  # 强制设置中文字体为宋体
-                    run.font.size = Pt(11)  # 设置字体大小为11号
-                if row.cells[0].text == "结算资金（元）":
-                    if row.cells[1].text == "以上四项合计金额：":
-                        res = row.cells[1].text + str(total)
-                        row.cells[1].text = ''
-                        run = row.cells[1].paragraphs[0].add_run(res)
-                        run.font.name = '宋体'  # 设置字体
-                        run._element.rPr.rFonts.set(qn('w:eastAsia'), '宋体')  # 强制设置中文字体为宋体
-                        run.font.size = Pt(11)  # 设置字体大小为11号
-                    else:
-                        # 使用经费字段名和模板进行匹配
-                        for k, v in funds_dic.items():
-                            if k in row.cells[1].text:
-                                res = row.cells[1].text + str(v)
-                                row.cells[1].text = ''
-                                run = row.cells[1].paragraphs[0].add_run(res)
-                                run.font.name = '宋体'  # 设置字体
-                                run._element.rPr.rFonts.set(qn('w:eastAsia'), '宋体')  # 强制设置中文字体为宋体
-                                run.font.size = Pt(11)  # 设置字体大小为11号
-        
-        doc.save(output)
-        output.seek(0)
+        output = render_funds_settlement(school_name, start_date, end_date, funds_dic)
         response = HttpResponse(output, content_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
         file_name = f"{start_date}~{end_date}_{school_name}经费情况.docx"
         response['Content-Disposition'] = f'attachment; filename={quote(file_name)}'
 
+        return response
+
+    @action(methods=['post'], detail=False)
+    def genfundszip(self, request, pk=None):
+        """
+        一次生成所有学校（或传入的学校）在一段时间内的经费结算单，打包为zip文件
+        """
+        school_ids = request.data.get("school_ids")
+        start_date = request.data.get("start_date")
+        end_date = request.data.get("end_date")
+
+        if not start_date or not end_date:
+            return Response({
+                "msg": "请传入起止时间",
+                "data": None,
+                "code": status.HTTP_400_BAD_REQUEST
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        if not is_valid_date(start_date) or not is_valid_date(end_date):
+            return Response({
+                "msg": "日期格式错误",
+                "data": None,
+                "code": status.HTTP_400_BAD_REQUEST
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        if school_ids is not None and (not isinstance(school_ids, list) or any(not str(school_id).isdigit() for school_id in school_ids)):
+            return Response({
+                "msg": "学校ID列表格式错误",
+                "data": None,
+                "code": status.HTTP_400_BAD_REQUEST
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        start_date = datetime.datetime.strptime(start_date, "%Y-%m-%d").strftime("%Y-%m-%d")
+        end_date = datetime.datetime.strptime(end_date, "%Y-%m-%d").strftime("%Y-%m-%d")
+
+        # 一次查询获取所有学校各经费来源的总价，一次查询获取学校名称
+        queryset = self.get_fact_queryset().filter(day__gte=start_date, day__lte=end_date, status="6")
+        if school_ids:
+            queryset = queryset.filter(school_id__in=school_ids)
+        breakdown = school_funds_breakdown(queryset)
+        schools = AccountModel.objects.filter(id__in=breakdown.keys(), role="2").order_by('id')
+
+        if not schools:
+            return Response({
+                "msg": "未查询到时间段内订单",
+                "data": None,
+                "code": status.HTTP_400_BAD_REQUEST
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        output = BytesIO()
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for school in schools:
+                document = render_funds_settlement(school.first_name, start_date, end_date, breakdown[school.id])
+                # 文件名带上学校ID避免重名学校互相覆盖，去掉名称中的路径分隔符避免在压缩包中生成目录
+                school_name = (school.first_name or "").replace("/", "_").replace("\\", "_")
+                archive.writestr(f"{start_date}~{end_date}_{school.id}_{school_name}经费情况.docx", document)
+
+        # 记录操作
+        log_operate(request.user.id, f"批量生成{start_date}~{end_date}经费结算单，学校：{[school.id for school in schools]}")
+
+        response = HttpResponse(output.getvalue(), content_type='application/zip')
+        file_name = f"{start_date}~{end_date}_经费情况.zip"
+        response['Content-Disposition'] = f'attachment; filename={quote(file_name)}'
 
         return response
-    
+
     @action(methods=['post'], detail=True)
     def cancel(self, request, pk=None):
         """
         用于取消订单。当学校用户取消订单时，仅能取消未接单的订单；当粮油公司取消订单时，仅能取消待发货的订单
         """
-        order = self.get_object()
-
         # 学校用户取消订单
         if self.request.user.role == "2":
-            if order.status != "0":
-                return Response({
-                    "msg": "订单已接单，无法取消",
-                    "data": None,
-                    "code": status.HTTP_400_BAD_REQUEST
-                }, status=status.HTTP_400_BAD_REQUEST)
+            user_id = request.user.id
+            with transaction.atomic():
+                # 先将未接单的订单标记为撤销，与接单同时发生时只有一个操作能成功
+                # 订单随后被删除并刷新日汇总，流转时不需要刷新
+                if not self.do_transition(pk, "cancel", refresh_facts=False):
+                    return Response({
+                        "msg": "订单已接单，无法取消",
+                        "data": None,
+                        "code": status.HTTP_400_BAD_REQUEST
+                    }, status=status.HTTP_400_BAD_REQUEST)
+
+                # 取消订单后将订单详情中的商品重新加入购物车
+                details = list(OrderDetailModel.objects.filter(order_id=pk).order_by('id'))
+                products = GoodsModel.objects.in_bulk({detail.product_id for detail in details})
+                funds_dict = {}
+                for funds in FundsModel.objects.filter(name__in={detail.funds for detail in details}).order_by('-id'):
+                    funds_dict[funds.name] = funds
+
+                # 相同人创建的相同商品和经费来源的购物车项，以(商品ID, 经费来源ID)为键
+                carts = {(cart.product_id, cart.funds_id): cart
+                         for cart in CartModel.objects.filter(creater_id=user_id, product_id__in=products.keys()).order_by('-id')}
+
+                # 商品或经费来源已被删除的订单详情无法放回购物车
+                skip_list = []
+                cart_update = {}
+                cart_create = {}
+                for detail in details:
+                    product = products.get(detail.product_id)
+                    funds = funds_dict.get(detail.funds)
+                    if product is None or funds is None:
+                        skip_list.append(detail.product_name)
+                        continue
+
+                    # 购物车中已有该商品和经费来源的项则累加数量，否则创建新的购物车项
+                    key = (product.id, funds.id)
+                    if key in carts:
+                        cart = carts[key]
+                        cart.quantity += detail.order_quantity
+                        cart_update[key] = cart
+                    elif key in cart_create:
+                        cart_create[key].quantity += detail.order_quantity
+                    else:
+                        cart_create[key] = CartModel(product=product, funds=funds, quantity=detail.order_quantity, creater_id=user_id, note=detail.note)
 
-            # 取消订单后将订单详情中的商品重新加入购物车
-            for detail in order.details.all():
-                product = GoodsModel.objects.get(id=detail.product_id)
-                funds = FundsModel.objects.get(name=detail.funds)
-                        
-                # 检查购物车中是否有相同人创建的相同的商品和经费来源的项，如果有，进行累加
-                existing_cart = CartModel.objects.filter(product=product, funds=funds, creater_id=order.creater_id).first()
-                if existing_cart:
-                    existing_cart.quantity += int(detail.order_quantity)
-                    existing_cart.save()
-                else:
-                    # 没有则创建新的购物车实例
-                    CartModel.objects.create(product=product, funds=funds, quantity=detail.order_quantity, creater_id=order.creater_id, note=detail.note)
+                CartModel.objects.bulk_update(cart_update.values(), ['quantity'])
+                CartModel.objects.bulk_create(cart_create.values())
+                fact_keys = order_fact_keys([pk])
+                OrdersModel.objects.filter(id=pk, status="-1").delete()
+                refresh_daily_facts(fact_keys)
 
             # 记录操作
-            log_operate(request.user.id, f"取消订单{order.id}")
-            order.delete() 
+            log_operate(request.user.id, f"取消订单{pk}")
+
+            if skip_list:
+                return Response({
+                    "msg": "订单取消成功，部分商品已不存在，未放回购物车",
+                    "data": skip_list,
+                    "code": status.HTTP_200_OK
+                }, status=status.HTTP_200_OK)
 
             return Response({
                 "msg": "订单取消成功",
@@ -1037,21 +967,16 @@ class OrdersViewset(viewsets.GenericViewSet,
 
 
         elif self.request.user.role == "0":
-            if order.status != "1":
+            # 仅当订单处于待发货状态时，将订单的状态设置为0，表示订单未接单，并清空接单人和接单时间
+            if not self.do_transition(pk, "unaccept"):
                 return Response({
                     "msg": "订单已发货，无法取消",
                     "data": None,
                     "code": status.HTTP_400_BAD_REQUEST
                 }, status=status.HTTP_400_BAD_REQUEST)
-            
-            # 将订单的状态设置为0，表示订单未接单
-            order.status = 0
-            order.accepter_id = None
-            order.accept_time = None
-            order.save()
 
             # 记录操作
-            log_operate(request.user.id, f"取消订单{order.id}")
+            log_operate(request.user.id, f"取消订单{pk}")
 
             return Response({
                 "msg": "订单取消接单成功",
@@ -1109,182 +1034,33 @@ class OrdersViewset(viewsets.GenericViewSet,
             }, status=status.HTTP_400_BAD_REQUEST)
         
         
-        # 制作表单数据
-        category_data = {}
-        count = {}
+        # 一次查询获取所有选中的商品种类
+        category_names = dict(CategoryModel.objects.filter(id__in=[category_id for category_id in category_list if str(category_id).isdigit()]).values_list('id', 'name'))
         categorys = []
-
         for category_id in category_list:
-            category = CategoryModel.objects.filter(id=category_id).first()
-            if not category:
+            if not str(category_id).isdigit() or int(category_id) not in category_names:
                 return Response({
                     "msg": f"id为{category_id}的商品种类不存在",
                     "data": None,
                     "code": status.HTTP_400_BAD_REQUEST
                 }, status=status.HTTP_400_BAD_REQUEST)
-            categorys.append(category.name)
-
-        # 为每个种类制作data列表
-        for category in categorys:
-            category_data[category] = []
-            count[category] = 1
-
-        # 制作备注
-        note_list = []
-
-        for order in queryset:
-            # 跳过已完成和未接单的订单
-            if order.status == '6' or order.status == '0':
-                continue
-            if order.note:
-                note_list.append(f"{order.note}")
-            details = order.details.all()
-            for detail in details:
-                category = detail.category
-                if category not in categorys:
-                    continue
+            categorys.append(category_names[int(category_id)])
 
-                detail_data = []
-                detail_data.append(count[category])
-                count[category] += 1
-                detail_data.append(detail.product_name)
-                detail_data.append(detail.brand)
-                detail_data.append(detail.description)
-                detail_data.append(detail.order_quantity)
-                detail_data.append('')
-                detail_data.append(detail.note)
-                category_data[category].append(detail_data)
-
-        note = ";".join(note_list)
-        
+        # 制作表单数据，每个种类一张表
+        category_data, note = collect_delivery_rows(queryset, categorys, lambda category: category)
 
         # 获取收货单位
         first_name = AccountModel.objects.get(id=school_id).first_name
-        
-        """
-        以下为生成表格样式
-        """
-        output = BytesIO()
 
-        workbook = xlsxwriter.Workbook(output, {"in_memory":True})
-
-        # 表示种类为空的数量，如果所有种类的数据都为空，表示所选时间没有要送的订单
-        empty_num = 0
-
-        # 遍历字典，为每个种类创建一个data列表，存储该种类下的订单详情信息，用于生成表格
-        for k, data in category_data.items():
-            if len(data) == 0:
-                empty_num += 1
-                continue
-            worksheet = workbook.add_worksheet(name=k)
-
-            # 设置列宽度
-            worksheet.set_column('A:G', 9)   # 单位列
-
-            # 合并单元格并添加标题
-            worksheet.set_row(0, 33)
-            worksheet.merge_range('A1:G1', '泸定县粮油购销有限责任公司配送清单', workbook.add_format({
-                'align': 'center', 
-                'valign': 'vcenter', 
-                'font_size': 18, 
-                'bold': True
-            }))
-
-            worksheet.set_row(1, 25)
-            worksheet.write('A2', '收货单位', workbook.add_format({
-                'align': 'center', 
-                'valign': 'vcenter', 
-                'font_size': 11, 
-            }))
-            worksheet.merge_range('B2:D2', first_name, workbook.add_format({
-                'align': 'center', 
-                'valign': 'vcenter', 
-                'font_size': 11, 
-            }))
-            worksheet.write('E2', '配送日期', workbook.add_format({
-                'align': 'center', 
-                'valign': 'vcenter', 
-                'font_size': 11, 
-            }))
-            worksheet.merge_range('F2:G2', deliver_date, workbook.add_format({
-                'align': 'center', 
-                'valign': 'vcenter', 
-                'font_size': 11, 
-            }))
-
-            # 添加表头
-            worksheet.set_row(2, 25)
-            headers = ['行号', '品名', '品牌', '规格', '预订数量', '实收数量', '备注']
-            worksheet.write_row('A3', headers, workbook.add_format({
-                'align': 'center', 
-                'valign': 'vcenter', 
-                'font_size': 11, 
-                'border': 1
-            }))
-
-            # 写入数据
-            row_start = 3
-            row_for_total = 0
-            for row, record in enumerate(data, start=row_start):
-                worksheet.set_row(row, 25)
-                worksheet.write_row(row, 0, record, workbook.add_format({
-                    'border': 1,
-                    'font_size': 11,
-                    'align': 'center',
-                    'valign': 'vcenter'
-                    }))
-                row_for_total = row
-
-            # 添加备注：
-            row_for_total += 1
-            worksheet.set_row(row_for_total, 25)
-            worksheet.write(f'A{row_for_total+1}', '备注', workbook.add_format({
-                'align': 'center', 
-                'valign': 'vcenter', 
-                'font_size': 11, 
-            }))
-            worksheet.merge_range(f'B{row_for_total+1}:G{row_for_total+1}', f'{note}', workbook.add_format({
-                'align': 'left', 
-                'valign': 'vcenter', 
-                'font_size': 11, 
-            }))
-            
-            # 添加额外信息
-            row_for_total += 1
-            worksheet.set_row(row_for_total, 25)
-            worksheet.write(f'A{row_for_total+1}', '送货人', workbook.add_format({
-                'align': 'center', 
-                'valign': 'vcenter', 
-                'font_size': 11, 
-            }))
-            worksheet.merge_range(f'B{row_for_total+1}:C{row_for_total+1}', '')
-
-            worksheet.write(f'D{row_for_total+1}', '验收人', workbook.add_format({
-                'align': 'center', 
-                'valign': 'vcenter', 
-                'font_size': 11, 
-            }))
-            # worksheet.merge_range(f'E{row_for_total+1}:F{row_for_total+1}', '')
-
-            worksheet.write(f'F{row_for_total+1}', '负责人', workbook.add_format({
-                'align': 'center', 
-                'valign': 'vcenter', 
-                'font_size': 11, 
-            }))
-            # worksheet.merge_range(f'H{row_for_total+1}:I{row_for_total+1}', '')
-
-        # 关闭Excel文件
-        workbook.close()
-
-        # 判单是否数据全为空
-        if len(category_data) == empty_num:
+        # 生成表格，如果所有种类的数据都为空，表示所选时间没有要送的订单
+        output = render_delivery(category_data, first_name, deliver_date, note)
+        if output is None:
             return Response({
                 "msg":"所选日期没有待送货物品",
                 "data":None,
                 "code":status.HTTP_204_NO_CONTENT
             }, status=status.HTTP_204_NO_CONTENT)
 
-        output.seek(0)
         response = HttpResponse(output, content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
         file_name = f"{first_name}_{deliver_date}_送货单.xlsx"
         response['Content-Disposition'] = f'attachment; filename="{quote(file_name)}"'
@@ -1292,6 +1068,7 @@ class OrdersViewset(viewsets.GenericViewSet,
         return response
 
     @action(methods=['post'], detail=True)
+    @idempotent
     def addproduct(self, request, pk =None):
         order = self.get_object()
 
@@ -1342,7 +1119,7 @@ class OrdersViewset(viewsets.GenericViewSet,
             }, status=status.HTTP_400_BAD_REQUEST)
         
         # 获取商品的价格
-        price = product.prices.filter(status=2, start_date__lte=order.deliver_date, end_date__gte=order.deliver_date).order_by('-id').first()
+        price = get_effective_price(product.id, order.deliver_date)
 
         # 获取商品用于生成订单详情的图片
         image = product.image
@@ -1358,26 +1135,20 @@ class OrdersViewset(viewsets.GenericViewSet,
         else:
             detail_license_path = None
 
-        # 创建订单详情
+        # 创建订单详情，并在同一事务中将订单商品数量加1
         try:
-            if not price:
-                OrderDetailModel.objects.create(order=order, product_id=product.id, product_name=product.name, brand=product.brand,
-                                        description=product.description, category=product.category.name,
-                                        price=0, funds=funds.name, order_quantity=quantity, image=detail_image_path, license=detail_license_path, note=note)
-            else:
+            with transaction.atomic():
                 OrderDetailModel.objects.create(order=order, product_id=product.id, product_name=product.name, brand=product.brand,
                                         description=product.description, category=product.category.name,
-                                        price=price.price, funds=funds.name, order_quantity=quantity, image=detail_image_path, license=detail_license_path, note=note)
+                                        price=price or 0, funds=funds.name, order_quantity=quantity, image=detail_image_path, license=detail_license_path, note=note)
+                OrdersModel.objects.filter(id=order.id).update(product_num=F('product_num') + 1)
+                refresh_daily_facts([(order.deliver_date, order.creater_id)])
         except:
             return Response({
                 "msg": "添加商品失败",
                 "data": None,
                 "code": status.HTTP_400_BAD_REQUEST
             }, status=status.HTTP_400_BAD_REQUEST)
-        
-        # 订单商品数量加1
-        order.product_num += 1
-        order.save()
 
         # 记录操作
         log_operate(request.user.id, f"添加商品{product.id}到订单{order.id}")
@@ -1399,7 +1170,9 @@ class OrdersViewset(viewsets.GenericViewSet,
         # 记录操作
         log_operate(self.request.user.id, f"删除订单{instance.id}")
 
-        return super().perform_destroy(instance)
+        with transaction.atomic():
+            super().perform_destroy(instance)
+            refresh_daily_facts([(instance.deliver_date, instance.creater_id)])
 
     def perform_update(self, serializer):
         if not is_valid_date(str(serializer.validated_data.get("deliver_date"))):
@@ -1425,16 +1198,80 @@ class OrdersViewset(viewsets.GenericViewSet,
         
         # 记录操作
         log_operate(self.request.user.id, f"修改订单{serializer.instance.id}送货日期为{serializer.validated_data.get('deliver_date')}")
-        return super().perform_update(serializer)
+
+        # 修改送货日期后，原日期和新日期的日汇总都需要刷新
+        old_key = (serializer.instance.deliver_date, serializer.instance.creater_id)
+        with transaction.atomic():
+            super().perform_update(serializer)
+            refresh_daily_facts([old_key, (serializer.instance.deliver_date, serializer.instance.creater_id)])
+
+    @action(methods=['post'], detail=False)
+    def summary(self, request, pk=None):
+        """
+        按日期范围从日汇总表查询订单的数量、金额和订单项个数，可按日期、学校、周期、类别、经费来源、状态分组
+        """
+        start_date = request.data.get("start_date")
+        end_date = request.data.get("end_date")
+        school_id = request.data.get("school_id")
+        cycle_id = request.data.get("cycle_id")
+        status_list = request.data.get("status_list")
+        group_by = request.data.get("group_by", ["day"])
+
+        if not start_date or not end_date:
+            return Response({
+                "msg": "请传入起止时间",
+                "data": None,
+                "code": status.HTTP_400_BAD_REQUEST
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        if not is_valid_date(start_date) or not is_valid_date(end_date):
+            return Response({
+                "msg": "日期格式错误",
+                "data": None,
+                "code": status.HTTP_400_BAD_REQUEST
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        if not isinstance(group_by, list) or any(field not in FACT_DIMENSIONS for field in group_by):
+            return Response({
+                "msg": f"分组字段只能为{FACT_DIMENSIONS}",
+                "data": None,
+                "code": status.HTTP_400_BAD_REQUEST
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = self.get_fact_queryset().filter(day__gte=start_date, day__lte=end_date)
+        if self.request.user.role in ("0", "1") and school_id:
+            queryset = queryset.filter(school_id=school_id)
+        if cycle_id:
+            queryset = queryset.filter(cycle_id=cycle_id)
+        if status_list:
+            queryset = queryset.filter(status__in=status_list)
+
+        return Response({
+            "msg": "获取成功",
+            "data": summarize_daily_facts(queryset, list(dict.fromkeys(group_by))),
+            "code": status.HTTP_200_OK
+        }, status=status.HTTP_200_OK)
 
     @action(methods=['post'], detail=False)
     def gentotal(self, request, pk=None):
+        """
+        统计周期内特定经费和状态的订单费用，传入group_by时按学校、经费来源、状态等维度分组统计
+        """
         school_id = request.data.get("school_id")
         funds_id = request.data.get("funds_id")
         cycle_id = request.data.get("cycle_id")
         status_list = request.data.get("status_list")
-        
-        if not funds_id:
+        group_by = request.data.get("group_by")
+
+        if group_by is not None and (not isinstance(group_by, list) or any(field not in FACT_DIMENSIONS for field in group_by)):
+            return Response({
+                "msg": f"分组字段只能为{FACT_DIMENSIONS}",
+                "data": None,
+                "code": status.HTTP_400_BAD_REQUEST
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        # 分组统计时经费来源可以不传，此时统计所有经费来源
+        if not funds_id and not group_by:
             return Response({
                 "msg": "未选择经费来源",
                 "data": None,
@@ -1455,35 +1292,61 @@ class OrdersViewset(viewsets.GenericViewSet,
                 "code": status.HTTP_400_BAD_REQUEST
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # 获取查询集
-        queryset = self.get_queryset()
+        # 从日汇总表中查询，不再逐个订单详情累加
+        queryset = self.get_fact_queryset()
 
-        if self.request.user.role != "2" and school_id:
-            queryset = queryset.filter(creater_id=school_id)
+        if self.request.user.role in ("0", "1") and school_id:
+            queryset = queryset.filter(school_id=school_id)
 
-        queryset = queryset.filter(cycle=cycle_id, status__in=status_list)
+        queryset = queryset.filter(cycle_id=cycle_id, status__in=status_list)
 
-        if not queryset:
+        funds = None
+        if funds_id:
+            funds = FundsModel.objects.filter(id=funds_id).first()
+            if not funds:
+                return Response({
+                    "msg": "经费来源不存在",
+                    "data": None,
+                    "code": status.HTTP_400_BAD_REQUEST
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+        # 分组统计，一次查询返回所有分组的费用
+        if group_by:
+            if funds is not None:
+                queryset = queryset.filter(funds=funds.name)
+            group_by = list(dict.fromkeys(group_by))
+            rows = list(queryset.values(*group_by).annotate(total=Sum('amount')).order_by(*group_by))
+            if not rows:
+                return Response({
+                    "msg": "未找到对应订单",
+                    "data": None,
+                    "code": status.HTTP_404_NOT_FOUND
+                }, status=status.HTTP_404_NOT_FOUND)
+
+            # 按学校分组时附带学校名称
+            if "school_id" in group_by:
+                names = dict(AccountModel.objects.filter(id__in={row["school_id"] for row in rows}).values_list('id', 'first_name'))
+                for row in rows:
+                    row["school_name"] = names.get(row["school_id"])
+
+            return Response({
+                "msg": "获取成功",
+                "data": rows,
+                "code": status.HTTP_200_OK
+            }, status=status.HTTP_200_OK)
+
+        # 一次聚合同时判断是否存在订单和统计所选经费来源的费用，有总价时按总价计算，否则按单价乘数量计算
+        result = queryset.aggregate(line_count=Sum('line_count'), total=Sum('amount', filter=Q(funds=funds.name)))
+        if not result['line_count']:
             return Response({
                 "msg": "未找到对应订单",
                 "data": None,
                 "code": status.HTTP_404_NOT_FOUND
             }, status=status.HTTP_404_NOT_FOUND)
-        
-        total = 0
-
-        for order in queryset:
-            for detail in order.details.all():
-                if detail.funds == FundsModel.objects.filter(id=funds_id).first().name:
-                    # total += detail.cost if detail.cost else Decimal(detail.price) * Decimal(detail.order_quantity)
-                    if detail.cost is not None:
-                        total += detail.cost
-                    else:
-                        total += Decimal(detail.price) * Decimal(detail.order_quantity)
-        
+
         return Response({
             "msg": "获取成功",
-            "data": total,
+            "data": result['total'] or 0,
             "code": status.HTTP_200_OK
         }, status=status.HTTP_200_OK)
         
@@ -1525,22 +1388,23 @@ class OrderDetailsViewset(viewsets.GenericViewSet,
                     "code": status.HTTP_400_BAD_REQUEST
                 }, status=status.HTTP_400_BAD_REQUEST)
             
-        # 删除时，将order的product_num减少1
-        order_obj.product_num -= 1
-        if instance.received_quantity:
-            order_obj.finish_num -= 1
-        order_obj.save()
+        detail_id = instance.id
+        with transaction.atomic():
+            # 删除时，将order的product_num减少1，已收货的订单详情同时将finish_num减少1
+            OrdersModel.objects.filter(id=order_obj.id).update(
+                product_num=F('product_num') - 1,
+                finish_num=F('finish_num') - (1 if instance.received_quantity is not None else 0)
+            )
+            super().perform_destroy(instance)
+
+            # 如果订单详情的商品数量为0，则删除订单
+            order_deleted = OrdersModel.objects.filter(id=order_obj.id, product_num__lte=0).delete()[0]
+            refresh_daily_facts([(order_obj.deliver_date, order_obj.creater_id)])
 
         # 记录操作
-        log_operate(self.request.user.id, f"删除订单号{order_obj.id}的订单详情{instance.id}")
-
-        # 如果订单详情的商品数量为0，则删除订单
-        if order_obj.product_num == 0:
-            order_obj.delete()
-            # 记录操作
+        log_operate(self.request.user.id, f"删除订单号{order_obj.id}的订单详情{detail_id}")
+        if order_deleted:
             log_operate(self.request.user.id, f"删除订单{order_obj.id}")
-        
-        return super().perform_destroy(instance)
     
     # @action(methods=['post'], detail=True)
     # def confirm(self, request, pk=None):
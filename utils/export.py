@@ -0,0 +1,121 @@
+from io import BytesIO
+
+import xlsxwriter
+
+# 导出表格使用的样式，以样式名为键，每个工作簿中每种样式只创建一次
+STYLES = {
+    # 送货单
+    "title": {'align': 'center', 'valign': 'vcenter', 'font_size': 18, 'bold': True},
+    "label": {'align': 'center', 'valign': 'vcenter', 'font_size': 11},
+    "note": {'align': 'left', 'valign': 'vcenter', 'font_size': 11},
+    "header": {'align': 'center', 'valign': 'vcenter', 'font_size': 11, 'border': 1},
+    "cell": {'align': 'center', 'valign': 'vcenter', 'font_size': 11, 'border': 1},
+    # 询价单
+    "ask_title": {'align': 'center', 'valign': 'vcenter', 'font_size': 16},
+    "ask_header": {'align': 'center', 'valign': 'vcenter', 'font_size': 12, 'border': 1, 'bold': True},
+    "ask_cell": {'align': 'center', 'valign': 'vcenter', 'font_size': 12, 'border': 1},
+    "ask_sign": {'align': 'left', 'valign': 'vcenter', 'font_size': 12},
+}
+
+
+class WorkbookFormats:
+    """
+    工作簿的样式表，按样式名在第一次使用时创建格式对象，之后重复使用
+    """
+
+    def __init__(self, workbook):
+        self.workbook = workbook
+        self._formats = {}
+
+    def __getitem__(self, name):
+        if name is None:
+            return None
+        if name not in self._formats:
+            self._formats[name] = self.workbook.add_format(STYLES[name])
+        return self._formats[name]
+
+
+class SheetWriter:
+    """
+    按行向下写入工作表，提供标题、表头信息、表格、备注、签字等通用布局
+    """
+
+    def __init__(self, worksheet, formats, columns):
+        self.worksheet = worksheet
+        self.formats = formats
+        # 表格的列数，标题和备注合并到最后一列
+        self.columns = columns
+        # 下一个要写入的行号（从0开始）
+        self.row = 0
+
+    def skip(self, count=1):
+        self.row += count
+
+    def cells(self, cells, height=None):
+        """
+        写入一行，cells为 (值, 占用列数, 样式名) 的列表，占用多列时合并单元格，值为None时跳过该单元格
+        """
+        if height:
+            self.worksheet.set_row(self.row, height)
+        col = 0
+        for value, span, style in cells:
+            if span > 1:
+                self.worksheet.merge_range(self.row, col, self.row, col + span - 1, value if value is not None else '', self.formats[style])
+            elif value is not None:
+                self.worksheet.write(self.row, col, value, self.formats[style])
+            col += span
+        self.row += 1
+
+    def title(self, text, style="title", height=None):
+        """
+        标题，合并整行
+        """
+        self.cells([(text, self.columns, style)], height)
+
+    def table(self, headers, rows, header_style="header", cell_style="cell", header_height=None, row_height=None):
+        """
+        表头和数据行，所有数据行共用同一个格式对象
+        """
+        if header_height:
+            self.worksheet.set_row(self.row, header_height)
+        self.worksheet.write_row(self.row, 0, headers, self.formats[header_style])
+        self.row += 1
+        cell_format = self.formats[cell_style]
+        for record in rows:
+            if row_height:
+                self.worksheet.set_row(self.row, row_height)
+            self.worksheet.write_row(self.row, 0, record, cell_format)
+            self.row += 1
+
+    def note(self, label, text, label_style="label", text_style="note", height=None):
+        """
+        备注行，第一列为标签，其余列合并
+        """
+        self.cells([(label, 1, label_style), (text, self.columns - 1, text_style)], height)
+
+
+class XlsxExport:
+    """
+    在内存中生成xlsx文件，工作簿内的工作表共用同一份样式表
+    """
+
+    def __init__(self):
+        self.output = BytesIO()
+        self.workbook = xlsxwriter.Workbook(self.output, {'in_memory': True})
+        self.formats = WorkbookFormats(self.workbook)
+
+    def add_sheet(self, name, columns, widths=()):
+        """
+        添加工作表，widths为 (列范围, 宽度) 的列表
+        """
+        worksheet = self.workbook.add_worksheet(name)
+        for col_range, width in widths:
+            worksheet.set_column(col_range, width)
+        return SheetWriter(worksheet, self.formats, columns)
+
+    def close(self):
+        """
+        关闭工作簿，返回文件内容
+        """
+        self.workbook.close()
+        return self.output.getvalue()
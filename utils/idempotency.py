@@ -0,0 +1,80 @@
+import functools
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+# 请求头 Idempotency-Key
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+# 响应的保存时间（秒）
+IDEMPOTENCY_TTL = 60 * 60 * 24
+# 请求处理中标记的默认保存时间（秒），需不短于最慢请求的处理时间，否则第一次请求未结束时重试会再次执行。
+# 请求结束时标记会被替换为响应或删除，只有处理请求的进程异常退出时才会等到标记过期
+IN_PROGRESS_TTL = 60 * 30
+IN_PROGRESS = 'in_progress'
+
+
+def _in_progress_ttl():
+    return getattr(settings, 'IDEMPOTENCY_IN_PROGRESS_TTL', IN_PROGRESS_TTL)
+
+
+def _fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.md5(body.encode('utf-8')).hexdigest()
+
+
+def idempotent(view_func):
+    """
+    视图集action的装饰器，请求头带有Idempotency-Key时，相同用户使用相同键的重复请求直接返回第一次请求的响应，不会重复执行。
+    第一次请求仍在处理中时返回409，同一个键用于不同请求数据时返回422。服务器错误（5xx）的响应不会被保存。
+    装饰器在DRF认证之后执行，重复请求不会执行视图中的查询，但JWT认证仍会查询一次用户
+    """
+    @functools.wraps(view_func)
+    def wrapper(self, request, *args, **kwargs):
+        idempotency_key = request.META.get(IDEMPOTENCY_HEADER)
+        if not idempotency_key:
+            return view_func(self, request, *args, **kwargs)
+
+        key_hash = hashlib.md5(idempotency_key.encode('utf-8')).hexdigest()
+        cache_key = f'idempotency:{request.user.id}:{request.method}:{request.path}:{key_hash}'
+        fingerprint = _fingerprint(request)
+
+        # 写入处理中标记，写入失败说明已有相同键的请求
+        if not cache.add(cache_key, IN_PROGRESS, _in_progress_ttl()):
+            saved = cache.get(cache_key)
+            if saved is None or saved == IN_PROGRESS:
+                return Response({
+                    "msg": "相同的请求正在处理中，请稍后重试",
+                    "data": None,
+                    "code": status.HTTP_409_CONFLICT
+                }, status=status.HTTP_409_CONFLICT)
+            if saved['fingerprint'] != fingerprint:
+                return Response({
+                    "msg": "Idempotency-Key已用于其他请求",
+                    "data": None,
+                    "code": status.HTTP_422_UNPROCESSABLE_ENTITY
+                }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            response = Response(saved['data'], status=saved['status'])
+            response['Idempotent-Replayed'] = 'true'
+            return response
+
+        # 请求结束时显式释放处理中标记：出错时删除，成功时替换为响应
+        try:
+            response = view_func(self, request, *args, **kwargs)
+        except BaseException:
+            cache.delete(cache_key)
+            raise
+
+        if response.status_code >= 500:
+            cache.delete(cache_key)
+        else:
+            cache.set(cache_key, {
+                "fingerprint": fingerprint,
+                "status": response.status_code,
+                "data": response.data
+            }, IDEMPOTENCY_TTL)
+        return response
+    return wrapper
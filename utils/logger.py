@@ -1,4 +1,143 @@
+import atexit
+import datetime
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
 from orders.models import OrderLogModel
 
+logger = logging.getLogger('django')
+
+# 通知后台线程退出的标记
+_STOP = object()
+
+
+class BufferedLogWriter:
+    """
+    操作日志缓冲写入器。日志先放入进程内队列，由后台线程每积累batch_size条或每隔flush_interval毫秒批量写入一次，
+    进程退出时写入队列中剩余的日志
+    """
+
+    def __init__(self, batch_size=100, flush_interval=500):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval / 1000
+        self.queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def put(self, entry):
+        self._ensure_started()
+        self.queue.put(entry)
+
+    def _ensure_started(self):
+        # 多进程部署时在fork后的子进程中重新启动后台线程
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='operate-log-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            entry = self.queue.get()
+            if entry is _STOP:
+                return
+            batch = [entry]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            # 在时间间隔内尽量多取日志，取满一批或超时后写入
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    entry = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if entry is _STOP:
+                    stop = True
+                    break
+                batch.append(entry)
+            self._write(batch)
+            if stop:
+                return
+
+    def _write(self, batch):
+        try:
+            close_old_connections()
+            OrderLogModel.objects.bulk_create(batch, batch_size=self.batch_size)
+        except Exception:
+            logger.exception(f"操作日志写入失败，丢失{len(batch)}条日志")
+        finally:
+            # 后台线程的数据库连接不会被请求结束时的信号关闭，写入后主动关闭
+            if threading.current_thread() is self._thread:
+                connection.close()
+
+    def flush(self):
+        """
+        在当前线程中写入队列中所有未写入的日志
+        """
+        batch = []
+        while True:
+            try:
+                entry = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is not _STOP:
+                batch.append(entry)
+        if batch:
+            self._write(batch)
+
+    def shutdown(self, timeout=5):
+        """
+        等待后台线程写完已取出的日志，再写入队列中剩余的日志
+        """
+        thread = self._thread
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            self.queue.put(_STOP)
+            thread.join(timeout)
+        self.flush()
+
+
+_writer = BufferedLogWriter(
+    batch_size=getattr(settings, 'OPERATE_LOG_BATCH_SIZE', 100),
+    flush_interval=getattr(settings, 'OPERATE_LOG_FLUSH_INTERVAL', 500),
+)
+atexit.register(_writer.shutdown)
+
+
+def _is_async():
+    return getattr(settings, 'OPERATE_LOG_ASYNC', False)
+
+
 def log_operate(operator_id, operation):
-    OrderLogModel.objects.create(operator_id=operator_id, operation=operation)
\ No newline at end of file
+    # 操作时间为记录日志的时间，而不是写入数据库的时间
+    entry = OrderLogModel(operator_id=operator_id, operation=operation, operate_time=datetime.datetime.now())
+    if _is_async():
+        _writer.put(entry)
+    else:
+        entry.save()
+
+def log_operate_bulk(operator_id, operations):
+    now_time = datetime.datetime.now()
+    entries = [OrderLogModel(operator_id=operator_id, operation=operation, operate_time=now_time) for operation in operations]
+    if _is_async():
+        for entry in entries:
+            _writer.put(entry)
+    else:
+        OrderLogModel.objects.bulk_create(entries)
+
+def flush_operate_log():
+    """
+    立即写入所有缓冲中的操作日志
+    """
+    _writer.shutdown()